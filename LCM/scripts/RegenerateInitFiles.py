@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import glob
 import os.path
+import re
 
 omi_libdir = "<DSC_SCRIPT_PATH>"
 
@@ -8,10 +9,15 @@ script_dirs=[omi_libdir + "/2.4x-2.5x/Scripts",
              omi_libdir + "/2.6x-2.7x/Scripts",
              omi_libdir + "/3.x/Scripts"]
 
+# client.py imports providers on demand. __providers__ tells it which
+# modules define *_Marshall entry points without importing anything.
+marshall_re = re.compile(r'^def\s+(Test|Set|Get|Inventory)_Marshall\s*\(', re.M)
+
 for current_dir in script_dirs:
     out_init = "__all__="
     py_files = glob.glob(current_dir + "/*.py")
     py_files_basename = []
+    providers = []
     for current_file in py_files:
         current_basename = os.path.basename(current_file)
 
@@ -22,7 +28,10 @@ for current_dir in script_dirs:
             continue
 
         py_files_basename.append(current_basename[:-3])
+        if marshall_re.search(open(current_file).read()):
+            providers.append(current_basename[:-3])
 
-    out_init = out_init + str(py_files_basename)
+    out_init = out_init + str(py_files_basename) + "\n"
+    out_init = out_init + "__providers__=" + str(providers) + "\n"
     open(current_dir + "/__init__.py", "w").write(out_init)
         
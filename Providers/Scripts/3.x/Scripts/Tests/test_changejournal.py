@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import shutil
+import tempfile
+import time
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+os.chdir(os.path.join(ScriptsDir, '3.x'))
+nxFile = imp.load_source('nxFile', './Scripts/nxFile.py')
+nxFileLine = imp.load_source('nxFileLine', './Scripts/nxFileLine.py')
+changejournal = nxFile.changejournal
+
+
+class changejournalTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        # log warnings and errors only, whatever dsc.conf says
+        self.log_config = nxFile.nxDSCLog.LogConfig
+        nxFile.nxDSCLog.LogConfig = (2, {}, 2)
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal = changejournal.ChangeJournal(thread=False)
+        self.path = os.path.join(self.tmpdir, 'a')
+        self.write(self.path, 'a')
+
+    def tearDown(self):
+        nxFile.nxDSCLog.LogConfig = self.log_config
+        self.journal.close()
+        changejournal.Journal = None
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, data):
+        F = open(path, 'w')
+        F.write(data)
+        F.close()
+
+    def check(self, key, paths, result):
+        token = self.journal.begin(paths)
+        self.journal.remember(key, token, result)
+
+    def testRemembersUntilChanged(self):
+        self.assertTrue(self.journal.cached('k') is None)
+        self.check('k', [self.path], [0])
+        self.assertTrue(self.journal.cached('k') == [0] and self.journal.hits == 1)
+        self.write(self.path, 'b')
+        self.assertTrue(self.journal.cached('k') is None)
+
+    def testChangesThatInvalidate(self):
+        other = os.path.join(self.tmpdir, 'other')
+        self.write(other, 'other')
+        changes = (lambda: os.chmod(self.path, 0o600),
+                   lambda: os.rename(other, self.path),
+                   lambda: os.remove(self.path),
+                   lambda: self.write(self.path, 'new'))
+        for change in changes:
+            self.check('k', [self.path], [0])
+            change()
+            self.assertTrue(self.journal.cached('k') is None, change)
+            self.write(os.path.join(self.tmpdir, 'unrelated'), 'x')
+
+    def testOtherFilesDoNotInvalidate(self):
+        self.check('k', [self.path], [0])
+        self.write(os.path.join(self.tmpdir, 'unrelated'), 'x')
+        self.assertTrue(self.journal.cached('k') == [0])
+
+    def testChangeDuringTestIsNotRemembered(self):
+        token = self.journal.begin([self.path])
+        self.write(self.path, 'b')
+        self.journal.remember('k', token, [0])
+        self.assertTrue(self.journal.cached('k') is None)
+
+    def testRecheckDoesNotRevalidateOthers(self):
+        self.check('k1', [self.path], [0])
+        self.write(self.path, 'b')
+        self.check('k2', [self.path], [-1])
+        self.assertTrue(self.journal.cached('k1') is None)
+        self.assertTrue(self.journal.cached('k2') == [-1])
+
+    def testOverflowDropsEverything(self):
+        self.check('k', [self.path], [0])
+        self.journal.dispatch(changejournal.EVENT.pack(-1, changejournal.IN_Q_OVERFLOW, 0, 0))
+        self.assertTrue(self.journal.cached('k') is None and self.journal.overflows == 1)
+
+    def testMovedDirectories(self):
+        d = os.path.join(self.tmpdir, 'd', 'e')
+        os.makedirs(d)
+        path = os.path.join(d, 'f')
+        self.write(path, 'f')
+        self.check('k', [path], [0])
+        os.rename(d, d + '.old')
+        os.makedirs(d)
+        self.write(path, 'f')
+        self.assertTrue(self.journal.cached('k') is None)
+        # a parent of the watched directory moved: no event, but found out
+        self.check('k', [path], [0])
+        os.rename(os.path.join(self.tmpdir, 'd'), os.path.join(self.tmpdir, 'd.old'))
+        os.makedirs(d)
+        self.write(path, 'f')
+        self.assertTrue(self.journal.cached('k') is None)
+        self.check('k', [path], [0])
+        self.assertTrue(self.journal.cached('k') == [0])
+
+    def testUnwatchablePath(self):
+        token = self.journal.begin([os.path.join(self.tmpdir, 'missing', 'x')])
+        self.assertTrue(token is None)
+        self.journal.remember('k', token, [0])
+        self.assertTrue(self.journal.cached('k') is None)
+
+    def testReaderThread(self):
+        journal = changejournal.ChangeJournal()
+        try:
+            token = journal.begin([self.path])
+            journal.remember('k', token, [0])
+            self.write(self.path, 'b')
+            for i in range(100):
+                if journal.changes[journal.slots[self.path]]:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(journal.changes[journal.slots[self.path]] > 0)
+        finally:
+            journal.close()
+
+    def testProviders(self):
+        changejournal.Journal = self.journal
+        calls = []
+        def Test(*args):
+            calls.append(args[0])
+            return [0]
+        saved = nxFile.Test, nxFileLine.Test
+        nxFile.Test = nxFileLine.Test = Test
+        try:
+            args = (self.path, '', 'present', 'file', False, 'a', 'md5', False, 'follow', '', '', '')
+            self.assertTrue(nxFile.Test_Marshall(*args) == [0])
+            self.assertTrue(nxFile.Test_Marshall(*args) == [0])
+            self.assertTrue(nxFileLine.Test_Marshall(self.path, '', 'a') == [0])
+            self.assertTrue(nxFileLine.Test_Marshall(self.path, '', 'a') == [0])
+            self.assertTrue(len(calls) == 2)
+            self.write(self.path, 'b')
+            nxFile.Test_Marshall(*args)
+            nxFileLine.Test_Marshall(self.path, '', 'a')
+            self.assertTrue(len(calls) == 4)
+            # directories are always checked
+            args = (self.tmpdir, '', 'present', 'directory', False, '', 'md5', True, 'follow', '', '', '')
+            nxFile.Test_Marshall(*args)
+            nxFile.Test_Marshall(*args)
+            self.assertTrue(len(calls) == 6)
+        finally:
+            nxFile.Test, nxFileLine.Test = saved
+
+    def testJournalPaths(self):
+        link = os.path.join(self.tmpdir, 'link')
+        os.symlink(self.path, link)
+        self.assertTrue(nxFile.JournalPaths(link, '', 'present', 'file', 'root', '') == [link, self.path, '/etc/passwd'])
+        self.assertTrue(nxFile.JournalPaths(link, 'http://host/x', 'present', 'file', '', '') is None)
+        self.assertTrue(nxFile.JournalPaths(self.tmpdir, '', 'absent', 'directory', '', '') == [self.tmpdir])
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(changejournalTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import errno
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+protocol = imp.load_source('protocol', os.path.join(ScriptsDir, 'protocol.py'))
+
+# Providers the client under test serves, by module name.
+Providers = {
+    'nxTestSleep': """
+import time
+def Test_Marshall(Milliseconds):
+    time.sleep(Milliseconds / 1000.0)
+    return [0]
+""",
+    'nxTestEcho': """
+import protocol
+def Test_Marshall(Milliseconds):
+    return [0 if Milliseconds else 1]
+def Get_Marshall(Milliseconds):
+    return [0, {'Milliseconds': protocol.MI_Uint32(Milliseconds)}]
+def Set_Marshall(Milliseconds):
+    raise ValueError('bad value')
+""",
+    'nxTestChild': """
+import os
+import subprocess
+def Test_Marshall(Milliseconds):
+    p = subprocess.Popen(['sleep', str(Milliseconds / 1000.0)])
+    F = open('child.pid', 'w')
+    F.write(str(p.pid))
+    F.close()
+    return [p.wait()]
+def Get_Marshall(Milliseconds):
+    return [subprocess.call(['sleep', str(Milliseconds / 1000.0)], preexec_fn=os.setsid), {}]
+""",
+    'nxTestSafe': """
+import subprocess
+THREAD_SAFE = True
+def Test_Marshall(Milliseconds):
+    return [subprocess.call(['sleep', str(Milliseconds / 1000.0)])]
+""",
+}
+
+
+class Client(object):
+    """
+    A client.py process serving one end of a socketpair, as omiserver
+    starts it, and the requests and replies on the other end.
+    """
+
+    def __init__(self, path):
+        self.sock, theirs = socket.socketpair()
+        self.process = subprocess.Popen([sys.executable, path, str(theirs.fileno())], pass_fds=[theirs.fileno()],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        theirs.close()
+        self.reader = protocol.BufferedReader(self.sock)
+        self.writer = protocol.BufferedWriter(self.sock)
+
+    def close(self):
+        self.sock.close()
+        self.process.wait()
+
+    def negotiate(self, capabilities):
+        self.writer.sendall(struct.pack('@B', protocol.OP_NEGOTIATE) + protocol.LENGTH_CODEC.pack(capabilities))
+        self.writer.flush()
+        return struct.unpack('@iii', self.reader.recv(12))
+
+    def send(self, op, name, tag=None, **args):
+        if tag is not None:
+            self.writer.sendall(protocol.TAG_CODEC.pack(tag))
+        self.writer.sendall(struct.pack('@B', op))
+        protocol.write_string(self.writer, name)
+        protocol.write_values(self.writer, args)
+        self.writer.flush()
+
+    def reply(self, op=0, tagged=False):
+        """
+        Returns (tag, status, failure text or Get values) of the next reply.
+        """
+        tag = protocol.TAG_CODEC.unpack(self.reader.recv(protocol.TAG_CODEC.size))[0] if tagged else None
+        status = struct.unpack('@i', self.reader.recv(4))[0]
+        if status:
+            return tag, status, protocol.read_string(self.reader)
+        if op == 2:
+            return tag, status, protocol.read_values(self.reader)
+        return tag, status, None
+
+
+class clientTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        # an installed client, with the providers above in 3.x/Scripts
+        self.tmpdir = tempfile.mkdtemp()
+        client = open(os.path.join(ScriptsDir, 'client.py')).read()
+        client = client.replace('"<DSC_SCRIPT_PATH>"', repr(self.tmpdir))
+        client = client.replace('"<PYTHON_PID_DIR>"', repr(os.path.join(self.tmpdir, 'var')))
+        self.write('client.py', client)
+        for name in ('protocol.py', 'metrics.py'):
+            shutil.copy(os.path.join(ScriptsDir, name), self.tmpdir)
+        self.write('3.x/Scripts/__init__.py', '__providers__ = ' + repr(sorted(Providers)) + '\n')
+        for name, source in Providers.items():
+            self.write('3.x/Scripts/' + name + '.py', source)
+        self.environ = os.environ.pop('DSC_PYTHON_TRACE', None)
+        self.client = Client(os.path.join(self.tmpdir, 'client.py'))
+
+    def tearDown(self):
+        self.client.close()
+        if self.environ is not None:
+            os.environ['DSC_PYTHON_TRACE'] = self.environ
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, data):
+        path = os.path.join(self.tmpdir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        F = open(path, 'w')
+        F.write(data)
+        F.close()
+
+    def testSerialRequests(self):
+        c = self.client
+        c.send(0, 'nxTestEcho', Milliseconds=protocol.MI_Uint32(1))
+        self.assertTrue(c.reply() == (None, 0, None))
+        c.send(0, 'nxTestEcho', Milliseconds=protocol.MI_Uint32(0))
+        self.assertTrue(c.reply()[1:2] == (1,))
+        c.send(2, 'nxTestEcho', Milliseconds=protocol.MI_Uint32(7))
+        self.assertTrue(c.reply(2)[2]['Milliseconds'].value.value == 7)
+
+    def testSerialWhenNotNegotiated(self):
+        c = self.client
+        self.assertTrue(c.negotiate(0)[:2] == (0, 0))
+        c.send(0, 'nxTestEcho', Milliseconds=protocol.MI_Uint32(1))
+        self.assertTrue(c.reply() == (None, 0, None))
+
+    def testTaggedRepliesInCompletionOrder(self):
+        c = self.client
+        status, granted, workers = c.negotiate(protocol.CAPABILITY_TAGGED)
+        self.assertTrue(status == 0 and granted == protocol.CAPABILITY_TAGGED and workers >= 3)
+        start = time.time()
+        c.send(0, 'nxTestSleep', 1, Milliseconds=protocol.MI_Uint32(500))
+        c.send(0, 'nxTestSleep', 2, Milliseconds=protocol.MI_Uint32(500))
+        c.send(2, 'nxTestEcho', 3, Milliseconds=protocol.MI_Uint32(3))
+        # another provider is not held up, the requests of one are serialized
+        tag, status, values = c.reply(2, True)
+        self.assertTrue(tag == 3 and status == 0 and values['Milliseconds'].value.value == 3)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertTrue(sorted([c.reply(0, True), c.reply(0, True)]) == [(1, 0, None), (2, 0, None)])
+        self.assertTrue(time.time() - start >= 1)
+
+    def timeout(self, seconds):
+        return {'__Timeout': protocol.MI_Uint32(seconds)}
+
+    def testTimeoutKillsOnlyItsChildren(self):
+        c = self.client
+        c.negotiate(protocol.CAPABILITY_TAGGED)
+        start = time.time()
+        c.send(0, 'nxTestSafe', 1, Milliseconds=protocol.MI_Uint32(2500))
+        c.send(0, 'nxTestChild', 2, Milliseconds=protocol.MI_Uint32(60000), **self.timeout(1))
+        self.assertTrue(c.reply(0, True) == (2, 2, 'Request timed out after 1 seconds'))
+        self.assertTrue(time.time() - start < 5)
+        pid = int(open(os.path.join(self.tmpdir, '3.x', 'child.pid')).read())
+        try:
+            os.kill(pid, 0)
+            self.fail('child %d of the timed out request is running' % pid)
+        except OSError as e:
+            self.assertTrue(e.errno == errno.ESRCH)
+        # the other request's child ran to the end, and the provider is free
+        self.assertTrue(c.reply(0, True) == (1, 0, None))
+        c.send(0, 'nxTestChild', 3, Milliseconds=protocol.MI_Uint32(0))
+        self.assertTrue(c.reply(0, True) == (3, 0, None))
+        # a child that calls setsid itself is killed as well
+        c.send(2, 'nxTestChild', 4, Milliseconds=protocol.MI_Uint32(60000), **self.timeout(1))
+        self.assertTrue(c.reply(2, True)[:2] == (4, 2))
+        self.assertTrue(time.time() - start < 10)
+
+    def testStuckRequestFailsItsProvider(self):
+        c = self.client
+        start = time.time()
+        c.send(0, 'nxTestSleep', Milliseconds=protocol.MI_Uint32(4000), **self.timeout(1))
+        self.assertTrue(c.reply() == (None, 2, 'Request timed out after 1 seconds'))
+        c.send(0, 'nxTestSleep', Milliseconds=protocol.MI_Uint32(0))
+        self.assertTrue(c.reply() == (None, 2, 'Provider lock held by a timed out nxTestSleep request'))
+        c.send(0, 'nxTestEcho', Milliseconds=protocol.MI_Uint32(1))
+        self.assertTrue(c.reply() == (None, 0, None))
+        self.assertTrue(time.time() - start < 4)
+        time.sleep(4.5 - (time.time() - start))
+        c.send(0, 'nxTestSleep', Milliseconds=protocol.MI_Uint32(0))
+        self.assertTrue(c.reply() == (None, 0, None))
+
+    def testTaggedProviderException(self):
+        c = self.client
+        c.negotiate(protocol.CAPABILITY_TAGGED)
+        c.send(1, 'nxTestEcho', 5, Milliseconds=protocol.MI_Uint32(1))
+        tag, status, text = c.reply(1, True)
+        self.assertTrue(tag == 5 and status == 1 and 'bad value' in text, text)
+        c.send(0, 'nxTestEcho', 6, Milliseconds=protocol.MI_Uint32(1))
+        self.assertTrue(c.reply(0, True) == (6, 0, None))
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(clientTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
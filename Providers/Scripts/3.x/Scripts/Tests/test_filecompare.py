@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import io
+import sys
+import shutil
+import hashlib
+import tempfile
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+filecompare = imp.load_source('filecompare', os.path.join(ScriptsDir, 'filecompare.py'))
+
+
+class filecompareTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_file(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        F = open(path, 'wb')
+        F.write(data)
+        F.close()
+        return path
+
+    def testFilesEqual(self):
+        data = os.urandom(3 * 4096 + 17)
+        a = self.make_file('a', data)
+        b = self.make_file('b', data)
+        self.assertTrue(filecompare.files_equal(a, b, 4096))
+        self.assertTrue(filecompare.files_equal(a, b))
+        self.assertTrue(filecompare.files_equal(a, a))
+        for pos in (0, 4096, len(data) - 1):
+            changed = bytearray(data)
+            changed[pos] ^= 1
+            c = self.make_file('c', bytes(changed))
+            self.assertTrue(not filecompare.files_equal(a, c, 4096), str(pos))
+        self.assertTrue(not filecompare.files_equal(a, self.make_file('d', data[:-1])))
+        e = self.make_file('e', b'')
+        self.assertTrue(filecompare.files_equal(e, self.make_file('f', b'')))
+        self.assertRaises((IOError, OSError), filecompare.files_equal, a, os.path.join(self.tmpdir, 'missing'))
+
+    def testStreamsOfDifferentLength(self):
+        self.assertTrue(filecompare.streams_equal(io.BytesIO(b'abc'), io.BytesIO(b'abc'), 2))
+        self.assertTrue(not filecompare.streams_equal(io.BytesIO(b'abcd'), io.BytesIO(b'abc'), 2))
+
+    def testDigestCache(self):
+        window = filecompare.RACY_WINDOW
+        filecompare.RACY_WINDOW = 0
+        try:
+            data = os.urandom(10000)
+            a = self.make_file('a', data)
+            b = self.make_file('b', data)
+            cache_path = os.path.join(self.tmpdir, 'cache', 'md5')
+            cache = filecompare.DigestCache(cache_path, hashlib.md5)
+            self.assertTrue(cache.files_equal(a, b))
+            self.assertTrue(cache.save() and not cache.dirty)
+            cache = filecompare.DigestCache(cache_path, hashlib.md5)
+            self.assertTrue(cache.files_equal(a, b))
+            self.assertTrue(cache.hits == 2 and cache.misses == 0, cache.stats())
+            self.assertTrue(cache.digest(a) == hashlib.md5(data).hexdigest())
+            F = open(b, 'r+b')
+            F.write(b'x')
+            F.close()
+            self.assertTrue(not cache.files_equal(a, b))
+            self.assertTrue(cache.misses == 1, cache.stats())
+            self.assertTrue(os.listdir(os.path.dirname(cache_path)) == ['md5'])
+            small = filecompare.DigestCache(cache_path, hashlib.md5, max_entries=1)
+            self.assertTrue(small.digest(a) == cache.digest(a))
+            small.digest(b)
+            self.assertTrue(len(small.entries) == 1 and small.get(os.stat(a)) is None)
+            self.assertTrue(filecompare.DigestCache(cache_path, hashlib.sha256).get(os.stat(a)) is None)
+        finally:
+            filecompare.RACY_WINDOW = window
+
+    def testRecentFilesAreNotCached(self):
+        a = self.make_file('a', b'data')
+        cache = filecompare.DigestCache(os.path.join(self.tmpdir, 'md5'), hashlib.md5)
+        cache.digest(a)
+        self.assertTrue(not cache.dirty and cache.get(os.stat(a)) is None)
+
+    def testFileDigest(self):
+        data = os.urandom(10000)
+        a = self.make_file('a', data)
+        self.assertTrue(filecompare.file_digest(a, hashlib.md5, 4096) == hashlib.md5(data).hexdigest())
+        self.assertTrue(filecompare.file_digest(self.make_file('e', b''), hashlib.md5) == hashlib.md5(b'').hexdigest())
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(filecompareTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import shutil
+import tempfile
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+identitycache = imp.load_source('identitycache', os.path.join(ScriptsDir, 'identitycache.py'))
+
+
+class identitycacheTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'passwd')
+        self.write('root:x:0:0\n')
+        self.now = 1000.0
+        self.clock = identitycache.clock
+        identitycache.clock = lambda: self.now
+        self.users = {0: 'root', 1000: 'joe'}
+        self.calls = []
+        self.db = identitycache.Database(self.path, self.by_id, self.by_name, ttl=300, negative_ttl=60, size=4)
+
+    def tearDown(self):
+        identitycache.clock = self.clock
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data):
+        F = open(self.path, 'w')
+        F.write(data)
+        F.close()
+
+    def by_id(self, uid):
+        self.calls.append(uid)
+        return (self.users[uid], 'x', uid)
+
+    def by_name(self, name):
+        self.calls.append(name)
+        for uid, n in self.users.items():
+            if n == name:
+                return (n, 'x', uid)
+        raise KeyError(name)
+
+    def testBothDirections(self):
+        self.assertTrue(self.db.lookup('id', 1000) == ('joe', 1000))
+        self.assertTrue(self.db.lookup('id', 1000) == ('joe', 1000))
+        self.assertTrue(self.db.lookup('name', 'joe') == ('joe', 1000))
+        self.assertTrue(self.calls == [1000] and self.db.hits == 2)
+        self.db.lookup('name', 'root')
+        self.db.lookup('id', 0)
+        self.assertTrue(self.calls == [1000, 'root', 0])
+
+    def testNegative(self):
+        self.assertRaises(KeyError, self.db.lookup, 'id', 5)
+        self.assertRaises(KeyError, self.db.lookup, 'id', 5)
+        self.assertTrue(self.calls == [5])
+        self.users[5] = 'new'
+        self.now += 61
+        self.assertTrue(self.db.lookup('id', 5) == ('new', 5))
+
+    def testTTL(self):
+        self.db.lookup('id', 1000)
+        self.users[1000] = 'renamed'
+        self.now += 299
+        self.assertTrue(self.db.lookup('id', 1000)[0] == 'joe')
+        self.now += 2
+        self.assertTrue(self.db.lookup('id', 1000)[0] == 'renamed')
+
+    def testChangedDatabase(self):
+        self.db.lookup('id', 1000)
+        self.users[1000] = 'renamed'
+        self.write('root:x:0:0\nrenamed:x:1000:1000\n')
+        self.assertTrue(self.db.lookup('id', 1000)[0] == 'joe')
+        self.now += identitycache.CHECK_INTERVAL
+        self.assertTrue(self.db.lookup('id', 1000)[0] == 'renamed')
+        self.users[1000] = 'again'
+        self.db.invalidate()
+        self.assertTrue(self.db.lookup('id', 1000)[0] == 'again')
+
+    def testBounded(self):
+        for uid in range(10):
+            self.users[uid] = 'u' + str(uid)
+            self.db.lookup('id', uid)
+        self.assertTrue(len(self.db.entries) == 4)
+        self.assertTrue(list(self.db.entries.keys())[-1] == ('name', 'u9'))
+
+    def testSystemDatabases(self):
+        self.assertTrue(identitycache.user_name(0) == 'root' and identitycache.user_id('root') == 0)
+        self.assertTrue(identitycache.group_id(identitycache.group_name(0)) == 0)
+        self.assertRaises(KeyError, identitycache.user_id, 'no such user here')
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(identitycacheTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
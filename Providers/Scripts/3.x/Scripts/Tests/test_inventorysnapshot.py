@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import shutil
+import tempfile
+import time
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+inventorysnapshot = imp.load_source('inventorysnapshot', os.path.join(ScriptsDir, 'inventorysnapshot.py'))
+
+
+class inventorysnapshotTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache', 'snapshot')
+        self.files = []
+        for i in range(50):
+            name = os.path.join(self.tmpdir, 'f' + str(i) + ('\xe9' if i % 7 == 0 else ''))
+            F = open(name, 'w')
+            F.write('x' * i)
+            F.close()
+            self.files.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def entries(self):
+        return [inventorysnapshot.make_entry(f, os.lstat(f), 'file', 'root', 'r\xf6\xf6t', 'ABC' * (i % 3))
+                for i, f in enumerate(self.files)]
+
+    def write(self, entries, taken=None):
+        writer = inventorysnapshot.Writer(self.path, taken or time.time())
+        for e in entries:
+            writer.add(e)
+        writer.finish().close()
+        writer.install()
+
+    def testRoundTrip(self):
+        entries = self.entries()
+        self.write(entries)
+        snapshot = inventorysnapshot.Snapshot(self.path)
+        try:
+            self.assertTrue(len(snapshot) == 50)
+            self.assertTrue(list(snapshot) == entries)
+            for e in entries:
+                self.assertTrue(snapshot.find(e[0]) == e)
+            self.assertTrue(snapshot.find(self.tmpdir) is None)
+        finally:
+            snapshot.close()
+
+    def testMissingOrDamaged(self):
+        self.assertTrue(len(inventorysnapshot.Snapshot(self.path)) == 0)
+        self.write(self.entries())
+        size = os.path.getsize(self.path)
+        F = open(self.path, 'r+b')
+        F.truncate(size - 1)
+        F.close()
+        snapshot = inventorysnapshot.Snapshot(self.path)
+        self.assertTrue(len(snapshot) == 0 and snapshot.find(self.files[0]) is None and not list(snapshot))
+
+    def testAbort(self):
+        self.write(self.entries()[:5])
+        writer = inventorysnapshot.Writer(self.path, time.time())
+        writer.add(self.entries()[10])
+        writer.abort()
+        self.assertTrue(os.listdir(os.path.dirname(self.path)) == ['snapshot'])
+        self.assertTrue(len(inventorysnapshot.Snapshot(self.path)) == 5)
+
+    def testUnchanged(self):
+        entry = self.entries()[3]
+        self.write([entry], time.time() + inventorysnapshot.RACY_WINDOW + 1)
+        snapshot = inventorysnapshot.Snapshot(self.path)
+        self.assertTrue(snapshot.unchanged(entry, os.lstat(self.files[3])))
+        F = open(self.files[3], 'a')
+        F.write('y')
+        F.close()
+        self.assertTrue(not snapshot.unchanged(entry, os.lstat(self.files[3])))
+        snapshot.close()
+        # taken right after the file changed, its stat is not trusted
+        self.write([entry], time.time())
+        snapshot = inventorysnapshot.Snapshot(self.path)
+        self.assertTrue(not snapshot.unchanged(entry, os.lstat(self.files[3])))
+        snapshot.close()
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(inventorysnapshotTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
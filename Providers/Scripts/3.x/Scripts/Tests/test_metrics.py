@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import shutil
+import tempfile
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+metrics = imp.load_source('metrics', os.path.join(ScriptsDir, 'metrics.py'))
+
+
+class metricsTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dsc_python_client.metrics')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testHistogramBuckets(self):
+        h = metrics.Histogram((1, 10))
+        for v in (0.5, 1, 2, 10, 11, 50):
+            h.add(v)
+        self.assertTrue(h.counts == [2, 2, 2], repr(h.counts))
+        self.assertTrue(h.count == 6 and h.max == 50)
+
+    def testFlushWritesPhasesAndSizes(self):
+        m = metrics.Metrics(self.path)
+        timer = metrics.RequestTimer()
+        for phase in ('decode', 'dispatch', 'encode', 'send'):
+            timer.mark(phase)
+        m.add('Test', 'nxFile', timer, 100)
+        m.add('Test', 'nxFile', timer, 5000)
+        self.assertTrue(not os.path.exists(self.path))
+        self.assertTrue(m.flush())
+        lines = open(self.path).read().splitlines()
+        self.assertTrue(lines[0].startswith('# pid ' + str(os.getpid())))
+        names = [' '.join(l.split()[:4]) for l in lines[1:]]
+        for phase in ('decode', 'dispatch', 'encode', 'send', 'total'):
+            self.assertTrue('latency Test nxFile ' + phase in names, repr(names))
+        self.assertTrue(lines[-1].startswith('bytes Test nxFile count 2 sum 5100 max 5000 '), lines[-1])
+        self.assertTrue(not os.path.exists(self.path + '.tmp'))
+
+    def testAddFlushesAfterInterval(self):
+        m = metrics.Metrics(self.path, interval=0)
+        m.add('Get', 'nxService', metrics.RequestTimer())
+        self.assertTrue(os.path.exists(self.path))
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(metricsTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
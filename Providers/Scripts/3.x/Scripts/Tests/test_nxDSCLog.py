@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import shutil
+import tempfile
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+nxDSCLog = imp.load_source('nxDSCLog', os.path.join(ScriptsDir, 'nxDSCLog.py'))
+
+
+class nxDSCLogTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'log', 'dsc.log')
+
+    def tearDown(self):
+        nxDSCLog.flush_all()
+        nxDSCLog.Writers.pop(self.path, None)
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        F = open(self.path, 'rb')
+        data = F.read().decode('utf8')
+        F.close()
+        return data
+
+    def testLinesAreBufferedUntilFlush(self):
+        log = nxDSCLog.DSCLog(self.path)
+        log.Log('INFO', 'first')
+        log.Log('ERROR', 'second é')
+        self.assertTrue(not os.path.exists(self.path))
+        nxDSCLog.flush_all()
+        data = self.read()
+        self.assertTrue(': INFO: ' in data and data.index('first') < data.index('second é'), data)
+        self.assertTrue('test_nxDSCLog.py(' in data, data)
+
+    def testFlushesOnSize(self):
+        log = nxDSCLog.DSCLog(self.path)
+        message = 'x' * 1000
+        for i in range(nxDSCLog.FlushSize // len(message) + 1):
+            log.Log('INFO', message)
+        self.assertTrue(os.path.getsize(self.path) >= nxDSCLog.FlushSize)
+
+    def testReopensAfterRotation(self):
+        log = nxDSCLog.DSCLog(self.path)
+        log.Log('INFO', 'before')
+        nxDSCLog.flush_all()
+        os.rename(self.path, self.path + '.1')
+        log.Log('INFO', 'after')
+        nxDSCLog.flush_all()
+        self.assertTrue('after' in self.read() and 'before' not in self.read())
+
+    def testLevelsFromConfig(self):
+        conf = os.path.join(self.tmpdir, 'dsc.conf')
+        F = open(conf, 'w')
+        F.write('PROXY=http://proxy\nLogLevel = warning\nLogLevel.test_nxDSCLog=INFO\nLogLevel.nxPackage=4\n')
+        F.close()
+        config = nxDSCLog.read_log_config(conf)
+        self.assertTrue(config == (2, {'test_nxDSCLog': 3, 'nxPackage': 4}, 4), repr(config))
+        self.assertTrue(nxDSCLog.read_log_config(conf + '.missing') == (5, {}, 5))
+        saved = nxDSCLog.LogConfig
+        nxDSCLog.LogConfig = config
+        try:
+            calls = []
+            def message():
+                calls.append(1)
+                return 'expensive'
+            log = nxDSCLog.DSCLog(self.path)
+            log.Log('DEBUG', message)
+            log.Log('INFO', 'info line')
+            log.Log('INFO', message)
+            nxDSCLog.LogConfig = (2, {}, 2)
+            log.Log('INFO', message)
+            self.assertTrue(log.GetCurrentLogLevel() == 2)
+        finally:
+            nxDSCLog.LogConfig = saved
+        nxDSCLog.flush_all()
+        self.assertTrue(len(calls) == 1)
+        data = self.read()
+        self.assertTrue('info line' in data and data.count('expensive') == 1, data)
+
+    def testReloadKeepsWriters(self):
+        writer = nxDSCLog.get_writer(self.path)
+        imp.load_source('nxDSCLog', os.path.join(ScriptsDir, 'nxDSCLog.py'))
+        self.assertTrue(nxDSCLog.get_writer(self.path) is writer)
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(nxDSCLogTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
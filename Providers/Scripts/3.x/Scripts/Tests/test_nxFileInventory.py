@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import shutil
+import tempfile
+import itertools
+import time
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+os.chdir(os.path.join(ScriptsDir, '3.x'))
+nxFileInventory = imp.load_source('nxFileInventory', './Scripts/nxFileInventory.py')
+GetChecksum = nxFileInventory.GetChecksum
+
+
+class nxFileInventoryTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        # log warnings and errors only, whatever dsc.conf says
+        self.log_config = nxFileInventory.nxDSCLog.LogConfig
+        nxFileInventory.nxDSCLog.LogConfig = (2, {}, 2)
+        self.tmpdir = tempfile.mkdtemp()
+        nxFileInventory.SnapshotDir = os.path.join(self.tmpdir, 'snapshots')
+        self.top = os.path.join(self.tmpdir, 'top') + '/'
+        for d in ('a/b/c', 'x/y', 'outside'):
+            os.makedirs(os.path.join(self.tmpdir, 'top', d))
+        for d in ('', 'a/', 'a/b/', 'a/b/c/', 'x/', 'x/y/', 'outside/'):
+            self.write(self.top + d + 'f.txt', 'contents of ' + d)
+            self.write(self.top + d + 'g.bin', '')
+        os.symlink(self.top + 'a/f.txt', self.top + 'filelink')
+        os.symlink(self.top + 'a', self.top + 'x/y/loop')
+        os.symlink(self.top + 'x', self.top + 'a/b/dirlink')
+        os.symlink(self.top + 'missing', self.top + 'broken')
+
+    def tearDown(self):
+        nxFileInventory.nxDSCLog.LogConfig = self.log_config
+        nxFileInventory.HAVE_SCANDIR = hasattr(os, 'scandir')
+        nxFileInventory.helperlib.DscConf = None
+        nxFileInventory.ChecksumPoolMinSize = 65536
+        nxFileInventory.inventorysnapshot.RACY_WINDOW = 2
+        nxFileInventory.GetChecksum = GetChecksum
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, data):
+        F = open(path, 'w')
+        F.write(data)
+        F.close()
+
+    def inventory(self, scandir, *args):
+        nxFileInventory.HAVE_SCANDIR = scandir
+        return list(nxFileInventory.DoInventory(*args))
+
+    def testWalkersAgree(self):
+        paths = (self.top, self.top[:-1], self.top + '*', self.top + '*/*', self.top + '?/*.txt',
+                 self.top + 'a/*/*', self.top + 'filelink', self.top + 'a/f.txt')
+        for path, Links, Recurse, Type, Checksum in itertools.product(
+                paths, ('follow', 'manage', 'ignore'), (False, True), ('file', 'directory', '*'), ('md5', 'mtime')):
+            args = (path, Recurse, Links, Checksum, Type, 1024, 10485760, False)
+            walked = self.inventory(False, *args)
+            scanned = self.inventory(True, *args)
+            self.assertTrue(walked == scanned, args)
+
+    def testLoopsAreWalkedOnce(self):
+        paths = [d['DestinationPath'] for d in self.inventory(True, self.top, True, 'follow', 'mtime', '*', 1024, 10485760, False)]
+        self.assertTrue(self.top + 'x/y/loop' in paths and self.top + 'a/b/dirlink' in paths)
+        self.assertTrue(not [p for p in paths if '/loop/' in p or '/dirlink/' in p], paths)
+        self.assertTrue(len(paths) == len(set(paths)) == 24)
+
+    def testRecords(self):
+        d = self.inventory(True, self.top + 'filelink', False, 'manage', 'mtime', '*', 1024, 10485760, False)
+        self.assertTrue(len(d) == 1 and d[0]['Type'] == 'link' and d[0]['Contents'] == 'Symlink to ' + self.top + 'a/f.txt')
+        d = self.inventory(True, self.top + 'a/*.txt', False, 'follow', 'md5', 'file', 1024, 10485760, False)
+        self.assertTrue(len(d) == 1 and d[0]['Contents'] == 'contents of a/' and d[0]['FileSize'] == 14)
+
+    def testChecksumPool(self):
+        # files of both sizes, hashed in the walk and by the pool
+        nxFileInventory.ChecksumPoolMinSize = 1000
+        for i in range(300):
+            self.write(self.top + 'x/' + str(i), str(i) * i * (i % 2) * 100)
+        for Checksum in ('md5', 'sha-256'):
+            args = (self.top, True, 'follow', Checksum, '*', 1024, 10485760, False)
+            nxFileInventory.helperlib.DscConf = {'nxFileInventoryChecksumWorkers': '1'}
+            serial = self.inventory(True, *args)
+            nxFileInventory.helperlib.DscConf = {'nxFileInventoryChecksumWorkers': '3'}
+            pooled = self.inventory(True, *args)
+            self.assertTrue(len(serial) > nxFileInventory.ChecksumWindow * 3)
+            self.assertTrue(serial == pooled, Checksum)
+            # stopped early, the pool is shut down with the generator
+            it = nxFileInventory.DoInventory(*args)
+            self.assertTrue(next(it) == pooled[0])
+            it.close()
+
+    def testRateLimit(self):
+        limit = nxFileInventory.RateLimit(1000000)
+        start = time.time()
+        for i in range(5):
+            limit.take(50000)
+        # the first read goes at once, the next four wait 0.05s each
+        self.assertTrue(0.19 < time.time() - start < 1)
+        unlimited = nxFileInventory.RateLimit(0)
+        start = time.time()
+        unlimited.take(10 ** 9)
+        self.assertTrue(time.time() - start < 0.1)
+
+    def testSnapshotChecksums(self):
+        hashed = []
+        def Hash(fname, Checksum):
+            hashed.append(fname)
+            return GetChecksum(fname, Checksum)
+        nxFileInventory.GetChecksum = Hash
+        nxFileInventory.inventorysnapshot.RACY_WINDOW = 0
+        args = (self.top, True, 'follow', 'md5', '*', 1024, 10485760, False)
+        first = self.inventory(True, *args)
+        self.assertTrue(len(hashed) == 9)
+        # symlinks are hashed again, their targets may have changed
+        links = [self.top + 'broken', self.top + 'filelink']
+        self.assertTrue(self.inventory(True, *args) == first and sorted(hashed[9:]) == links)
+        self.write(self.top + 'x/f.txt', 'changed')
+        second = self.inventory(False, *args)
+        self.assertTrue(sorted(hashed[11:]) == links + [self.top + 'x/f.txt'])
+        self.assertTrue([d['DestinationPath'] for d in second if d not in first] == [self.top + 'x/f.txt'])
+        nxFileInventory.helperlib.DscConf = {'nxFileInventorySnapshot': 'false'}
+        self.assertTrue(self.inventory(True, *args) == second and len(hashed) == 23)
+
+    def testDelta(self):
+        nxFileInventory.helperlib.DscConf = {'nxFileInventoryDelta': 'true'}
+        args = (self.top, True, 'follow', 'mtime', '*', 1024, 10485760, False)
+        self.assertTrue(len(self.inventory(True, *args)) == 24)
+        self.assertTrue(self.inventory(True, *args) == [])
+        os.remove(self.top + 'a/b/g.bin')
+        self.write(self.top + 'a/new', 'new')
+        os.chmod(self.top + 'x/f.txt', 0o600)
+        # the change is reported until an inventory is read to the end
+        it = nxFileInventory.DoInventory(*args)
+        next(it)
+        it.close()
+        delta = dict([(d['DestinationPath'], d) for d in self.inventory(False, *args)])
+        # the link to 'a' is followed, it changed with 'a'
+        self.assertTrue(sorted(delta.keys()) == [self.top + p for p in ('a', 'a/b', 'a/b/g.bin', 'a/new', 'x/f.txt', 'x/y/loop')])
+        self.assertTrue(delta[self.top + 'a/b/g.bin']['Type'] == 'removed' and delta[self.top + 'a/new']['Type'] == 'file')
+        self.assertTrue(delta[self.top + 'x/f.txt']['Mode'] == '600' and delta[self.top + 'a/b/g.bin']['FileSize'] == 0)
+        self.assertTrue(self.inventory(True, *args) == [])
+
+    def listed(self, *args):
+        listed = []
+        scandir = os.scandir
+        def Scandir(path):
+            listed.append(path.rstrip('/')[len(self.top):])
+            return scandir(path)
+        os.scandir = Scandir
+        try:
+            paths = [d['DestinationPath'][len(self.top):] for d in self.inventory(True, *args)]
+        finally:
+            os.scandir = scandir
+        return sorted(paths), sorted(listed)
+
+    def testAnyDepth(self):
+        args = (self.top + '**/f.txt', False, 'manage', 'md5', '*', 1024, 10485760, False)
+        paths = ['a/b/c/f.txt', 'a/b/f.txt', 'a/f.txt', 'f.txt', 'outside/f.txt', 'x/f.txt', 'x/y/f.txt']
+        self.assertTrue(self.listed(*args)[0] == paths)
+        self.assertTrue(self.inventory(False, *args) == self.inventory(True, *args))
+        args = (self.top + '**/y', True, 'manage', 'mtime', 'directory', 1024, 10485760, False)
+        self.assertTrue(self.listed(*args)[0] == ['x/y'])
+        # nothing below x or outside can match, and only b below a
+        args = (self.top + '*/b/**/*.txt', False, 'manage', 'mtime', '*', 1024, 10485760, False)
+        self.assertTrue(self.listed(*args) == (['a/b/c/f.txt', 'a/b/f.txt'], ['', 'a/b', 'a/b/c']))
+        # through the links, each directory is walked once per state of the pattern
+        args = (self.top + '*/b/**/*.txt', False, 'follow', 'mtime', '*', 1024, 10485760, False)
+        paths = self.listed(*args)[0]
+        self.assertTrue('a/b/dirlink/f.txt' in paths and 'a/b/dirlink/y/loop/f.txt' in paths)
+        self.assertTrue(len(paths) == len(set(paths)) and not [p for p in paths if '/loop/b/' in p], paths)
+
+    def testLiteralComponents(self):
+        args = (self.top + '*/y/*.txt', False, 'manage', 'mtime', '*', 1024, 10485760, False)
+        self.assertTrue(self.listed(*args) == (['x/y/f.txt'], ['', 'x/y']))
+        self.assertTrue(self.inventory(False, *args) == self.inventory(True, *args))
+
+    def testExclude(self):
+        nxFileInventory.helperlib.DscConf = {'nxFileInventoryExclude': self.top + 'a/b, ' + self.top + 'outside',
+                                   'nxFileInventoryInclude': self.top + 'a/b/c/f.txt'}
+        args = (self.top, True, 'manage', 'mtime', '*', 1024, 10485760, False)
+        paths, listed = self.listed(*args)
+        self.assertTrue(paths == ['a', 'a/b/c/f.txt', 'a/f.txt', 'a/g.bin', 'broken', 'f.txt', 'filelink', 'g.bin',
+                                  'x', 'x/f.txt', 'x/g.bin', 'x/y', 'x/y/f.txt', 'x/y/g.bin', 'x/y/loop'], paths)
+        self.assertTrue('outside' not in listed and 'a/b/c' in listed)
+        self.assertTrue(self.inventory(False, *args) == self.inventory(True, *args))
+        self.assertTrue(self.inventory(True, self.top + 'outside/f.txt', *args[1:]) == [])
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(nxFileInventoryTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
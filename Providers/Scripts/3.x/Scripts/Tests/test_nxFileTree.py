@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import errno
+import shutil
+import tempfile
+import threading
+import time
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+os.chdir(os.path.join(ScriptsDir, '3.x'))
+nxFile = imp.load_source('nxFile', './Scripts/nxFile.py')
+
+
+class nxFileTreeTestCases(unittest2.TestCase):
+
+    def setUp(self):
+        # log warnings and errors only, whatever dsc.conf says
+        self.log_config = nxFile.nxDSCLog.LogConfig
+        nxFile.nxDSCLog.LogConfig = (2, {}, 2)
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'src')
+        self.dst = os.path.join(self.tmpdir, 'dst')
+        self.cache = nxFile.Md5Cache
+        nxFile.Md5Cache = nxFile.filecompare.DigestCache(os.path.join(self.tmpdir, 'md5'), nxFile.md5const)
+        for d in ('a', 'a/b', 'c'):
+            os.makedirs(os.path.join(self.src, d))
+            for f in ('x', 'y'):
+                self.write(os.path.join(self.src, d, f), d + f)
+        os.symlink('a/x', os.path.join(self.src, 'link'))
+
+    def tearDown(self):
+        nxFile.nxDSCLog.LogConfig = self.log_config
+        nxFile.HAVE_SCANDIR = hasattr(os, 'scandir')
+        nxFile.Md5Cache = self.cache
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, data):
+        F = open(path, 'w')
+        F.write(data)
+        F.close()
+
+    def context(self, SourcePath, Mode=''):
+        return nxFile.FileContext(self.dst, SourcePath, 'present', 'directory', False, '', 'md5',
+                                  True, 'manage', '', '', Mode)
+
+    def check(self, fc):
+        """
+        Tests through the per-file functions and the planner, which must agree.
+        """
+        nxFile.HAVE_SCANDIR = False
+        legacy = nxFile.TestDirectory(self.dst, fc.SourcePath, fc)
+        nxFile.HAVE_SCANDIR = True
+        planned = nxFile.TestDirectory(self.dst, fc.SourcePath, fc)
+        self.assertTrue(legacy == planned, (legacy, planned))
+        return planned
+
+    def actions(self, fc):
+        return [(action, os.path.relpath(dest, self.dst)) for action, dest, arg in
+                nxFile.PlanDirectory(self.dst, fc.SourcePath, fc).entries]
+
+    def testCreateTree(self):
+        fc = self.context(self.src)
+        self.assertTrue(self.check(fc) is False)
+        actions = self.actions(fc)
+        self.assertTrue(actions[0] == ('mkdir', '.'))
+        self.assertTrue(actions.index(('mkdir', 'a/b')) < actions.index(('create', 'a/b/x')))
+        self.assertTrue(('link', 'link') in actions and len(actions) == 11, actions)
+        self.assertTrue(nxFile.SetDirectoryRecursive(self.dst, self.src, fc))
+        self.assertTrue(self.check(fc) is True and self.actions(fc) == [])
+        self.assertTrue(os.readlink(os.path.join(self.dst, 'link')) == 'a/x')
+
+    def testPlanUpdates(self):
+        fc = self.context(self.src)
+        nxFile.SetDirectoryRecursive(self.dst, self.src, fc)
+        self.write(os.path.join(self.src, 'a/b/y'), 'changed')
+        self.write(os.path.join(self.src, 'c/z'), 'new')
+        os.chmod(os.path.join(self.dst, 'a/x'), 0o600)
+        os.chmod(os.path.join(self.src, 'c'), 0o700)
+        self.write(os.path.join(self.dst, 'extra'), 'kept')
+        self.assertTrue(self.check(fc) is False)
+        actions = sorted(self.actions(fc))
+        self.assertTrue(actions == [('chmod', 'a/x'), ('chmod', 'c'), ('create', 'c/z'), ('update', 'a/b/y')], actions)
+        self.assertTrue(len(nxFile.PlanDirectory(self.dst, self.src, fc, limit=1).entries) == 1)
+        self.assertTrue(nxFile.SetDirectoryRecursive(self.dst, self.src, fc))
+        self.assertTrue(self.check(fc) is True)
+        self.assertTrue(os.path.exists(os.path.join(self.dst, 'extra')))
+
+    def testPooledPlanMatchesSerial(self):
+        fc = self.context(self.src)
+        nxFile.SetDirectoryRecursive(self.dst, self.src, fc)
+        self.write(os.path.join(self.src, 'a/y'), 'changed')
+        os.chmod(os.path.join(self.dst, 'c/x'), 0o600)
+        pool = nxFile.ThreadPoolExecutor(4)
+        try:
+            pooled = nxFile.PlanDirectory(self.dst, self.src, fc, pool=pool).entries
+        finally:
+            pool.shutdown()
+        serial = nxFile.PlanDirectory(self.dst, self.src, fc).entries
+        self.assertTrue(pooled == serial and len(serial) == 2, (pooled, serial))
+
+    def testPooledFailureStops(self):
+        os.makedirs(self.dst)
+        plan = nxFile.TreePlan(self.context(self.src))
+        for name in ('1', '2', '3'):
+            plan.add('create', os.path.join(self.dst, name), os.path.join(self.src, 'a/x'))
+        plan.add('create', os.path.join(self.dst, 'missing'), os.path.join(self.src, 'missing'))
+        plan.add('mkdir', os.path.join(self.dst, 'after'), '')
+        pool = nxFile.ThreadPoolExecutor(2)
+        try:
+            self.assertTrue(nxFile.ExecutePlan(plan, pool) is False)
+        finally:
+            pool.shutdown()
+        self.assertTrue(sorted(os.listdir(self.dst)) == ['1', '2', '3'])
+
+    def testPooledExceptionWaitsForWorkers(self):
+        plan = nxFile.TreePlan(self.context(self.src))
+        for name in ('raises', 'slow'):
+            plan.add('create', name, '')
+        started = threading.Event()
+        done = []
+        def execute(plan, entry):
+            if entry[1] == 'raises':
+                started.wait()
+                raise ValueError(entry[1])
+            started.set()
+            time.sleep(0.3)
+            done.append(entry[1])
+        execute_entry = nxFile.ExecuteEntry
+        nxFile.ExecuteEntry = execute
+        pool = nxFile.ThreadPoolExecutor(2)
+        try:
+            self.assertRaises(ValueError, nxFile.ExecuteBatch, plan, plan.entries, pool)
+            self.assertTrue('slow' in done)
+        finally:
+            nxFile.ExecuteEntry = execute_entry
+            pool.shutdown()
+
+    def testModeIsNotFollowedThroughSwappedLink(self):
+        fc = self.context(self.src)
+        nxFile.SetDirectoryRecursive(self.dst, self.src, fc)
+        outside = os.path.join(self.tmpdir, 'outside')
+        self.write(outside, 'outside')
+        os.chmod(outside, 0o600)
+        fc = self.context('', '640')
+        plan = nxFile.PlanDirectory(self.dst, '', fc)
+        self.assertTrue(('chmod', os.path.join(self.dst, 'a/x'), '640') in plan.entries)
+        os.remove(os.path.join(self.dst, 'a/x'))
+        os.symlink(outside, os.path.join(self.dst, 'a/x'))
+        self.assertTrue(nxFile.ExecutePlan(plan))
+        self.assertTrue(oct(os.stat(outside).st_mode)[-3:] == '600')
+        self.assertTrue(oct(os.stat(os.path.join(self.dst, 'c/y')).st_mode)[-3:] == '640')
+
+    def testModeIsNotFollowedThroughSwappedDirectory(self):
+        fc = self.context(self.src)
+        nxFile.SetDirectoryRecursive(self.dst, self.src, fc)
+        outside = os.path.join(self.tmpdir, 'outside')
+        shutil.copytree(os.path.join(self.dst, 'a'), outside)
+        os.chmod(os.path.join(outside, 'x'), 0o600)
+        fc = self.context('', '640')
+        for swap in (lambda a: os.symlink(outside, a), lambda a: shutil.copytree(outside, a)):
+            plan = nxFile.PlanDirectory(self.dst, '', fc)
+            self.assertTrue(('chmod', os.path.join(self.dst, 'a/x'), '640') in plan.entries)
+            os.rename(os.path.join(self.dst, 'a'), os.path.join(self.tmpdir, 'old'))
+            swap(os.path.join(self.dst, 'a'))
+            self.assertTrue(nxFile.ExecutePlan(plan) is False)
+            self.assertTrue(oct(os.stat(os.path.join(outside, 'x')).st_mode)[-3:] == '600')
+            self.assertTrue(oct(os.lstat(os.path.join(self.dst, 'a/x')).st_mode)[-3:] == '600')
+            if os.path.islink(os.path.join(self.dst, 'a')):
+                os.remove(os.path.join(self.dst, 'a'))
+            else:
+                shutil.rmtree(os.path.join(self.dst, 'a'))
+            os.rename(os.path.join(self.tmpdir, 'old'), os.path.join(self.dst, 'a'))
+
+    def testDirFdsKeepsRecentDirectories(self):
+        dirs = nxFile.DirFds(size=2)
+        try:
+            fd = dirs.get(self.src)
+            self.assertTrue(dirs.get(self.src) == fd)
+            dirs.get(os.path.join(self.src, 'a'))
+            dirs.get(os.path.join(self.src, 'c'))
+            self.assertTrue(list(dirs.fds.keys()) == [os.path.join(self.src, 'a'), os.path.join(self.src, 'c')])
+        finally:
+            dirs.close()
+        self.assertTrue(not dirs.fds)
+
+    def testCopyFileReplaces(self):
+        os.makedirs(self.dst)
+        dest = os.path.join(self.dst, 'x')
+        self.write(dest, 'old')
+        os.link(dest, os.path.join(self.dst, 'old'))
+        source = os.path.join(self.src, 'a/x')
+        os.chmod(source, 0o640)
+        self.assertTrue(nxFile.CopyFile(source, dest) is None)
+        self.assertTrue(open(dest).read() == 'ax' and open(os.path.join(self.dst, 'old')).read() == 'old')
+        self.assertTrue(oct(os.stat(dest).st_mode)[-3:] == '640')
+        self.assertTrue(nxFile.CopyFile(source, dest, -1, -1, '600') is None)
+        self.assertTrue(oct(os.stat(dest).st_mode)[-3:] == '600')
+        self.assertTrue(sorted(os.listdir(self.dst)) == ['old', 'x'])
+        self.assertTrue(nxFile.CopyFile(os.path.join(self.src, 'missing'), dest) is not None)
+        self.assertTrue(sorted(os.listdir(self.dst)) == ['old', 'x'])
+
+    def testCopyFileRewritesBusyFile(self):
+        os.makedirs(self.dst)
+        dest = os.path.join(self.dst, 'x')
+        self.write(dest, 'old')
+        os.link(dest, os.path.join(self.dst, 'mounted'))
+        rename = os.rename
+        def busy(src, dst):
+            raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), dst)
+        os.rename = busy
+        try:
+            self.assertTrue(nxFile.CopyFile(os.path.join(self.src, 'a/x'), dest) is None)
+        finally:
+            os.rename = rename
+        # rewritten in place, where a mount over it would see it
+        self.assertTrue(open(os.path.join(self.dst, 'mounted')).read() == 'ax')
+        self.assertTrue(sorted(os.listdir(self.dst)) == ['mounted', 'x'])
+
+    def testCopyFdFallsBackToBuffer(self):
+        data = os.urandom(100000)
+        r, w = os.pipe()
+        os.makedirs(self.dst)
+        F = open(os.path.join(self.dst, 'x'), 'wb')
+        def write():
+            os.write(w, data)
+            os.close(w)
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            nxFile.CopyFd(r, F.fileno(), 0)
+        finally:
+            os.close(r)
+            writer.join()
+            F.close()
+        self.assertTrue(open(os.path.join(self.dst, 'x'), 'rb').read() == data)
+
+    def testTypeConflictIsAnError(self):
+        os.makedirs(self.dst)
+        self.write(os.path.join(self.dst, 'a'), 'not a directory')
+        fc = self.context(self.src)
+        self.assertTrue(('error', 'a') in self.actions(fc))
+        self.assertTrue(nxFile.SetDirectoryRecursive(self.dst, self.src, fc) is False)
+
+    def testModeWithoutSource(self):
+        fc = self.context(self.src)
+        nxFile.SetDirectoryRecursive(self.dst, self.src, fc)
+        fc = self.context('', '700')
+        self.assertTrue(self.check(fc) is False)
+        actions = self.actions(fc)
+        self.assertTrue(len(actions) == 10 and ('chmod', 'link') not in actions, actions)
+        self.assertTrue(nxFile.SetDirectoryRecursive(self.dst, '', fc))
+        self.assertTrue(self.check(fc) is True)
+        self.assertTrue(oct(os.stat(os.path.join(self.dst, 'a/b/x')).st_mode)[-3:] == '700')
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(nxFileTreeTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
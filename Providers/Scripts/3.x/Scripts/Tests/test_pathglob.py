@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import fnmatch
+import imp
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+pathglob = imp.load_source('pathglob', os.path.join(ScriptsDir, 'pathglob.py'))
+
+
+class pathglobTestCases(unittest2.TestCase):
+
+    def testNamesAsFnmatch(self):
+        names = ('a', 'ab', 'a.log', '.hidden', 'x[1]', 'a*b', 'A.LOG', '')
+        for pattern in ('*', 'a*', '*.log', '?', '[ab]*', '[!a]*', 'x[[]1]', 'a[*]b', '[', '*.LOG'):
+            match = pathglob.compile_name(pattern)
+            for name in names:
+                self.assertTrue((match(name) is not None) == fnmatch.fnmatch(name, pattern), (pattern, name))
+        self.assertTrue(pathglob.is_literal('app.log') and not pathglob.is_literal('app[0-9]'))
+
+    def testComponents(self):
+        g = pathglob.PathGlob('/var/log/*/app*.log')
+        self.assertTrue(g.match('/var/log/x/app1.log') and g.match('/var/log/x/app.log/'))
+        self.assertTrue(not g.match('/var/log/app.log') and not g.match('/var/log/x/y/app.log'))
+        # nothing below /var/log/x/app.log or /var/lib can match
+        self.assertTrue(g.below(g.states('/var/log/x')))
+        self.assertTrue(not g.below(g.states('/var/log/x/app.log')))
+        self.assertTrue(not g.states('/var/lib'))
+        self.assertTrue(g.names(g.states('/var')) == set(['log']) and g.names(g.states('/var/log')) is None)
+
+    def testAnyDepth(self):
+        g = pathglob.PathGlob('/var/**/*.log')
+        for path in ('/var/a.log', '/var/x/a.log', '/var/x/y/z/a.log', '/var/x.log/a.log'):
+            self.assertTrue(g.match(path), path)
+        self.assertTrue(not g.match('/var') and not g.match('/usr/a.log') and not g.match('/var/x/a.txt'))
+        g = pathglob.PathGlob('/a/**/**/b/**')
+        self.assertTrue(g.match('/a/b') and g.match('/a/x/b/y/z') and not g.match('/a/x'))
+        self.assertTrue(g.below(g.states('/a/x/y')))
+
+    def testFilter(self):
+        f = pathglob.PathFilter(pathglob.parse_list(' /proc, /var/cache/**/tmp ,'), ['/var/cache/app/tmp/keep*'])
+        self.assertTrue(f.skip('/proc') and f.skip('/proc/1/status') and not f.enter('/proc'))
+        self.assertTrue(not f.skip('/') and not f.skip('/procs') and f.enter('/var'))
+        self.assertTrue(f.skip('/var/cache/x/y/tmp') and not f.enter('/var/cache/x/y/tmp'))
+        self.assertTrue(f.skip('/var/cache/app/tmp') and f.enter('/var/cache/app/tmp'))
+        self.assertTrue(f.skip('/var/cache/app/tmp/other') and not f.skip('/var/cache/app/tmp/keep.1'))
+        self.assertTrue(not f.skip('/var/cache/app/tmp/keep.d/x'))
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(pathglobTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
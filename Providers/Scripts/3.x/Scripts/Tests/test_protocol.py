@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+import os
+import sys
+import ctypes
+import socket
+import threading
+import imp
+import io
+
+try:
+    import unittest2
+except:
+    import unittest as unittest2
+
+ScriptsDir = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../..'))
+protocol = imp.load_source('protocol', os.path.join(ScriptsDir, 'protocol.py'))
+protocol.set_trace_level(protocol.TRACE_OFF)
+
+
+class ShortReadSocket(object):
+    """
+    Socket stand-in that hands out at most 'step' bytes per recv and
+    counts the calls made on it.
+    """
+    def __init__(self, data, step):
+        self.data = data
+        self.pos = 0
+        self.step = step
+        self.recv_calls = 0
+        self.sent = []
+
+    def recv(self, n):
+        self.recv_calls += 1
+        n = min(n, self.step)
+        buf = self.data[self.pos:self.pos + n]
+        self.pos += len(buf)
+        return buf
+
+    def sendall(self, buf):
+        self.sent.append(bytes(buf))
+
+
+def encode_values(d):
+    fd = ShortReadSocket(b'', 0)
+    writer = protocol.BufferedWriter(fd)
+    protocol.write_values(writer, d)
+    writer.flush()
+    return fd
+
+
+class protocolTestCases(unittest2.TestCase):
+
+    def testWriterSendsReplyOnce(self):
+        d = {'Name': protocol.MI_String('name'),
+             'Count': protocol.MI_Uint32(7),
+             'Enabled': protocol.MI_Boolean(True)}
+        fd = encode_values(d)
+        self.assertTrue(len(fd.sent) == 1, repr(fd.sent))
+
+    def testReaderHandlesShortReads(self):
+        text = 'x' * 200000
+        d = {'Contents': protocol.MI_String(text),
+             'Size': protocol.MI_Uint64(len(text))}
+        data = encode_values(d).sent[0]
+        reader = protocol.BufferedReader(ShortReadSocket(data, 1000))
+        r = protocol.read_values(reader)
+        self.assertTrue(r['Contents'].value == text)
+        self.assertTrue(r['Size'].value.value == len(text))
+
+    def testReaderBatchesSmallFields(self):
+        d = {}
+        for i in range(100):
+            d['Name' + str(i)] = protocol.MI_String('value' + str(i))
+        data = encode_values(d).sent[0]
+        fd = ShortReadSocket(data, len(data))
+        r = protocol.read_values(protocol.BufferedReader(fd))
+        self.assertTrue(len(r) == 100)
+        self.assertTrue(fd.recv_calls == 1, repr(fd.recv_calls))
+
+    def testReaderEndOfStream(self):
+        reader = protocol.BufferedReader(ShortReadSocket(b'\x01\x02', 2))
+        self.assertTrue(reader.recv(1) == b'\x01')
+        self.assertRaises(socket.error, reader.recv, 4)
+        self.assertTrue(reader.recv(1) == b'')
+
+    def testNumericArraysRoundTrip(self):
+        d = {'Flags': protocol.MI_BooleanA([True, False, 1]),
+             'Bytes': protocol.MI_Uint8A(range(256)),
+             'Small': protocol.MI_Sint8A([-128, 127]),
+             'Ports': protocol.MI_Uint16A([ctypes.c_ushort(22), 443]),
+             'Deltas': protocol.MI_Sint16A([-1, 1]),
+             'Counters': protocol.MI_Uint32A([0, 4294967295]),
+             'Offsets': protocol.MI_Sint32A([-2147483648, 2147483647]),
+             'Sizes': protocol.MI_Uint64A([0, 18446744073709551615]),
+             'Times': protocol.MI_Sint64A([-9223372036854775808, 9223372036854775807]),
+             'Ratios': protocol.MI_Real32A([0.5, -2.0]),
+             'Averages': protocol.MI_Real64A([1.0 / 3]),
+             'Letters': protocol.MI_Char16A([65, 66])}
+        data = encode_values(d).sent[0]
+        fd = ShortReadSocket(data, 7)
+        r = protocol.read_values(protocol.BufferedReader(fd))
+        self.assertTrue(fd.pos == len(data))
+        for k in d.keys():
+            self.assertTrue(r[k] == d[k], k + ': ' + repr(r[k]) + ' != ' + repr(d[k]))
+        self.assertTrue(list(r['Flags'].value) == [1, 0, 1])
+        self.assertTrue(list(r['Ports'].value) == [22, 443])
+
+    def testEmptyArrayIsNull(self):
+        data = encode_values({'Counters': protocol.MI_Uint32A([])}).sent[0]
+        r = protocol.read_values(protocol.BufferedReader(ShortReadSocket(data, len(data))))
+        self.assertTrue(len(r['Counters'].value) == 0)
+
+    def testDatetimesRoundTrip(self):
+        d = {'Modified': protocol.MI_Timestamp.from_time(1500000000),
+             'Timeout': protocol.MI_Interval(1, 2, 3, 4, 5),
+             'Schedule': protocol.MI_DatetimeA([protocol.MI_Interval(0, 0, 15, 0, 0),
+                                               protocol.MI_Timestamp.from_time(0)]),
+             'Empty': protocol.MI_DatetimeA([]),
+             'Name': protocol.MI_String('after')}
+        data = encode_values(d).sent[0]
+        r = protocol.read_values(protocol.BufferedReader(ShortReadSocket(data, 5)))
+        self.assertTrue(r['Timeout'].days.value == 1 and r['Timeout'].seconds.value == 4)
+        self.assertTrue(r['Schedule'].value[0].minutes.value == 15)
+        self.assertTrue(len(r['Empty'].value) == 0)
+        self.assertTrue(r['Name'].value == 'after')
+
+    def testInstanceArrayOverSocketpair(self):
+        instances = []
+        for i in range(1000):
+            instances.append({'DestinationPath': protocol.MI_String('/etc/file' + str(i)),
+                              'FileSize': protocol.MI_Uint64(i)})
+        s1, s2 = socket.socketpair()
+        try:
+            def send():
+                writer = protocol.BufferedWriter(s1)
+                protocol.write_values(writer, {'__Inventory': protocol.MI_InstanceA(instances)})
+                writer.flush()
+            t = threading.Thread(target=send)
+            t.start()
+            r = protocol.read_values(protocol.BufferedReader(s2))
+            t.join()
+        finally:
+            s1.close()
+            s2.close()
+        inventory = r['__Inventory'].value
+        self.assertTrue(len(inventory) == 1000)
+        self.assertTrue(inventory[999]['DestinationPath'].value == '/etc/file999')
+        self.assertTrue(inventory[999]['FileSize'].value.value == 999)
+
+    def testInstanceStreamMatchesInstanceArray(self):
+        def instances(count):
+            for i in range(count):
+                yield {'Name': protocol.MI_String('service' + str(i)),
+                       'Enabled': protocol.MI_Boolean(i % 2)}
+        for count in (0, 1, 500):
+            expected = encode_values({'__Inventory': protocol.MI_InstanceA(instances(count))}).sent
+            streamed = encode_values({'__Inventory': protocol.MI_InstanceStreamA(instances(count))}).sent
+            self.assertTrue(streamed == expected, str(count))
+            unbuffered = ShortReadSocket(b'', 0)
+            protocol.write_values(unbuffered, {'__Inventory': protocol.MI_InstanceStreamA(instances(count))})
+            self.assertTrue(b''.join(unbuffered.sent) == expected[0], str(count))
+        stream = protocol.MI_InstanceStreamA(instances(3))
+        self.assertTrue(len(stream.value) == 3)
+        self.assertTrue(stream.value[2]['Name'].value == 'service2')
+
+    def testTraceFormatsOnlyWhenEnabled(self):
+        calls = []
+        def message():
+            calls.append(1)
+            return 'built'
+        stdout = sys.stdout
+        sys.stdout = out = io.StringIO()
+        try:
+            protocol.trace(message)
+            protocol.verbose_trace('  len: %s', 1)
+            protocol.set_trace_level(protocol.trace_level_from('on'))
+            protocol.trace(message)
+            protocol.trace('  key: %s %r', 'Name', 'x')
+            protocol.verbose_trace('  len: %s', 1)
+        finally:
+            protocol.set_trace_level(protocol.TRACE_OFF)
+            sys.stdout = stdout
+        self.assertTrue(len(calls) == 1)
+        self.assertTrue(out.getvalue() == "built\n  key: Name 'x'\n", repr(out.getvalue()))
+        self.assertTrue(protocol.trace_level_from('2') == protocol.TRACE_VERBOSE)
+        self.assertTrue(protocol.trace_level_from('bogus') == protocol.TRACE_OFF)
+
+
+######################################
+if __name__ == '__main__':
+    s1 = unittest2.TestLoader().loadTestsFromTestCase(protocolTestCases)
+    alltests = unittest2.TestSuite([s1])
+    if not unittest2.TextTestRunner(stream=sys.stdout, verbosity=0).run(alltests).wasSuccessful():
+        sys.exit(1)
@@ -15,6 +15,7 @@ import tarfile
 import zipfile
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+filecompare = imp.load_source('filecompare', '../filecompare.py')
 LG = nxDSCLog.DSCLog
 try:
     import hashlib
@@ -196,19 +197,14 @@ def ReadCacheInfo(SourcePath, DestinationPath):
 
 
 def WriteCacheInfo(SourcePath, DestinationPath):
-    src_hash = md5const()
-    src_block = b'loopme'
-    with opened_w_error(SourcePath, 'rb') as (src_file, src_error):
-        if src_error:
-            print("Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                  " Error: " + src_error.message + src_error.strerror, file=sys.stderr)
-            LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                    " Error: " + src_error.message + src_error.strerror)
-            return -1
-        while src_block:
-            src_block = src_file.read(BLOCK_SIZE)
-            src_hash.update(src_block)
-    chksum = src_hash.hexdigest()
+    try:
+        chksum = filecompare.file_digest(SourcePath, md5const)
+    except (IOError, OSError) as src_error:
+        print("Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
+              " Error: " + src_error.strerror, file=sys.stderr)
+        LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
+                " Error: " + src_error.strerror)
+        return -1
     st, error = LStatFile(SourcePath)
     cache_file_path = cache_file_dir + \
         SourcePath.replace('/', '_') + DestinationPath.replace('/', '_')
@@ -242,20 +238,15 @@ def CompareFileWithCacheFile(SourcePath, DestinationPath, Checksum):
                 str(error.errno) + " Error: " + error.strerror)
         return False
     if Checksum == "md5":
-        src_error = None
-        src_hash = md5const()
-        src_block = b'loopme'
-        with opened_w_error(SourcePath, 'rb') as (src_file, src_error):
-            if src_error:
-                print("Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                      " Error: " + src_error.message + src_error.strerror, file=sys.stderr)
-                LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                        " Error: " + src_error.message + src_error.strerror)
-                return -1
-            while src_block:
-                src_block = src_file.read(BLOCK_SIZE)
-                src_hash.update(src_block)
-        if src_hash.hexdigest() == cache_hash:
+        try:
+            src_hash = filecompare.file_digest(SourcePath, md5const)
+        except (IOError, OSError) as src_error:
+            print("Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
+                  " Error: " + src_error.strerror, file=sys.stderr)
+            LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
+                    " Error: " + src_error.strerror)
+            return -1
+        if src_hash == cache_hash:
             return True
         else:
             return False
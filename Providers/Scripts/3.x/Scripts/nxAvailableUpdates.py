@@ -150,7 +150,7 @@ def GetYumUpdates(Name):
         param_list = ""
         for pkg in pkg_list.splitlines():
             if pkg == "Obsoleting":
-                LG().Log('DEBUG', "List including obsolete packages: " + str(pkg_list))
+                LG().Log('DEBUG', lambda: "List including obsolete packages: " + str(pkg_list))
                 break
             param_list = param_list + " " + pkg
 
@@ -162,7 +162,7 @@ def GetYumUpdates(Name):
         #LG().Log('DEBUG', "Cmd output is : " + out)
         updates_list = []
         if len(out) < 1 or ':' not in out:
-            LG().Log('DEBUG', "Failed retrieving individual package info. Output is too small : " + out)
+            LG().Log('DEBUG', lambda: "Failed retrieving individual package info. Output is too small : " + out)
             return updates_list
         yum_pkg_info_list = srch.finditer(out)
         updates_list = get_yum_updates_list(yum_pkg_info_list, Name)
@@ -203,7 +203,7 @@ def validate_yum_pkg_list_output(pkg_list, retcode):
         LG().Log('DEBUG', "No packages are available for update")
     else:
         LG().Log('DEBUG', "Error return code when retrieving update package list: " + str(retcode))
-        LG().Log('DEBUG', "Output when retrieving update package list: " + str(pkg_list))
+        LG().Log('DEBUG', lambda: "Output when retrieving update package list: " + str(pkg_list))
         if repo_urls_unreachable_error in str(pkg_list):
             LG().Log('DEBUG', "Unable to contact YUM repos" + str(pkg_list))
         if repo_urls_unconfigured_error in str(pkg_list):
@@ -5,17 +5,27 @@
 # ====================================
 
 from contextlib import contextmanager
+from collections import OrderedDict
 
 import os
 import sys
-import pwd
+import errno
 import shutil
-import grp
 import codecs
 import urllib.request
 import time
+import stat
+import tempfile
 import imp
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait
+except ImportError:
+    ThreadPoolExecutor = None
 protocol = imp.load_source('protocol', '../protocol.py')
+filecompare = imp.load_source('filecompare', '../filecompare.py')
+remotefile = imp.load_source('remotefile', '../remotefile.py')
+changejournal = imp.load_source('changejournal', '../changejournal.py')
+identitycache = imp.load_source('identitycache', '../identitycache.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
 
@@ -29,6 +39,31 @@ except ImportError:
 
 BLOCK_SIZE = 8192
 
+# Recursive directories are planned in one os.scandir pass when available.
+HAVE_SCANDIR = hasattr(os, 'scandir')
+
+# Directories of a recursive resource are listed, stat'ed and have their
+# entries' owner, group and mode changed through a descriptor, so only
+# the last component of each path is looked up.
+HAVE_DIR_FD = (HAVE_SCANDIR and os.scandir in os.supports_fd and os.stat in os.supports_dir_fd and
+               os.chown in os.supports_dir_fd and os.chmod in os.supports_dir_fd)
+
+# CopyFile copies inside the kernel when it can.
+HAVE_COPY_FILE_RANGE = hasattr(os, 'copy_file_range')
+HAVE_SENDFILE = hasattr(os, 'sendfile')
+
+# Files a recursive Set compares and copies at once, one per CPU up to 4;
+# nxFileWorkers=<n> in dsc.conf overrides it and 1 handles them one at a
+# time.
+DefaultFileWorkers = min(os.cpu_count() or 1, 4)
+
+
+# md5 digests of compared files, reused while their stat is unchanged.
+Md5Cache = filecompare.DigestCache(helperlib.PYTHON_PID_DIR + '/cache/nxFile/md5.' + str(os.getuid()), md5const)
+
+# Remote SourcePaths, downloaded again only when the server has changed them.
+RemoteFiles = remotefile.RemoteCache(helperlib.PYTHON_PID_DIR + '/cache/nxFile/remote.' + str(os.getuid()))
+
 global show_mof
 show_mof = False
 RemoteFileRetryCount = 5
@@ -72,16 +107,48 @@ def Set_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Che
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
                      = init_locals(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
     retval = Set(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    SaveMd5Cache()
     return retval
 
 
 def Test_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode):
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
                      = init_locals(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    journal = changejournal.get_journal()
+    paths = JournalPaths(DestinationPath, SourcePath, Ensure, Type, Owner, Group)
+    if journal is not None and paths is not None:
+        key = ('nxFile', DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+        retval = journal.cached(key)
+        if retval is not None:
+            return list(retval)
+        token = journal.begin(paths)
     retval = Test(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode)
+    if journal is not None and paths is not None:
+        journal.remember(key, token, list(retval))
+    SaveMd5Cache()
     return retval
 
 
+def JournalPaths(DestinationPath, SourcePath, Ensure, Type, Owner, Group):
+    """
+    Returns the paths the result of Test depends on, or None if the change
+    journal cannot tell when it changes: remote sources, and directories,
+    whose contents it does not watch.
+    """
+    if '://' in SourcePath:
+        return None
+    if Type == 'directory' and Ensure != 'absent':
+        return None
+    paths = [DestinationPath]
+    if SourcePath:
+        paths.append(SourcePath)
+    if Owner:
+        paths.append('/etc/passwd')
+    if Group:
+        paths.append('/etc/group')
+    return changejournal.watched_paths(paths)
+
+
 def Get_Marshall(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode):
     arg_names = list(locals().keys())
     DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Recurse, Links, Owner, Group, Mode \
@@ -205,6 +272,32 @@ def WriteFile(path, contents):
     return error
 
 
+def UserId(name):
+    """
+    The uid of user 'name', through identitycache.  Raises KeyError for
+    unknown users like pwd.getpwnam.
+    """
+    return identitycache.user_id(name)
+
+
+def GroupId(name):
+    return identitycache.group_id(name)
+
+
+def KnownUid(uid):
+    """
+    Returns 'uid' if the passwd database has it, raises KeyError if not,
+    like pwd.getpwuid(uid)[2].
+    """
+    identitycache.user_name(uid)
+    return uid
+
+
+def KnownGid(gid):
+    identitycache.group_name(gid)
+    return gid
+
+
 def LStatFile(path):
     """
     LStat the file.  Do not follow the symlink.
@@ -375,12 +468,57 @@ def RemoveFile(path):
     return error
 
 
-def CopyFile(spath, dpath):
+def CopyFile(spath, dpath, owner=-1, group=-1, mode=None):
+    """
+    Copy spath to a temporary file next to dpath and rename it over
+    dpath, so dpath is never seen half written.  The copy is given the
+    owner, group and mode of spath, or 'owner', 'group' and 'mode'
+    (octal digits) where those are set, before it is renamed, and is
+    synced first if nxFileFsync=true is in dsc.conf.  Whatever cannot be
+    set is left for SetOwnerGroupMode to report.
+    """
     error = None
     if spath == dpath:  # Nothing to copy!
         return error
+    tmp = None
     try:
-        shutil.copyfile(spath,dpath)
+        src = os.open(spath, os.O_RDONLY)
+        try:
+            stat_src = os.fstat(src)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dpath) or '.', prefix='.' + os.path.basename(dpath) + '.')
+            try:
+                CopyFd(src, fd, stat_src.st_size)
+                if mode is None:
+                    mode = stat.S_IMODE(stat_src.st_mode)
+                elif type(mode) != int:
+                    mode = int(mode, 8)
+                if owner == -1:
+                    owner = stat_src.st_uid
+                if group == -1:
+                    group = stat_src.st_gid
+                try:
+                    os.fchown(fd, owner, group)
+                except OSError:
+                    pass
+                os.fchmod(fd, mode)
+                if helperlib.dsc_conf().get('nxFileFsync', '').lower() == 'true':
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            try:
+                os.rename(tmp, dpath)
+            except OSError as e:
+                # a file mounted over, as container runtimes do with
+                # /etc/hosts and /etc/resolv.conf, can only be rewritten
+                if e.errno != errno.EBUSY:
+                    raise
+                shutil.copyfile(tmp, dpath)
+                os.remove(tmp)
+            tmp = None
+        finally:
+            os.close(src)
+            if tmp is not None:
+                os.remove(tmp)
     except OSError as error:
         print("Exception copying tree " + spath  + ' to ' + dpath + " Error Code: " + str(error.errno) + " Error: " +error.strerror, file=sys.stderr)
         LG().Log('ERROR', "Exception copying tree " + spath + ' to ' + dpath + " Error Code: " + str(error.errno) + " Error: " + error.strerror)
@@ -392,6 +530,70 @@ def CopyFile(spath, dpath):
     return error
 
 
+def CopyFd(src, dst, size):
+    """
+    Copy from the descriptor src to dst, inside the kernel with
+    copy_file_range or sendfile where the system has them, otherwise
+    through a buffer.  Stops at the end of src; 'size' is what fstat
+    said src holds, files that claim to be empty such as those in /proc
+    are always read.
+    """
+    copied = 0
+    if HAVE_COPY_FILE_RANGE and size:
+        try:
+            while True:
+                n = os.copy_file_range(src, dst, max(size - copied, BLOCK_SIZE))
+                if not n:
+                    return
+                copied += n
+        except OSError as error:
+            # not between these filesystems, or not at all
+            if error.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+    if HAVE_SENDFILE and size:
+        # sendfile reads at an offset and leaves the position of src as
+        # copy_file_range left it
+        try:
+            while True:
+                n = os.sendfile(dst, src, copied, max(size - copied, BLOCK_SIZE))
+                if not n:
+                    return
+                copied += n
+        except OSError as error:
+            if error.errno not in (errno.EINVAL, errno.ENOSYS, errno.ESPIPE):
+                raise
+    if copied:
+        os.lseek(src, copied, os.SEEK_SET)
+    buf = bytearray(min(filecompare.BLOCK_SIZE, size + 1) if size else filecompare.BLOCK_SIZE)
+    view = memoryview(buf)
+    F = os.fdopen(src, 'rb', 0, closefd=False)
+    while True:
+        n = F.readinto(buf)
+        if not n:
+            return
+        written = 0
+        while written < n:
+            written += os.write(dst, view[written:n])
+
+
+def CopyAttributes(fc):
+    """
+    Returns the owner, group and mode set by fc for CopyFile, -1 or None
+    where fc leaves them to the source.
+    """
+    owner = -1
+    group = -1
+    try:
+        if fc.Owner:
+            owner = UserId(fc.Owner)
+        if fc.Group:
+            group = GroupId(fc.Group)
+    except KeyError:
+        # SetOwnerGroupMode reports it
+        pass
+    return owner, group, fc.Mode or None
+
+
 def CompareFiles(DestinationPath, SourcePath, Checksum):
     """
     If the files differ in size, return -1.
@@ -402,38 +604,26 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
         return 0
     stat_dest = StatFile(DestinationPath)
     stat_src = StatFile(SourcePath)
+    return CompareFileStats(DestinationPath, SourcePath, stat_dest, stat_src, Checksum)
+
+
+def CompareFileStats(DestinationPath, SourcePath, stat_dest, stat_src, Checksum):
+    """
+    CompareFiles for files already stat'ed.
+    """
     if stat_src.st_size != stat_dest.st_size:
         return -1
     if Checksum == "md5":
-        src_error = None
-        dest_error = None
-        src_hash = md5const()
-        dest_hash = md5const()
-        src_block = b'loopme'
-        dest_block = b'loopme'
-        with opened_bin_w_error(SourcePath, 'rb') as (src_file, src_error):
-            if src_error:
-                print("Exception opening source file " + SourcePath  + " Error Code: " + str(src_error.errno) +
-                      " Error: " + src_error.strerror, file=sys.stderr)
-                LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error Code: " + str(src_error.errno) +
-                        " Error: " + src_error.strerror)
-                return -1
-            with opened_bin_w_error(DestinationPath, 'rb') as (dest_file, dest_error):
-                if dest_error:
-                    print("Exception opening destination file " + DestinationPath + " Error Code: " + str(dest_error.errno) +
-                          " Error: " + dest_error.strerror, file=sys.stderr)
-                    LG().Log('ERROR', "Exception opening destination file " + DestinationPath + " Error Code: " + str(dest_error.errno) +
-                          " Error: " + dest_error.strerror)
-                    return -1
-                while src_block or dest_block :
-                    src_block = src_file.read(BLOCK_SIZE)
-                    dest_block = dest_file.read(BLOCK_SIZE)
-                    src_hash.update(src_block)
-                    dest_hash.update(dest_block)
-                    if src_hash.hexdigest() != dest_hash.hexdigest():
-                        return -1
-        if src_hash.hexdigest() == dest_hash.hexdigest():
-            return 0
+        try:
+            if Md5Cache.files_equal(SourcePath, DestinationPath, stat_src, stat_dest):
+                return 0
+            return -1
+        except (IOError, OSError) as e:
+            print("Exception opening file " + str(e.filename) + " Error Code: " + str(e.errno) +
+                  " Error: " + e.strerror, file=sys.stderr)
+            LG().Log('ERROR', "Exception opening file " + str(e.filename) + " Error Code: " + str(e.errno) +
+                    " Error: " + e.strerror)
+            return -1
     elif Checksum == "ctime":
         if stat_src.st_ctime != stat_dest.st_ctime:
             return -1
@@ -446,6 +636,13 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
             return 0
 
 
+def SaveMd5Cache():
+    if Md5Cache.dirty:
+        if not Md5Cache.save():
+            LG().Log('WARNING', "Unable to write md5 cache " + Md5Cache.path)
+    LG().Log('DEBUG', lambda: "md5 cache: " + Md5Cache.stats())
+
+
 def RemoveTree(path):
     error = None
     try:
@@ -489,30 +686,30 @@ def TestOwnerGroupMode(DestinationPath, SourcePath, fc):
 
     if fc.Owner:
         try:
-            Specified_Owner_ID = pwd.getpwnam(fc.Owner)[2]
+            Specified_Owner_ID = UserId(fc.Owner)
         except KeyError as error:
             print("Exception obtaining gid from group name " + fc.Group  + " Error: " + repr(error), file=sys.stderr)
             LG().Log('ERROR', "Exception obtaining gid from group name " + fc.Group + " Error: " + repr(error))
             return False
-        if Specified_Owner_ID != pwd.getpwuid(stat_info.st_uid)[2]:
+        if Specified_Owner_ID != KnownUid(stat_info.st_uid):
             return False
     elif SourcePath:
         # Owner wasn't specified, if SourcePath is specified then check that the Owners match
-        if pwd.getpwuid(stat_info.st_uid)[2] != pwd.getpwuid(stat_info_src.st_uid)[2]:
+        if KnownUid(stat_info.st_uid) != KnownUid(stat_info_src.st_uid):
             return False
 
     if fc.Group:
         try:
-            Specified_Group_ID = grp.getgrnam(fc.Group)[2]
+            Specified_Group_ID = GroupId(fc.Group)
         except KeyError as error:
             print("Exception obtaining gid from group name " + fc.Group  + " Error: " +  repr(error), file=sys.stderr)
             LG().Log('ERROR', "Exception obtaining gid from group name " + fc.Group + " Error: " + repr(error))
             return False
-        if Specified_Group_ID != grp.getgrgid(stat_info.st_gid)[2]:
+        if Specified_Group_ID != KnownGid(stat_info.st_gid):
             return False
     elif SourcePath:
         # Group wasn't specified, if SourcePath is specified then check that the Groups match
-        if grp.getgrgid(stat_info.st_gid)[2] != grp.getgrgid(stat_info_src.st_gid)[2]:
+        if KnownGid(stat_info.st_gid) != KnownGid(stat_info_src.st_gid):
             return False
     # Mode is irrelevant to symlinks
     if not os.path.islink(DestinationPath):
@@ -616,35 +813,35 @@ def SetOwnerGroupMode(DestinationPath, SourcePath, fc):
             return False
 
     if fc.Owner:
-        Specified_Owner_ID = pwd.getpwnam(fc.Owner)[2]
-        if Specified_Owner_ID != pwd.getpwuid(stat_info.st_uid)[2]:
+        Specified_Owner_ID = UserId(fc.Owner)
+        if Specified_Owner_ID != KnownUid(stat_info.st_uid):
             print("Changing owner of " + DestinationPath + " to " + str(Specified_Owner_ID))
             LG().Log('INFO', "Changing owner of " + DestinationPath + " to " + str(Specified_Owner_ID))
             if LChown(DestinationPath, Specified_Owner_ID, -1) is not None :
                 return False
 
     elif SourcePath:
-        src_uid = pwd.getpwuid(stat_info_src.st_uid)[2]
-        if pwd.getpwuid(stat_info.st_uid)[2] != src_uid:
+        src_uid = KnownUid(stat_info_src.st_uid)
+        if KnownUid(stat_info.st_uid) != src_uid:
             print("Changing owner of " + DestinationPath + " to " + str(src_uid))
             LG().Log('INFO', "Changing owner of " + DestinationPath + " to " + str(src_uid))
             if LChown(DestinationPath, src_uid, -1) is not None :
                 return False
 
     if fc.Group:
-        Specified_Group_ID = grp.getgrnam(fc.Group)[2]
-        if Specified_Group_ID != grp.getgrgid(stat_info.st_gid)[2]:
+        Specified_Group_ID = GroupId(fc.Group)
+        if Specified_Group_ID != KnownGid(stat_info.st_gid):
             print("Changing group of " + DestinationPath + " to " + str(Specified_Group_ID))
             LG().Log('INFO', "Changing group of " + DestinationPath + " to " + str(Specified_Group_ID))
             if LChown(DestinationPath, -1, Specified_Group_ID) is not None :
                 return False
 
     elif SourcePath:
-        src_gid = grp.getgrgid(stat_info_src.st_gid)[2]
-        if grp.getgrgid(stat_info.st_gid)[2] != src_gid:
+        src_gid = KnownGid(stat_info_src.st_gid)
+        if KnownGid(stat_info.st_gid) != src_gid:
             print("Changing group of " + DestinationPath + " to " + str(src_gid))
             LG().Log('INFO', "Changing group of " + DestinationPath + " to " + str(src_gid))
-            if LChown(DestinationPath, src_gid , -1) is not None :
+            if LChown(DestinationPath, -1, src_gid) is not None :
                 return False
 
     # Mode is irrelevant to symlinks
@@ -666,6 +863,16 @@ def SetOwnerGroupMode(DestinationPath, SourcePath, fc):
 
 
 def SetDirectoryRecursive(DestinationPath, SourcePath, fc):
+    if fc.Recurse and HAVE_SCANDIR:
+        pool = NewFilePool()
+        try:
+            plan = PlanDirectory(DestinationPath, SourcePath, fc, pool=pool)
+            if plan.entries:
+                LG().Log('INFO', lambda: "Changes to " + DestinationPath + ":\n" + FormatPlan(plan))
+            return ExecutePlan(plan, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
     if not os.path.exists(DestinationPath):
         if MakeDirs(DestinationPath) is not None:
             return False
@@ -711,6 +918,534 @@ def SetDirectoryRecursive(DestinationPath, SourcePath, fc):
     return True
 
 
+# ###########################################################
+# Recursive directories are compared in a single planning pass over the
+# source and destination trees.  os.scandir hands out the file type of
+# every entry with the listing and caches its lstat, so each entry costs
+# one lstat instead of the exists/islink/isfile/isdir/lstat series the
+# per-file Test and Set functions make.  The plan lists what Set has to
+# do, in order:
+#
+#   ('mkdir', dest, src)        create a directory, then set its owner,
+#                               group and mode
+#   ('create', dest, src)       copy a file missing from the destination
+#   ('update', dest, src)       copy a file whose contents differ
+#   ('replace', dest, src)      the destination is not a regular file,
+#                               SetFile replaces it if Force is set
+#   ('link', dest, src)         the source is a symlink, for SetLink
+#   ('chown', dest, (uid, gid)) -1 leaves either as it is
+#   ('chmod', dest, mode)
+#   ('error', dest, message)    nothing Set can fix
+#
+# Test passes when the plan is empty.  Like the per-file functions the
+# plan never removes destination entries that have no source.
+#
+# With a pool of threads, Set compares the contents of files on the pool
+# while the walk goes on and copies them, and changes their owner, group
+# and mode, on it too.  Hashing and file I/O release the GIL.
+# ###########################################################
+
+class TreePlan:
+    def __init__(self, fc, limit=None, pool=None):
+        self.fc = fc
+        self.limit = limit
+        self.pool = pool
+        self.entries = []
+        self.copy_attributes = CopyAttributes(fc)
+        self.dirs = None
+        # (st_dev, st_ino, is_link) of the directories listed, for DirFds
+        self.planned_dirs = {}
+        self.uid = None
+        self.gid = None
+
+    def add(self, action, dest, arg):
+        self.entries.append((action, dest, arg))
+
+    def full(self):
+        return self.limit is not None and len(self.entries) >= self.limit
+
+    def resolve_owner(self):
+        """
+        Look up Owner and Group once for the whole tree.
+        """
+        if self.fc.Owner:
+            try:
+                self.uid = UserId(self.fc.Owner)
+            except KeyError:
+                self.add('error', '', "Unknown owner " + self.fc.Owner)
+                return False
+        if self.fc.Group:
+            try:
+                self.gid = GroupId(self.fc.Group)
+            except KeyError:
+                self.add('error', '', "Unknown group " + self.fc.Group)
+                return False
+        return True
+
+    def attributes(self, path, st, src_st, is_link):
+        """
+        Returns the chown and chmod entries that give 'path' the owner,
+        group and mode of the resource, or of its source.
+        """
+        changes = []
+        uid = self.uid
+        gid = self.gid
+        mode = self.fc.Mode
+        if src_st is not None:
+            if uid is None:
+                uid = src_st.st_uid
+            if gid is None:
+                gid = src_st.st_gid
+            if not mode:
+                mode = '%03o' % (src_st.st_mode & 0o777)
+        if uid is not None and st.st_uid == uid:
+            uid = None
+        if gid is not None and st.st_gid == gid:
+            gid = None
+        if uid is not None or gid is not None:
+            changes.append(('chown', path, (uid is None and -1 or uid, gid is None and -1 or gid)))
+        # Mode is irrelevant to symlinks
+        if mode and not is_link and '%03o' % (st.st_mode & 0o777) != mode:
+            changes.append(('chmod', path, mode))
+        return changes
+
+
+class DirFds:
+    """
+    Descriptors of the directories a plan changes entries in, the 'size'
+    most recently used kept open.  'planned' has the (st_dev, st_ino) of
+    each directory the plan listed, and whether it got there through a
+    symlink.  Those are opened a component at a time from the top of the
+    plan, and only while they are still the directories it listed.
+    """
+    def __init__(self, planned=None, size=16):
+        self.planned = planned or {}
+        self.size = size
+        self.fds = OrderedDict()
+
+    def get(self, path):
+        path = path.rstrip('/') or '/'
+        fd = self.fds.pop(path, None)
+        if fd is None:
+            planned = self.planned.get(path)
+            parent, name = SplitPath(path)
+            if planned is None:
+                fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            elif parent in self.planned and parent != path:
+                fd = OpenPlannedDir(self.get(parent), name, path, planned)
+            else:
+                fd = OpenPlannedDir(None, path, path, planned)
+            while len(self.fds) >= self.size:
+                os.close(self.fds.popitem(last=False)[1])
+        self.fds[path] = fd
+        return fd
+
+    def close(self):
+        while self.fds:
+            os.close(self.fds.popitem()[1])
+
+
+def OpenPlannedDir(dir_fd, name, path, planned):
+    """
+    Opens directory 'name' in 'dir_fd', the one at 'path' the plan
+    listed.  Fails if it was replaced since, a symlink put in its place
+    included.
+    """
+    dev, ino, is_link = planned
+    flags = os.O_RDONLY | os.O_DIRECTORY
+    if not is_link:
+        flags |= os.O_NOFOLLOW
+    fd = os.open(name, flags, dir_fd=dir_fd)
+    st = os.fstat(fd)
+    if (st.st_dev, st.st_ino) != (dev, ino):
+        os.close(fd)
+        raise OSError(errno.ESTALE, "Directory replaced since the plan was made", path)
+    return fd
+
+
+def SplitPath(path):
+    """
+    Returns the directory 'path' is in and its last component.
+    """
+    directory, sep, name = path.rpartition('/')
+    if not sep:
+        return '.', name
+    return directory or '/', name
+
+
+def LChownAt(dirs, path, owner, group):
+    """
+    LChown through the descriptor of the directory 'path' is in.
+    """
+    if not HAVE_DIR_FD:
+        return LChown(path, owner, group)
+    error = None
+    directory, name = SplitPath(path)
+    try:
+        os.chown(name, owner, group, dir_fd=dirs.get(directory), follow_symlinks=False)
+    except OSError as error:
+        print("Exception changing ownership of file " + path  + " Error Code: " + str(error.errno) + " Error: " +error.strerror, file=sys.stderr)
+        LG().Log('ERROR', "Exception changing ownership of file " + path + " Error Code: " + str(error.errno) + " Error: " + error.strerror)
+        return error
+    return error
+
+
+def ChmodAt(dirs, path, mode):
+    """
+    Chmod through the descriptor of the directory 'path' is in.  A
+    symlink found in place of 'path' is left alone, chmod would change
+    what it points to.
+    """
+    if not HAVE_DIR_FD:
+        return Chmod(path, mode)
+    error = None
+    directory, name = SplitPath(path)
+    try:
+        fd = dirs.get(directory)
+        if os.chmod in os.supports_follow_symlinks:
+            try:
+                os.chmod(name, int(mode, 8), dir_fd=fd, follow_symlinks=False)
+            except OSError as error:
+                if error.errno != errno.EOPNOTSUPP:
+                    raise
+        elif not stat.S_ISLNK(os.stat(name, dir_fd=fd, follow_symlinks=False).st_mode):
+            os.chmod(name, int(mode, 8), dir_fd=fd)
+    except OSError as error:
+        print("Exception  changing mode of file " + path  + " Error Code: " + str(error.errno) + " Error: " +error.strerror, file=sys.stderr)
+        LG().Log('ERROR', "Exception  changing mode of file " + path + " Error Code: " + str(error.errno) + " Error: " + error.strerror)
+        return error
+    return error
+
+
+def ScanDir(path):
+    """
+    Returns the entries of directory 'path' by name, and the descriptor
+    of the directory when they were listed through one, which CloseDir
+    closes once the entries have been stat'ed.  (None, None) if 'path'
+    cannot be listed.
+    """
+    d = {}
+    fd = None
+    try:
+        if HAVE_DIR_FD:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            entries = os.scandir(fd)
+        else:
+            entries = os.scandir(path)
+        for entry in entries:
+            d[entry.name] = entry
+    except OSError as error:
+        CloseDir(fd)
+        print("Exception listing dir" + path  + " Error Code: " + str(error.errno) + " Error: " +error.strerror, file=sys.stderr)
+        LG().Log('ERROR', "Exception listing dir " + path + " Error Code: " + str(error.errno) + " Error: " + error.strerror)
+        return None, None
+    return d, fd
+
+
+def CloseDir(fd):
+    if fd is not None:
+        os.close(fd)
+
+
+def PlanDirectory(DestinationPath, SourcePath, fc, limit=None, pool=None):
+    """
+    Returns the TreePlan that makes the directory DestinationPath match
+    SourcePath, or the Owner/Group/Mode of fc when there is no source.
+    The plan stops growing after 'limit' entries.  Files are compared on
+    'pool' if one is given.
+    """
+    plan = TreePlan(fc, limit, pool)
+    if not plan.resolve_owner():
+        return plan
+    try:
+        st = os.lstat(DestinationPath)
+    except OSError:
+        st = None
+    if st is None:
+        plan.add('mkdir', DestinationPath, SourcePath)
+        if SourcePath:
+            PlanContents(plan, DestinationPath, SourcePath, {})
+        return plan
+    if not os.path.isdir(DestinationPath):
+        plan.add('error', DestinationPath, "Not a directory")
+        return plan
+    src_st = None
+    if SourcePath:
+        src_st = LStatFile(SourcePath)
+        if src_st is None:
+            plan.add('error', SourcePath, "Unable to stat source directory")
+            return plan
+    for change in plan.attributes(DestinationPath, st, src_st, stat.S_ISLNK(st.st_mode)):
+        plan.add(*change)
+    PlanContents(plan, DestinationPath, SourcePath, None)
+    if plan.pool is not None:
+        ResolveComparisons(plan)
+    return plan
+
+
+def PlanContents(plan, DestinationPath, SourcePath, dest_entries):
+    """
+    Adds the entries for the contents of the directories DestinationPath
+    and SourcePath to 'plan'.  'dest_entries' is {} for a destination
+    the plan creates.
+    """
+    if plan.full():
+        return
+    dest_fd = None
+    if dest_entries is None:
+        dest_entries, dest_fd = ScanDir(DestinationPath)
+        if dest_entries is None:
+            plan.add('error', DestinationPath, "Unable to list directory")
+            return
+        if dest_fd is not None:
+            path = DestinationPath.rstrip('/') or '/'
+            st = os.fstat(dest_fd)
+            plan.planned_dirs[path] = (st.st_dev, st.st_ino, os.path.islink(path))
+    try:
+        if not SourcePath:
+            PlanAttributes(plan, DestinationPath, dest_entries)
+            return
+        src_entries, src_fd = ScanDir(SourcePath)
+        if src_entries is None:
+            plan.add('error', SourcePath, "Unable to list directory")
+            return
+        try:
+            PlanEntries(plan, DestinationPath, SourcePath, dest_entries, src_entries)
+        finally:
+            CloseDir(src_fd)
+    finally:
+        CloseDir(dest_fd)
+
+
+def PlanAttributes(plan, DestinationPath, dest_entries):
+    """
+    Enforce the Owner/Group/Mode specified on the entries of
+    DestinationPath, and below.
+    """
+    for name, d in sorted(dest_entries.items()):
+        if plan.full():
+            return
+        if d.is_symlink():
+            continue
+        dest_path = os.path.join(DestinationPath, name)
+        if d.is_file():
+            for change in plan.attributes(dest_path, d.stat(follow_symlinks=False), None, False):
+                plan.add(*change)
+        elif d.is_dir():
+            for change in plan.attributes(dest_path, d.stat(follow_symlinks=False), None, False):
+                plan.add(*change)
+            PlanContents(plan, dest_path, '', None)
+
+
+def PlanEntries(plan, DestinationPath, SourcePath, dest_entries, src_entries):
+    fc = plan.fc
+    for name, s in sorted(src_entries.items()):
+        if plan.full():
+            return
+        d = dest_entries.get(name)
+        dest_path = os.path.join(DestinationPath, name)
+        src_path = os.path.join(SourcePath, name)
+        if s.is_symlink():
+            if TestLink(dest_path, src_path, fc) is False:
+                plan.add('link', dest_path, src_path)
+        elif s.is_file():
+            if d is None:
+                plan.add('create', dest_path, src_path)
+            elif d.is_symlink() or not d.is_file():
+                plan.add('replace', dest_path, src_path)
+            else:
+                dest_st = d.stat(follow_symlinks=False)
+                src_st = s.stat(follow_symlinks=False)
+                changes = plan.attributes(dest_path, dest_st, src_st, False)
+                if changes and plan.limit is not None:
+                    # a Test, which needs no more than one difference
+                    plan.add(*changes[0])
+                elif plan.pool is not None:
+                    # resolved by ResolveComparisons
+                    plan.add('compare', dest_path, (src_path, changes, plan.pool.submit(
+                        CompareFileStats, dest_path, src_path, dest_st, src_st, fc.Checksum)))
+                elif CompareFileStats(dest_path, src_path, dest_st, src_st, fc.Checksum) == -1:
+                    # the copy is given the right owner, group and mode
+                    plan.add('update', dest_path, src_path)
+                else:
+                    for change in changes:
+                        plan.add(*change)
+        elif s.is_dir():
+            if d is None:
+                plan.add('mkdir', dest_path, src_path)
+                PlanContents(plan, dest_path, src_path, {})
+            elif not d.is_dir():
+                plan.add('error', dest_path, "Not a directory")
+            else:
+                for change in plan.attributes(dest_path, d.stat(follow_symlinks=False),
+                                              s.stat(follow_symlinks=False), d.is_symlink()):
+                    plan.add(*change)
+                PlanContents(plan, dest_path, src_path, None)
+
+
+def ResolveComparisons(plan):
+    """
+    Replaces the 'compare' entries of 'plan' with an update of the file,
+    or the changes to its attributes, once its comparison is done.
+    """
+    entries = []
+    for action, dest, arg in plan.entries:
+        if action != 'compare':
+            entries.append((action, dest, arg))
+            continue
+        src, changes, comparison = arg
+        if comparison.result() == -1:
+            entries.append(('update', dest, src))
+        else:
+            entries.extend(changes)
+    plan.entries = entries
+
+
+def FormatPlan(plan):
+    lines = []
+    for action, dest, arg in plan.entries:
+        if action == 'chown':
+            lines.append(action + ' ' + dest + ' ' + str(arg[0]) + ':' + str(arg[1]))
+        elif action in ('chmod', 'error'):
+            lines.append(action + ' ' + dest + ' ' + arg)
+        elif arg:
+            lines.append(action + ' ' + dest + ' from ' + arg)
+        else:
+            lines.append(action + ' ' + dest)
+    return '\n'.join(lines)
+
+
+# Entries that only touch their own file, which can run side by side.
+# Owner, group and mode changes are quick and go through DirFds, which
+# belongs to the thread running the plan.
+PooledActions = ('create', 'update')
+
+
+def ExecutePlan(plan, pool=None):
+    """
+    Carries out 'plan', stopping at the first entry that fails.  Runs of
+    PooledActions go to 'pool' if one is given; every other entry waits
+    for the run before it to finish.
+    """
+    batch = []
+    plan.dirs = DirFds(plan.planned_dirs)
+    try:
+        for entry in plan.entries:
+            if pool is not None and entry[0] in PooledActions:
+                batch.append(entry)
+                continue
+            if batch:
+                if ExecuteBatch(plan, batch, pool) is False:
+                    return False
+                batch = []
+            if ExecuteEntry(plan, entry) is False:
+                return False
+        if batch:
+            return ExecuteBatch(plan, batch, pool)
+        return True
+    finally:
+        plan.dirs.close()
+        plan.dirs = None
+
+
+def ExecuteBatch(plan, batch, pool):
+    """
+    Runs the entries of 'batch' on 'pool'.  Once one fails none that has
+    not started yet is run, and the failures are reported in plan order
+    whichever finished first.  Nothing is reported or raised before every
+    entry that started is done, so no worker is left changing files.
+    """
+    failed = []
+
+    def run(entry):
+        if failed:
+            return None
+        try:
+            result = ExecuteEntry(plan, entry)
+        except:
+            failed.append(entry)
+            raise
+        if result is False:
+            failed.append(entry)
+        return result
+
+    futures = [pool.submit(run, entry) for entry in batch]
+    wait(futures)
+    if not failed:
+        return True
+    error = None
+    skipped = 0
+    for entry, future in zip(batch, futures):
+        if future.exception() is not None:
+            LG().Log('ERROR', "Unable to " + entry[0] + " " + entry[1] + ": " + repr(future.exception()))
+            if error is None:
+                error = future.exception()
+        elif future.result() is False:
+            LG().Log('ERROR', "Unable to " + entry[0] + " " + entry[1])
+        elif future.result() is None:
+            skipped += 1
+    if skipped:
+        LG().Log('ERROR', "Skipped " + str(skipped) + " changes after the first failure")
+    if error is not None:
+        # as ExecuteEntry's exception would have been run serially
+        raise error
+    return False
+
+
+def ExecuteEntry(plan, entry):
+    fc = plan.fc
+    action, dest, arg = entry
+    if action == 'mkdir':
+        if MakeDirs(dest) is not None:
+            return False
+        if SetOwnerGroupMode(dest, arg, fc) is False:
+            return False
+    elif action == 'create' or action == 'update':
+        if CopyFile(arg, dest, *plan.copy_attributes) is not None:
+            return False
+        SetOwnerGroupMode(dest, arg, fc)
+    elif action == 'replace':
+        if SetFile(dest, arg, fc) is False:
+            return False
+    elif action == 'link':
+        if SetLink(dest, arg, fc) is False:
+            return False
+    elif action == 'chown':
+        LG().Log('INFO', "Changing owner and group of " + dest + " to " + str(arg[0]) + ":" + str(arg[1]))
+        if LChownAt(plan.dirs, dest, arg[0], arg[1]) is not None:
+            return False
+    elif action == 'chmod':
+        LG().Log('INFO', "Changing mode of " + dest + " to " + arg)
+        if ChmodAt(plan.dirs, dest, arg) is not None:
+            return False
+    elif action == 'error':
+        print("Error: " + dest + ": " + arg, file=sys.stderr)
+        LG().Log('ERROR', dest + ": " + arg)
+        return False
+    return True
+
+
+def GetFileWorkersFromConf():
+    """
+    Returns the nxFileWorkers setting of dsc.conf, or DefaultFileWorkers.
+    """
+    try:
+        return max(int(helperlib.dsc_conf().get('nxFileWorkers', DefaultFileWorkers)), 1)
+    except ValueError:
+        return DefaultFileWorkers
+
+
+def NewFilePool():
+    """
+    Returns a pool of the configured number of threads, or None when
+    files are to be handled one at a time.
+    """
+    workers = GetFileWorkersFromConf()
+    if workers < 2 or ThreadPoolExecutor is None:
+        return None
+    return ThreadPoolExecutor(workers)
+
+
 def SetFile(DestinationPath, SourcePath, fc):
     error = None
     if os.path.exists(DestinationPath) and (os.path.islink(DestinationPath) or os.path.isdir(DestinationPath)):
@@ -737,7 +1472,7 @@ def SetFile(DestinationPath, SourcePath, fc):
         else:
             should_copy_file = True
         if should_copy_file:
-            if CopyFile(SourcePath, DestinationPath) is not None :
+            if CopyFile(SourcePath, DestinationPath, *CopyAttributes(fc)) is not None :
                 return False
     elif fc.Contents:
         if WriteFile(DestinationPath, fc.Contents) is not None:
@@ -754,10 +1489,9 @@ def SetFile(DestinationPath, SourcePath, fc):
         except IOError as error:
             print("Exception creating file " + DestinationPath + " Error Code: " + str(error.errno) + " Error: " +error.strerror, file=sys.stderr)
             LG().Log('ERROR', "Exception creating file " + DestinationPath + " Error Code: " + str(error.errno) + " Error: " + error.strerror)
+    # fc.LocalPath belongs to RemoteFiles, which compares the next
+    # download against it
     SetOwnerGroupMode(DestinationPath, SourcePath, fc)
-    if len(fc.LocalPath) > 0 :
-        if RemoveFile(fc.LocalPath) is not None:
-            return False
     return True
 
 
@@ -870,6 +1604,13 @@ def TestDirectory(DestinationPath, SourcePath, fc):
     if not os.path.exists(DestinationPath) or not os.path.isdir(DestinationPath):
         return False
 
+    if fc.Recurse and HAVE_SCANDIR:
+        plan = PlanDirectory(DestinationPath, SourcePath, fc, limit=1)
+        if plan.entries:
+            LG().Log('DEBUG', lambda: "Test of " + DestinationPath + " failed at: " + FormatPlan(plan))
+            return False
+        return True
+
     if TestOwnerGroupMode(DestinationPath, SourcePath, fc) is False:
         return False
 
@@ -1028,8 +1769,8 @@ def Get(DestinationPath, SourcePath, Ensure, Type, Force, Contents, Checksum, Re
     Ensure = "present"
     stat_info = os.lstat(DestinationPath)
 
-    Owner = pwd.getpwuid(stat_info.st_uid)[0]
-    Group = grp.getgrgid(stat_info.st_gid)[0]
+    Owner = identitycache.user_name(stat_info.st_uid)
+    Group = identitycache.group_name(stat_info.st_gid)
     Mode = str(oct(stat_info.st_mode))[-3:]
     if os.path.islink(DestinationPath):
         Type = "link"
@@ -1079,17 +1820,12 @@ def SetProxyFromConf():
     HTTP_PROXY
     HTTPS_PROXY
     """
-    path = helperlib.CONFIG_SYSCONFDIR + '/' + helperlib.CONFIG_SYSCONFDIR_DSC + '/dsc.conf'
-    txt, error = ReadFile(path)
-    if error :
-        return
-    for l in txt.splitlines():
-        if l.startswith('PROXY'):
-            info = l.split('=')[1].strip()
-            if 'https' in info:
-                os.environ['HTTPS_PROXY'] = info
-            if 'http:' in info:
-                os.environ['HTTP_PROXY'] = info
+    info = helperlib.read_dsc_conf().get('PROXY')
+    if info:
+        if 'https' in info:
+            os.environ['HTTPS_PROXY'] = info
+        if 'http:' in info:
+            os.environ['HTTP_PROXY'] = info
     return
 
 def GetRemoteFileWithRetries(fc):
@@ -1115,30 +1851,21 @@ def GetRemoteFileWithRetries(fc):
     return ret
         
 def GetRemoteFile(fc):
+    """
+    Points fc.LocalPath at a copy of the remote SourcePath, downloaded
+    only if the server has changed it since the last time.
+    """
     SetProxyFromConf()
-    req = urllib.request.Request(fc.SourcePath)
-    resp = urllib.request.urlopen(req)
-    fc.LocalPath = '/tmp/'+os.path.basename(fc.DestinationPath)+'_remote'
-    data=b'keep going'
-    hasWritten = False
-    with (open(fc.LocalPath, 'wb+')) as F:
-        try:
-            while data:
-                data = resp.read(1048576)
-                if data is not None and len(data) > 0:
-                    hasWritten = True
-                    F.write(data)
-            if hasWritten == False:
-                LG().Log('ERROR', "Data at URL: " + fc.SourcePath + " was empty. Please ensure this file exists at this remote location.")
-                F.close()
-                os.unlink(fc.LocalPath)
-                return 1
-        except Exception as e:
-            F.close()
-            os.unlink(fc.LocalPath)
-            print(repr(e))
-            LG().Log('ERROR', repr(e))
-            return 1
+    try:
+        path, meta = RemoteFiles.fetch(fc.SourcePath)
+    except (IOError, OSError) as e:
+        print(repr(e))
+        LG().Log('ERROR', repr(e))
+        return 1
+    if not meta['length']:
+        LG().Log('ERROR', "Data at URL: " + fc.SourcePath + " was empty. Please ensure this file exists at this remote location.")
+        return 1
+    fc.LocalPath = path
     return 0
 
 def TestRemoteFileWithRetries(fc):
@@ -1165,11 +1892,8 @@ def TestRemoteFileWithRetries(fc):
 
 def TestRemoteFile(fc):
     SetProxyFromConf()
-    req = urllib.request.Request(fc.SourcePath)
-    resp = urllib.request.urlopen(req)
-    h = resp.info()
     if fc.Checksum != 'md5' :  # if not 'md5' check the last_modified header time before we download
-        lm = h.get('last-modified')
+        lm = RemoteFiles.head(fc.SourcePath)['last_modified']
         remote_mtime = GetTimeFromString(lm)
         destination_mtime = None
         dst_st = None
@@ -1185,25 +1909,13 @@ def TestRemoteFile(fc):
         else:
             return False
     #md5
+    path, meta = RemoteFiles.fetch(fc.SourcePath)
     if not os.path.exists(fc.DestinationPath):
         return False
-    src_data=b'keep going'
-    dest_data=b'keep going'
-    src_hash = md5const()
-    dest_hash = md5const()
-    with (open(fc.DestinationPath, 'rb')) as F:
-        try:
-            while src_data or dest_data:
-                src_data = resp.read(1048576)
-                src_hash.update(src_data)
-                dest_data = F.read(1048576)
-                dest_hash.update(dest_data)
-                if src_hash.hexdigest() != dest_hash.hexdigest():
-                    return False
-        except Exception as e:
-            F.close()
-            return False
-    return True
+    try:
+        return Md5Cache.digest(fc.DestinationPath) == meta['md5']
+    except (IOError, OSError):
+        return False
 
 
 class FileContext:
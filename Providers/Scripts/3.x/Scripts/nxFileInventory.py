@@ -10,15 +10,26 @@ from __future__ import with_statement
 from contextlib import contextmanager
 
 import os
-import pwd
-import grp
+import stat
 import codecs
-import fnmatch
-import copy
+import threading
+import time
 import imp
+from collections import deque
+try:
+    from concurrent.futures import ThreadPoolExecutor, Future
+except ImportError:
+    ThreadPoolExecutor = Future = None
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+helperlib = imp.load_source('helperlib', '../helperlib.py')
+identitycache = imp.load_source('identitycache', '../identitycache.py')
+inventorysnapshot = imp.load_source('inventorysnapshot', '../inventorysnapshot.py')
+pathglob = imp.load_source('pathglob', '../pathglob.py')
 LG = nxDSCLog.DSCLog
+# Inventory only reads the file system, client.py may run requests for
+# this provider concurrently with other providers.
+THREAD_SAFE = True
 try:
     import hashlib
     md5const = hashlib.md5
@@ -29,6 +40,25 @@ except ImportError: # Only sha-1 is available for python2.4.
     import sha
     shaconst = sha.sha
 
+# os.scandir (python 3.5) hands out the type and stat data of directory
+# entries, so the walk needs no second stat of what it lists.
+HAVE_SCANDIR = hasattr(os, 'scandir')
+
+# md5 and sha-256 checksums are computed by this many threads while the
+# walk goes on; nxFileInventoryChecksumWorkers=<n> in dsc.conf overrides
+# it and 1 computes them in the walk.
+DefaultChecksumWorkers = min(os.cpu_count() or 1, 4)
+# Records waiting for their checksum, per worker.
+ChecksumWindow = 64
+ChecksumBlockSize = 1048576
+# Smaller files are read in the walk, a thread costs more than they do.
+ChecksumPoolMinSize = 65536
+
+
+SnapshotDir = helperlib.PYTHON_PID_DIR + '/cache/nxFileInventory'
+# Key of the stat result of a record, for its snapshot entry.
+SnapshotStat = 'StatInfo'
+
 # [ClassVersion("1.0.0"), Description("The configuration provider for files and directories."), FriendlyName("nxFileInventory")]
 # class MSFT_nxFileInventoryResource:OMI_BaseResource
 # {
@@ -110,11 +140,21 @@ def Inventory_Marshall(DestinationPath, Recurse, Links, Checksum, Type, MaxConte
     DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo \
                      = init_locals(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo)
     retval = 0
+    Inventory = DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo)
+    _Inventory = protocol.MI_InstanceStreamA(MarshallInventory(Inventory, MaxContentsReturnable, MaxOutputSize))
+    retd = {}
+    retd["__Inventory"] = _Inventory
+    return retval, retd
+
+
+def MarshallInventory(Inventory, MaxContentsReturnable, MaxOutputSize):
+    """
+    Yield the entries of Inventory as MI instances until the xml output
+    would reach MaxOutputSize.
+    """
     out_size_cur = 158 # xml output header + footer length.
     xml_overhead_array_element = 99 # xml output overhead per Inventory array entry.
     xml_overhead_param = 102 # xml output overhead per Inventory parameter.
-    _Inventory = []
-    Inventory = DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo)
     for d in Inventory:
         if out_size_cur <  MaxOutputSize:
             out_size_cur += xml_overhead_array_element
@@ -136,15 +176,156 @@ def Inventory_Marshall(DestinationPath, Recurse, Links, Checksum, Type, MaxConte
         d['Group'] = protocol.MI_String(d['Group'])
         d['Owner'] = protocol.MI_String(d['Owner'])
         d['FileSize'] = protocol.MI_Uint64(d['FileSize'])
-        _Inventory.append(d)
-    _Inventory = protocol.MI_InstanceA(_Inventory)
-    retd = {}
-    retd["__Inventory"] = _Inventory
-    return retval, retd
+        yield d
 
 
 def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, MaxOutputSize, UseSudo):
-    Inventory = []
+    """
+    Yield the inventory records of DestinationPath in walk order.
+
+    With md5 or sha-256 checksums, unless nxFileInventorySnapshot=false
+    in dsc.conf, or with nxFileInventoryDelta=true, what the inventory
+    finds is kept in a snapshot for the next inventory with the same
+    parameters, written once the records are read to the end.  Files
+    whose stat did not change since are not read again for their
+    checksum.  In delta mode only the records that are new or differ
+    from the snapshot are yielded, followed by a record of Type
+    'removed', as the snapshot had it, for each path that is gone.
+    """
+    conf = helperlib.dsc_conf()
+    delta = conf.get('nxFileInventoryDelta', '').lower() == 'true'
+    if not delta and not ((Checksum == 'md5' or Checksum == 'sha-256')
+                          and conf.get('nxFileInventorySnapshot', '').lower() != 'false'):
+        for d in ChecksumInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable):
+            yield d
+        return
+    path = SnapshotPath(DestinationPath, Recurse, Links, Checksum, Type)
+    known = inventorysnapshot.Snapshot(path)
+    writer = None
+    try:
+        try:
+            writer = inventorysnapshot.Writer(path, time.time())
+        except (IOError, OSError) as e:
+            LG().Log('WARNING', 'Unable to write inventory snapshot ' + path + ': ' + str(e))
+        for d in ChecksumInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, known):
+            entry = inventorysnapshot.make_entry(d['DestinationPath'], d.pop(SnapshotStat), d['Type'],
+                                                 d['Owner'], d['Group'], SnapshotChecksum(d['Checksum']))
+            if writer is not None:
+                try:
+                    writer.add(entry)
+                except (IOError, OSError) as e:
+                    LG().Log('WARNING', 'Unable to write inventory snapshot ' + path + ': ' + str(e))
+                    writer.abort()
+                    writer = None
+            if delta and known.find(entry[0]) == entry:
+                continue
+            yield d
+        if writer is None:
+            # without the new snapshot, what is gone cannot be told
+            return
+        try:
+            current = writer.finish()
+        except (IOError, OSError) as e:
+            LG().Log('WARNING', 'Unable to write inventory snapshot ' + path + ': ' + str(e))
+            return
+        try:
+            if delta:
+                for entry in known:
+                    if current.find(entry[0]) is None:
+                        yield RemovedRecord(entry, Checksum)
+        finally:
+            current.close()
+        try:
+            writer.install()
+        except (IOError, OSError) as e:
+            LG().Log('WARNING', 'Unable to write inventory snapshot ' + path + ': ' + str(e))
+    finally:
+        if writer is not None:
+            writer.abort()
+        known.close()
+
+
+def SnapshotPath(DestinationPath, Recurse, Links, Checksum, Type):
+    """
+    The snapshot file of an inventory with these parameters.
+    """
+    key = repr((DestinationPath, bool(Recurse), Links, Checksum, Type))
+    return SnapshotDir + '/' + md5const(key.encode('utf-8', 'surrogateescape')).hexdigest() + '.' + str(os.getuid())
+
+
+def SnapshotChecksum(Checksum):
+    """
+    The Checksum of a record as a snapshot keeps it: the hash alone of
+    an md5 or sha-256 checksum, which has the path in it.
+    """
+    Checksum = str(Checksum)
+    if Checksum.startswith('@{'):
+        return Checksum.split(' Hash=', 1)[1].split(' ', 1)[0]
+    return Checksum
+
+
+def KnownChecksum(known, fname, stat_info):
+    """
+    The hash of file 'fname' in snapshot 'known', if the file has not
+    changed since; otherwise None.
+    """
+    entry = known.find(fname)
+    if entry is None or entry[10] in ('', '0') or not known.unchanged(entry, stat_info):
+        return None
+    return entry[10]
+
+
+def RemovedRecord(entry, Checksum):
+    """
+    The record, of Type 'removed', of snapshot entry 'entry'.
+    """
+    path, dev, ino, size, mtime_ns, ctime_ns, mode, type, owner, group, checksum = entry
+    if (Checksum == 'md5' or Checksum == 'sha-256') and checksum not in ('', '0'):
+        checksum = fileContentChecksum.format(Checksum.upper(), checksum, path)
+    return {'DestinationPath': path, 'Type': 'removed', 'Owner': owner, 'Group': group,
+            'Mode': str(oct(mode))[-3:], 'ModifiedDate': int(mtime_ns / 1e9), 'CreatedDate': int(ctime_ns / 1e9),
+            'FileSize': size, 'Checksum': checksum, 'Contents': ''}
+
+
+def ChecksumInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, known=None):
+    """
+    Yield the inventory records of DestinationPath in walk order.  The
+    md5 and sha-256 checksums of files are computed on a pool of threads,
+    if there is one, while the walk goes on; a record waits in a window
+    of ChecksumWindow records per worker until its checksum is done.
+    """
+    pool = None
+    if Checksum == 'md5' or Checksum == 'sha-256':
+        workers = GetChecksumWorkersFromConf()
+        pool = NewChecksumPool(workers)
+    if pool is None:
+        for d in ListInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, None, known):
+            yield d
+        return
+    window = ChecksumWindow * workers
+    pending = deque()
+    try:
+        for d in ListInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, pool, known):
+            pending.append(d)
+            if len(pending) >= window:
+                yield ResolveChecksum(pending.popleft(), Checksum)
+        while pending:
+            yield ResolveChecksum(pending.popleft(), Checksum)
+    finally:
+        # the records left when the caller stops early are not needed
+        for d in pending:
+            if isinstance(d.get('Checksum'), Future):
+                d['Checksum'].cancel()
+        pool.shutdown()
+
+
+def ListInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsReturnable, pool=None, known=None):
+    """
+    Yield the inventory records of DestinationPath, leaving out the
+    paths of nxFileInventoryExclude in dsc.conf.  A DestinationPath
+    with a '**' component is walked by GlobInventory.
+    """
+    path_filter = NewPathFilter()
     full_path = DestinationPath.split('/')
     if full_path[-1] == '':
         full_path[-1] = '*'
@@ -161,19 +342,52 @@ def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsRetu
     if not os.path.exists(top):
         print("Error: Unable to read 'DestinationPath': " + DestinationPath)
         LG().Log("ERROR","Unable to read 'DestinationPath': " + DestinationPath)
-        return Inventory
+        return
     if not wildcard_path:
         if Links == 'ignore' and os.path.islink(top):
-            return Inventory
+            return
         if Type != 'directory' and os.path.isfile(top): # This is s single file.
-            d = GetFileInfo(top, Links, MaxContentsReturnable, Checksum)
+            if path_filter is not None and path_filter.skip(top):
+                return
+            d = GetFileInfo(top, Links, MaxContentsReturnable, Checksum, pool=pool, known=known)
             if 'DestinationPath' in d.keys():
-                Inventory.append(copy.deepcopy(d))
-            return Inventory
+                yield d
+            return
         if '*' not in full_path[-1] and '?' not in full_path[-1]:
             full_path.append('*') # It is a directory without the trailing '/', so add it.
+    if '**' in full_path:
+        walk = GlobInventory(top, pathglob.PathGlob('/'.join(full_path)), Links, Checksum, Type,
+                             MaxContentsReturnable, pool, known, path_filter)
+    elif HAVE_SCANDIR:
+        walk = ScanInventory(top, full_path, wildcard_path, Recurse, Links, Checksum, Type,
+                             MaxContentsReturnable, pool, known, path_filter)
+    else:
+        walk = WalkInventory(top, full_path, wildcard_path, Recurse, Links, Checksum, Type,
+                             MaxContentsReturnable, pool, known, path_filter)
+    for d in walk:
+        yield d
+
+
+def NewPathFilter():
+    """
+    Returns the pathglob.PathFilter of the nxFileInventoryExclude and
+    nxFileInventoryInclude settings of dsc.conf, comma separated path
+    patterns, or None if nothing is excluded.
+    """
+    conf = helperlib.dsc_conf()
+    exclude = pathglob.parse_list(conf.get('nxFileInventoryExclude'))
+    if not exclude:
+        return None
+    return pathglob.PathFilter(exclude, pathglob.parse_list(conf.get('nxFileInventoryInclude')))
+
+
+def WalkInventory(top, full_path, wildcard_path, Recurse, Links, Checksum, Type, MaxContentsReturnable, pool=None, known=None, path_filter=None):
+    """
+    Yield the inventory of 'top' for DoInventory through os.walk.
+    """
     dirs = set()
     full_path_len =  len(full_path)
+    match = [pathglob.compile_name(p) for p in full_path]
     for dirpath, dirnames, filenames in os.walk(top, followlinks=(Links == 'follow'), topdown=True):
         dlen = len(dirpath.split('/'))
         if dirpath.split('/')[-1] == '':
@@ -182,68 +396,270 @@ def DoInventory(DestinationPath, Recurse, Links, Checksum, Type, MaxContentsRetu
             do_wildcard = True
         else :
             do_wildcard = False
-        st = os.stat(dirpath)
         scandirs = []
         if dlen+1 == full_path_len  or ( Recurse and dlen >= full_path_len ):
             for filename in filenames:
                 if (dlen+1 == full_path_len  or ( Recurse and dlen >= full_path_len )) \
-                       and not fnmatch.fnmatch(filename, full_path[-1]):
+                       and match[-1](filename) is None:
+                    continue
+                if path_filter is not None and path_filter.skip(os.path.join(dirpath, filename)):
                     continue
                 if Type != 'directory':
                     d = GetFileInfo(os.path.join(dirpath, filename),\
-                                    Links, MaxContentsReturnable, Checksum)
+                                    Links, MaxContentsReturnable, Checksum, pool=pool, known=known)
                     if 'DestinationPath' in d.keys():
-                        Inventory.append(copy.deepcopy(d))
+                        yield d
         for dirname in dirnames:
             if not ( Recurse and dlen+1 >= full_path_len ):
-                if ( do_wildcard and not fnmatch.fnmatch(dirname, full_path[dlen]) ) or \
+                if ( do_wildcard and match[dlen](dirname) is None ) or \
                        ( not Recurse and dlen > full_path_len ):
                     continue
+            if path_filter is not None and not path_filter.enter(os.path.join(dirpath, dirname)):
+                continue
             st = os.stat(os.path.join(dirpath, dirname)) # use Lstat if follow?
             dirkey = st.st_dev, st.st_ino
             if dirkey not in dirs:
                 if Recurse or (not Recurse and dlen+1 < full_path_len)  :
                     dirs.add(dirkey)
                     scandirs.append(dirname)
-            if Type != 'file' and ( dlen+1 == full_path_len  or  ( Recurse and dlen >= full_path_len ) ) :
-                d = GetDirInfo(os.path.join(dirpath, dirname), st, Checksum, Links)
+            if Type != 'file' and ( dlen+1 == full_path_len  or  ( Recurse and dlen >= full_path_len ) ) \
+                   and ( path_filter is None or not path_filter.skip(os.path.join(dirpath, dirname)) ):
+                d = GetDirInfo(os.path.join(dirpath, dirname), st, Checksum, Links, known=known)
                 if 'DestinationPath' in d.keys():
-                    Inventory.append(copy.deepcopy(d))
+                    yield d
         dirnames[:] = scandirs
-    return Inventory
 
 
-def GetFileInfo(fname, Links, MaxContentsReturnable, Checksum):
+def ScanInventory(top, full_path, wildcard_path, Recurse, Links, Checksum, Type, MaxContentsReturnable, pool=None, known=None, path_filter=None):
+    """
+    Yield the inventory of 'top' for DoInventory in the order of
+    WalkInventory, from one os.scandir per directory: files are
+    described from the lstat of their entry, directories from their
+    stat, which is the only stat taken of them.  Directories are walked
+    once, by (st_dev, st_ino), and symlinks to directories only if
+    Links is 'follow'; as with os.walk, a symlink that is not followed
+    still takes the (st_dev, st_ino) of its directory.  A directory
+    where no file is listed and only one name, without wildcards, can
+    be walked is not listed either, that name is looked up.
+    """
+    dirs = set()
+    full_path_len = len(full_path)
+    match = [pathglob.compile_name(p) for p in full_path]
+    literal = [pathglob.is_literal(p) for p in full_path]
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        dlen = len(dirpath.split('/'))
+        if dirpath.endswith('/'):
+            dlen -= 1
+        do_wildcard = wildcard_path and full_path_len >= dlen+1
+        listed = dlen+1 == full_path_len or ( Recurse and dlen >= full_path_len )
+        if do_wildcard and not listed and literal[dlen] and not ( Recurse and dlen+1 >= full_path_len ):
+            it = [PathEntry(dirpath, full_path[dlen])]
+        else:
+            try:
+                it = os.scandir(dirpath)
+            except OSError:
+                continue
+        # files are described as they are listed, only directories are kept
+        subdirs = []
+        try:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdirs.append(entry)
+                elif listed and Type != 'directory' and match[-1](entry.name) is not None:
+                    if path_filter is not None and path_filter.skip(entry.path):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    d = GetFileInfo(entry.path, Links, MaxContentsReturnable, Checksum, st, entry.is_symlink(), pool, known)
+                    if 'DestinationPath' in d:
+                        yield d
+        except OSError:
+            pass
+        finally:
+            if hasattr(it, 'close'): # python < 3.6
+                it.close()
+        scandirs = []
+        for entry in subdirs:
+            if not ( Recurse and dlen+1 >= full_path_len ):
+                if ( do_wildcard and match[dlen](entry.name) is None ) or \
+                       ( not Recurse and dlen > full_path_len ):
+                    continue
+            if path_filter is not None and not path_filter.enter(entry.path):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            is_link = entry.is_symlink()
+            dirkey = st.st_dev, st.st_ino
+            if dirkey not in dirs and ( Recurse or dlen+1 < full_path_len ):
+                dirs.add(dirkey)
+                if Links == 'follow' or not is_link:
+                    scandirs.append(entry.path)
+            if Type != 'file' and listed and ( path_filter is None or not path_filter.skip(entry.path) ):
+                d = GetDirInfo(entry.path, st, Checksum, Links, is_link, known)
+                if 'DestinationPath' in d:
+                    yield d
+        scandirs.reverse()
+        stack.extend(scandirs)
+
+
+def GlobInventory(top, glob, Links, Checksum, Type, MaxContentsReturnable, pool=None, known=None, path_filter=None):
+    """
+    Yield the inventory of 'top' for DoInventory of a DestinationPath
+    with a '**' component, compiled in pathglob.PathGlob 'glob': the
+    files and directories whose path matches it, whatever Recurse is.
+    A directory below which nothing can match is not walked at all, nor
+    listed when only names without wildcards can match there, those are
+    looked up.  Otherwise, as in ScanInventory, directories are walked once, by
+    (st_dev, st_ino) and the states of the pattern reached there, and
+    symlinks to directories only if Links is 'follow'.
+    """
+    dirs = set()
+    stack = [(top, glob.states(top))]
+    while stack:
+        dirpath, states = stack.pop()
+        names = glob.names(states)
+        try:
+            if names is not None:
+                it = [PathEntry(dirpath, name) for name in sorted(names)]
+            elif HAVE_SCANDIR:
+                it = os.scandir(dirpath)
+            else:
+                it = [PathEntry(dirpath, name) for name in os.listdir(dirpath)]
+        except OSError:
+            continue
+        subdirs = []
+        try:
+            for entry in it:
+                s = glob.step(states, entry.name)
+                if not s:
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdirs.append((entry, s))
+                elif Type != 'directory' and glob.matches(s):
+                    if path_filter is not None and path_filter.skip(entry.path):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    d = GetFileInfo(entry.path, Links, MaxContentsReturnable, Checksum, st, entry.is_symlink(), pool, known)
+                    if 'DestinationPath' in d:
+                        yield d
+        except OSError:
+            pass
+        finally:
+            if hasattr(it, 'close'):
+                it.close()
+        scandirs = []
+        for entry, s in subdirs:
+            if path_filter is not None and not path_filter.enter(entry.path):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            is_link = entry.is_symlink()
+            dirkey = st.st_dev, st.st_ino, s
+            if dirkey not in dirs and glob.below(s):
+                dirs.add(dirkey)
+                if Links == 'follow' or not is_link:
+                    scandirs.append((entry.path, s))
+            if Type != 'file' and glob.matches(s) and ( path_filter is None or not path_filter.skip(entry.path) ):
+                d = GetDirInfo(entry.path, st, Checksum, Links, is_link, known)
+                if 'DestinationPath' in d:
+                    yield d
+        scandirs.reverse()
+        stack.extend(scandirs)
+
+
+class PathEntry(object):
+    """
+    What an os.DirEntry tells of 'name' in directory 'dirpath', from
+    stat calls: for a name looked up rather than listed, and where
+    there is no os.scandir.
+    """
+
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self.st = None
+        self.lst = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            if self.lst is None:
+                self.lst = os.lstat(self.path)
+            return self.lst
+        if self.st is None:
+            self.st = os.stat(self.path)
+        return self.st
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        try:
+            return stat.S_ISLNK(self.stat(False).st_mode)
+        except OSError:
+            return False
+
+
+def GetFileInfo(fname, Links, MaxContentsReturnable, Checksum, stat_info=None, is_link=None, pool=None, known=None):
     """
     Return a dictionary of info for file.
     If 'Links' == 'follow', no link files will appear here,
     those links will be sent to GetDirInfo() as direcroties.
     Therefore only LStatFile is used.
     If file is link and 'Links' == 'ignore' {} is returned.
+    'stat_info' and 'is_link', when the caller has them, spare
+    the lstat of the file.  With a 'pool', the md5 or sha-256
+    'Checksum' is the Future of GetChecksum, for ResolveChecksum.  With
+    a snapshot 'known', the checksum of a file that did not change is
+    taken from it, and the record keeps its stat result for the snapshot.
     """
-    fileContentChecksum = "@{{Algoritm={0} Hash={1} Path={2}}}"
     d = {}
 
     if fname.endswith("omsadmin.conf"):
        return d
 
-    if os.path.islink(fname):
+    if is_link is None:
+        is_link = os.path.islink(fname)
+    if is_link:
         d['Type'] = 'link'
     else :
         d['Type'] = 'file'
     if d['Type'] == 'link' and Links == 'ignore':
         return {}
-    stat_info = None
-    stat_info = LStatFile(fname)
+    if stat_info is None:
+        stat_info = LStatFile(fname)
     if stat_info == None:
         return {}
     d['DestinationPath'] = fname
+    if known is not None:
+        d[SnapshotStat] = stat_info
     try:
-        d['Owner'] = pwd.getpwuid(stat_info.st_uid).pw_name
+        d['Owner'] = identitycache.user_name(stat_info.st_uid)
     except:
         d['Owner'] = str(stat_info.st_uid)
     try:
-        d['Group'] = grp.getgrgid(stat_info.st_gid).gr_name
+        d['Group'] = identitycache.group_name(stat_info.st_gid)
     except:
         d['Group'] = str(stat_info.st_gid)
     d['Mode'] = str(oct(stat_info.st_mode))[-3:]
@@ -263,11 +679,19 @@ def GetFileInfo(fname, Links, MaxContentsReturnable, Checksum):
        return d
 
     if Checksum == 'md5' or Checksum == 'sha-256':
-       try:
-        fileHash = GetChecksum(fname,Checksum)
-        d['Checksum'] = fileContentChecksum.format(Checksum.upper(), fileHash.upper(), fname)
-       except:
-        d['Checksum'] = 0 
+       fileHash = None
+       if known is not None and d['Type'] != 'link': # the stat is not the target's
+        fileHash = KnownChecksum(known, fname, stat_info)
+       if fileHash is not None:
+        d['Checksum'] = fileContentChecksum.format(Checksum.upper(), fileHash, fname)
+       elif pool is not None and stat_info.st_size >= ChecksumPoolMinSize:
+        d['Checksum'] = pool.submit(GetChecksum, fname, Checksum)
+       else:
+        try:
+         fileHash = GetChecksum(fname,Checksum)
+         d['Checksum'] = fileContentChecksum.format(Checksum.upper(), fileHash.upper(), fname)
+        except:
+         d['Checksum'] = 0 
     elif Checksum == "ctime":
         d['Checksum']= str(int(stat_info.st_ctime))
     else : # Checksum == "mtime":
@@ -280,7 +704,23 @@ def GetFileInfo(fname, Links, MaxContentsReturnable, Checksum):
         d['Contents'] = ''
     return d
 
-def GetDirInfo(dname, stat_info, Checksum, Links):
+fileContentChecksum = "@{{Algoritm={0} Hash={1} Path={2}}}"
+
+
+def ResolveChecksum(d, Checksum):
+    """
+    Replace the Future of GetChecksum in record 'd' with the checksum.
+    """
+    future = d.get('Checksum')
+    if isinstance(future, Future):
+        try:
+            d['Checksum'] = fileContentChecksum.format(Checksum.upper(), future.result().upper(), d['DestinationPath'])
+        except:
+            d['Checksum'] = 0
+    return d
+
+
+def GetDirInfo(dname, stat_info, Checksum, Links, is_link=None, known=None):
     """
     Return a dictionary of info for directory.
     Only if 'Links' == 'follow' will links be
@@ -291,12 +731,14 @@ def GetDirInfo(dname, stat_info, Checksum, Links):
         return d
     d['Type'] = 'directory'
     d['DestinationPath'] = dname
+    if known is not None:
+        d[SnapshotStat] = stat_info
     try:
-        d['Owner'] = pwd.getpwuid(stat_info.st_uid).pw_name
+        d['Owner'] = identitycache.user_name(stat_info.st_uid)
     except:
         d['Owner'] = str(stat_info.st_uid)
     try:
-        d['Group'] = grp.getgrgid(stat_info.st_gid).gr_name
+        d['Group'] = identitycache.group_name(stat_info.st_gid)
     except:
         d['Group'] = str(stat_info.st_gid)
     if Checksum == 'md5' or Checksum == 'sha-256':
@@ -310,7 +752,9 @@ def GetDirInfo(dname, stat_info, Checksum, Links):
     d['CreatedDate'] = int(stat_info.st_ctime)
     d['FileSize'] = stat_info.st_size
     d['Contents'] = ''
-    if Links == 'manage' and os.path.islink(dname):
+    if is_link is None and Links == 'manage':
+        is_link = os.path.islink(dname)
+    if Links == 'manage' and is_link:
         d['Contents'] = 'Symlink to ' + os.readlink(dname)
     return d
 
@@ -382,17 +826,95 @@ def StatFile(path):
     return d
 
 def GetChecksum(fname, Checksum):
+    """
+    The hex digest of file 'fname', read in ChecksumBlockSize blocks at
+    no more than the configured rate; "" if it cannot be opened.
+    """
     src_error = None
     src_block = b'loopme'
     if Checksum == "md5":
         src_hash = md5const()
     else : # sha-256
         src_hash = shaconst()
+    limit = GetChecksumRateLimit()
     with opened_bin_w_error(fname, 'rb') as (src_file, src_error):
         if src_error:
             return ""
         while src_block :
-            src_block = src_file.read(8192)
+            src_block = src_file.read(ChecksumBlockSize)
             src_hash.update(src_block)
+            limit.take(len(src_block))
         return src_hash.hexdigest()
 
+
+class RateLimit(object):
+    """
+    Paces the reads of every thread that takes from it to 'rate' bytes a
+    second, or not at all if 'rate' is 0.  Each read books the time it
+    is worth at that rate after the reads before it and waits for its
+    turn, so a burst is at most one block.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def take(self, size):
+        if not self.rate or not size:
+            return
+        self.lock.acquire()
+        try:
+            now = time.time()
+            start = max(self.next, now)
+            self.next = start + size / float(self.rate)
+        finally:
+            self.lock.release()
+        if start > now:
+            time.sleep(start - now)
+
+
+# Shared by every inventory of the process, which client.py may run
+# concurrently; created from dsc.conf the first time it is needed.
+try:
+    ChecksumRateLimit
+except NameError:
+    ChecksumRateLimit = None
+
+
+def GetChecksumRateLimit():
+    """
+    Returns the RateLimit of the nxFileInventoryChecksumRate setting of
+    dsc.conf, in megabytes a second; unlimited if it is not set.
+    """
+    global ChecksumRateLimit
+    if ChecksumRateLimit is None:
+        try:
+            rate = float(helperlib.dsc_conf().get('nxFileInventoryChecksumRate', 0))
+        except ValueError:
+            rate = 0
+        ChecksumRateLimit = RateLimit(max(int(rate * 1000000), 0))
+    return ChecksumRateLimit
+
+
+def GetChecksumWorkersFromConf():
+    """
+    Returns the nxFileInventoryChecksumWorkers setting of dsc.conf, or
+    DefaultChecksumWorkers.
+    """
+    try:
+        return max(int(helperlib.dsc_conf().get('nxFileInventoryChecksumWorkers', DefaultChecksumWorkers)), 1)
+    except ValueError:
+        return DefaultChecksumWorkers
+
+
+def NewChecksumPool(workers):
+    """
+    Returns a pool of 'workers' threads, or None when checksums are to be
+    computed in the walk.
+    """
+    if workers < 2 or ThreadPoolExecutor is None:
+        return None
+    return ThreadPoolExecutor(workers)
+
+
@@ -13,6 +13,7 @@ import codecs
 
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+changejournal = imp.load_source('changejournal', '../changejournal.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxFileLine")]
@@ -54,7 +55,16 @@ def Test_Marshall(FilePath, DoesNotContainPattern, ContainsLine):
         LG().Log(
             'ERROR', "Error: 'DoesNotContainPattern' or 'ContainsLine' must be specified.\n")
         return [-1]
+    journal = changejournal.get_journal()
+    if journal is not None:
+        key = ('nxFileLine', FilePath, DoesNotContainPattern, ContainsLine)
+        retval = journal.cached(key)
+        if retval is not None:
+            return list(retval)
+        token = journal.begin(changejournal.watched_paths([FilePath]))
     retval = Test(FilePath, DoesNotContainPattern, ContainsLine)
+    if journal is not None:
+        journal.remember(key, token, list(retval))
     return retval
 
 
@@ -15,6 +15,7 @@ import fnmatch
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+identitycache = imp.load_source('identitycache', '../identitycache.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxGroup"),SupportsInventory()]
@@ -58,6 +59,7 @@ def Set_Marshall(GroupName, Ensure, Members, MembersToInclude, MembersToExclude,
                   MembersToExclude, PreferredGroupID)
     retval = Set(GroupName, Ensure, Members, MembersToInclude,
                  MembersToExclude, PreferredGroupID)
+    identitycache.invalidate()
     return retval
 
 
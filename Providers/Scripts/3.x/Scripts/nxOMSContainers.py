@@ -16,6 +16,7 @@ import shutil
 
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+filecompare = imp.load_source('filecompare', '../filecompare.py')
 
 LG = nxDSCLog.DSCLog
 
@@ -206,34 +207,13 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
         return -1
 
     if Checksum == "md5":
-        src_error = None
-        dest_error = None
-        src_hash = md5const()
-        dest_hash = md5const()
-        src_block = 'loopme'
-        dest_block = 'loopme'
-        src_file,src_error = opened_bin_w_error(SourcePath, 'rb')
-        if src_error:
-            LG().Log('ERROR', "Exception opening source file " + SourcePath + " Error : " + str(src_error))
+        try:
+            if filecompare.files_equal(SourcePath, DestinationPath):
+                return 0
             return -1
-        dest_file, dest_error = opened_bin_w_error(DestinationPath, 'rb')
-        if dest_error:
-            LG().Log('ERROR', "Exception opening destination file " + DestinationPath + " Error : " + str(dest_error))
-            src_file.close()
+        except (IOError, OSError) as e:
+            LG().Log('ERROR', "Exception opening file " + str(e.filename) + " Error : " + str(e))
             return -1
-        while src_block != '' and dest_block != '':
-            src_block = src_file.read(BLOCK_SIZE)
-            dest_block = dest_file.read(BLOCK_SIZE)
-            src_hash.update(src_block)
-            dest_hash.update(dest_block)
-            if src_hash.hexdigest() != dest_hash.hexdigest():
-                src_file.close()
-                dest_file.close()
-                return -1  
-        if src_hash.hexdigest() == dest_hash.hexdigest():
-            src_file.close()
-            dest_file.close()
-            return 0  
     elif Checksum == "ctime":
         if stat_src.st_ctime != stat_dest.st_ctime:
             return -1
@@ -16,6 +16,7 @@ import platform
 
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
+filecompare = imp.load_source('filecompare', '../filecompare.py')
 
 LG = nxDSCLog.DSCLog
 try:
@@ -443,34 +444,14 @@ def CompareFiles(DestinationPath, SourcePath, Checksum):
     if stat_src.st_size != stat_dest.st_size:
         return -1
     if Checksum == 'sha256':
-        src_error = None
-        dest_error = None
-        src_hash = hashconst()
-        dest_hash = hashconst()
-        src_block = b'loopme'
-        dest_block = b'loopme'
-        with opened_bin_w_error(SourcePath, 'rb') as (src_file, src_error):
-            if src_error:
-                print_error('Exception opening source file ' + SourcePath
-                            + ' Error : ' + str(src_error))
-                return -1
-            with opened_bin_w_error(DestinationPath, 'rb') as (dest_file,
-                    dest_error):
-                if dest_error:
-                    print_error('Exception opening destination file '
-                                + DestinationPath + ' Error Code: '
-                                + str(dest_error.errno) + ' Error: '
-                                + dest_error.strerror)
-                    return -1
-                while src_block and dest_block:
-                    src_block = src_file.read(BLOCK_SIZE)
-                    dest_block = dest_file.read(BLOCK_SIZE)
-                    src_hash.update(src_block)
-                    dest_hash.update(dest_block)
-                    if src_hash.hexdigest() != dest_hash.hexdigest():
-                        return -1  
-                    if src_hash.hexdigest() == dest_hash.hexdigest():
-                        return 0  
+        try:
+            if filecompare.files_equal(SourcePath, DestinationPath):
+                return 0
+            return -1
+        except (IOError, OSError) as e:
+            print_error('Exception opening file ' + str(e.filename)
+                        + ' Error : ' + str(e))
+            return -1
     elif Checksum == 'ctime':
         if stat_src.st_ctime != stat_dest.st_ctime:
             return -1
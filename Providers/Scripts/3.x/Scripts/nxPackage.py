@@ -11,7 +11,6 @@ import sys
 import time
 import imp
 import urllib.request
-import copy
 import fnmatch
 import re
 apt = None
@@ -29,6 +28,9 @@ protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
 LG = nxDSCLog.DSCLog
+# A package manager waiting on a held lock (yum, dpkg) or a stalled
+# download is killed by client.py after this many seconds.
+REQUEST_TIMEOUT = 1800
 
 # [ClassVersion("1.0.0"),FriendlyName("nxPackage"),SupportsInventory()]
 # class MSFT_nxPackageResource : OMI_BaseResource
@@ -146,6 +148,13 @@ def Inventory_Marshall(Ensure, PackageManager, Name, FilePath, PackageGroup, Arg
         Ensure, PackageManager, Name, FilePath, PackageGroup, Arguments, ReturnCode)
     retval, pkgs = GetAll(Ensure, PackageManager, Name,
                           FilePath, PackageGroup, Arguments, ReturnCode)
+    Inventory = protocol.MI_InstanceStreamA(MarshallPackages(pkgs, PackageManager, Arguments))
+    retd = {}
+    retd["__Inventory"] = Inventory
+    return retval, retd
+
+
+def MarshallPackages(pkgs, PackageManager, Arguments):
     for p in pkgs:
         p['Ensure'] = protocol.MI_String('present')
         p['PackageManager'] = protocol.MI_String(PackageManager)
@@ -161,10 +170,7 @@ def Inventory_Marshall(Ensure, PackageManager, Name, FilePath, PackageGroup, Arg
         p['Size'] = protocol.MI_Uint32(int(p['Size']))
         p['Version'] = protocol.MI_String(p['Version'])
         p['Installed'] = protocol.MI_Boolean(True)
-    Inventory = protocol.MI_InstanceA(pkgs)
-    retd = {}
-    retd["__Inventory"] = Inventory
-    return retval, retd
+        yield p
 
 #
 # Begin user defined DSC functions
@@ -441,11 +447,14 @@ def ParseInfo(p, info):
 
 
 def ParseAllInfo(info, p):
-    pkg_list = []
-    d = {}
+    """
+    Yields the packages in the stat_all output 'info' one at a time, so
+    that Inventory encodes each before the next is parsed.
+    """
     if len(info) < 1 or p.record_delimiter not in info:
-        return pkg_list
-    for pkg in re.split(p.record_delimiter, info):
+        return
+    for pkg in SplitRecords(info, p.record_delimiter):
+        d = {}
         d['Name'] = ''
         d['PackageDescription'] = ''
         d['Publisher'] = ''
@@ -476,9 +485,23 @@ def ParseAllInfo(info, p):
                         'ERROR in ParseAllInfo.  Output was ' + info, file=sys.stdout)
                     LG().Log(
                         'ERROR', 'ERROR in ParseAllInfo.  Output was ' + info)
-                    return pkg_list         
-                pkg_list.append(copy.deepcopy(d))
-    return pkg_list
+                    return
+                yield d
+
+
+def SplitRecords(info, delimiter):
+    """
+    The records of 'info' between occurrences of 'delimiter', as
+    re.split returns them but without building the list.
+    """
+    start = 0
+    while True:
+        end = info.find(delimiter, start)
+        if end < 0:
+            yield info[start:]
+            return
+        yield info[start:end]
+        start = end + len(delimiter)
 
 
 def DoEnableDisable(p):
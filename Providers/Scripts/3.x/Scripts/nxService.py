@@ -20,6 +20,9 @@ protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
 LG = nxDSCLog.DSCLog
+# client.py fails requests still running after this many seconds and
+# kills their commands, such as systemctl waiting on a stuck unit.
+REQUEST_TIMEOUT = 300
 
 # [ClassVersion("1.0.0"),FriendlyName("nxService"), SupportsInventory()]
 # class MSFT_nxServiceResource : OMI_BaseResource
@@ -112,7 +115,14 @@ def Inventory_Marshall(Name, Controller, Enabled, State):
     sc.FilterEnabled = FilterEnabled
     if not GetAll(sc):
         return -1, {"__Inventory": {}}
-    for srv in sc.services_list:
+    Inventory = protocol.MI_InstanceStreamA(MarshallServices(sc.services_list))
+    retd = {}
+    retd["__Inventory"] = Inventory
+    return 0, retd
+
+
+def MarshallServices(services_list):
+    for srv in services_list:
         srv['Name'] = protocol.MI_String(srv['Name'])
         srv['Controller'] = protocol.MI_String(srv['Controller'])
         srv['Enabled'] = protocol.MI_Boolean(srv['Enabled'])
@@ -123,10 +133,7 @@ def Inventory_Marshall(Name, Controller, Enabled, State):
         srv['Path'] = protocol.MI_String(srv['Path'])
         srv['Description'] = protocol.MI_String(srv['Description'])
         srv['Runlevels'] = protocol.MI_String(srv['Runlevels'])
-    Inventory = protocol.MI_InstanceA(sc.services_list)
-    retd = {}
-    retd["__Inventory"] = Inventory
-    return 0, retd
+        yield srv
 
 #
 # Begin user defined DSC functions
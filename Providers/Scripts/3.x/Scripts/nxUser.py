@@ -14,6 +14,7 @@ import fnmatch
 protocol = imp.load_source('protocol', '../protocol.py')
 nxDSCLog = imp.load_source('nxDSCLog', '../nxDSCLog.py')
 helperlib = imp.load_source('helperlib', '../helperlib.py')
+identitycache = imp.load_source('identitycache', '../identitycache.py')
 LG = nxDSCLog.DSCLog
 
 # [ClassVersion("1.0.0"), FriendlyName("nxUser"),SupportsInventory()]
@@ -67,6 +68,7 @@ def Set_Marshall(UserName, Ensure, FullName, Description, Password, Disabled, Pa
                   Disabled, PasswordChangeRequired, HomeDirectory, GroupID)
     retval = Set(UserName, Ensure, FullName, Description, Password,
                  Disabled, PasswordChangeRequired, HomeDirectory, GroupID)
+    identitycache.invalidate()
     return retval
 
 
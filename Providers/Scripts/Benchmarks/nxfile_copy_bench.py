@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Throughput of nxFile.CopyFile on large files.
+
+Writes a source file of 'size_mb' MiB of random data into 'directory'
+(the system temporary directory by default; use one on the filesystem
+that matters, /tmp is often tmpfs) and copies it over an existing
+destination with:
+
+  in place         shutil.copyfile, how CopyFile wrote the destination
+                   before it copied through a temporary file
+  copy_file_range  CopyFile
+  sendfile         CopyFile with copy_file_range turned off
+  buffered         CopyFile with both turned off
+  fsync            CopyFile with nxFileFsync=true
+
+Each is run 'repeat' times after dropping the destination from the page
+cache where posix_fadvise allows; the best is reported.
+
+usage: nxfile_copy_bench.py [size_mb [repeat [directory]]]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import imp
+
+ProvidersDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '3.x')
+os.chdir(ProvidersDir)
+nxFile = imp.load_source('nxFile', './Scripts/nxFile.py')
+nxFile.nxDSCLog.LogConfig = (2, {}, 2)
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python < 3.3
+    clock = time.time
+
+
+def make_source(path, size_mb):
+    chunk = os.urandom(1 << 20)
+    F = open(path, 'wb')
+    for i in range(size_mb):
+        F.write(chunk)
+    F.close()
+
+
+def drop_cache(path):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def in_place(src, dst):
+    shutil.copyfile(src, dst)
+
+
+def copy_file(src, dst):
+    if nxFile.CopyFile(src, dst) is not None:
+        raise Exception('CopyFile failed')
+
+
+def with_settings(func, copy_file_range, sendfile, fsync):
+    def run(src, dst):
+        saved = (nxFile.HAVE_COPY_FILE_RANGE, nxFile.HAVE_SENDFILE, nxFile.helperlib.DscConf)
+        nxFile.HAVE_COPY_FILE_RANGE = copy_file_range and saved[0]
+        nxFile.HAVE_SENDFILE = sendfile and saved[1]
+        nxFile.helperlib.DscConf = {'nxFileFsync': str(fsync).lower()}
+        try:
+            func(src, dst)
+        finally:
+            nxFile.HAVE_COPY_FILE_RANGE, nxFile.HAVE_SENDFILE, nxFile.helperlib.DscConf = saved
+    return run
+
+
+CASES = (
+    ('in place', in_place),
+    ('copy_file_range', with_settings(copy_file, True, True, False)),
+    ('sendfile', with_settings(copy_file, False, True, False)),
+    ('buffered', with_settings(copy_file, False, False, False)),
+    ('fsync', with_settings(copy_file, True, True, True)))
+
+
+def main(argv):
+    size_mb = 2048
+    repeat = 3
+    directory = None
+    if len(argv) > 1:
+        size_mb = int(argv[1])
+    if len(argv) > 2:
+        repeat = int(argv[2])
+    if len(argv) > 3:
+        directory = argv[3]
+    scratch = tempfile.mkdtemp(dir=directory)
+    try:
+        src = os.path.join(scratch, 'src')
+        dst = os.path.join(scratch, 'dst')
+        make_source(src, size_mb)
+        shutil.copyfile(src, dst)
+        print('%d MiB in %s' % (size_mb, scratch))
+        print('%-16s %10s %10s' % ('', 'best s', 'MiB/s'))
+        for name, func in CASES:
+            best = None
+            for i in range(max(repeat, 1)):
+                drop_cache(dst)
+                start = clock()
+                func(src, dst)
+                elapsed = clock() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            print('%-16s %10.3f %10.1f' % (name, best, size_mb / best))
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Benchmark for nxFile recursive directories.
+
+Builds a synthetic source tree of 'dirs' directories holding 'files'
+small files each (100k entries by default) under a scratch directory and
+times, once through the per-file functions (nxFile.HAVE_SCANDIR off) and
+once through the scandir planner:
+
+  set      Set of an empty destination from the source
+  test     Test of the converged destination, which passes
+  plan     PlanDirectory of the converged destination, the dry run
+  changed  Test after one file deep in the tree changed, which fails
+  resync   Set after a file changed in every directory
+
+The md5 cache goes to the scratch directory so the system one is not
+touched; each pass starts with an empty cache.
+
+usage: nxfile_tree_bench.py [dirs [files]]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import imp
+
+ProvidersDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '3.x')
+os.chdir(ProvidersDir)
+nxFile = imp.load_source('nxFile', './Scripts/nxFile.py')
+nxFile.nxDSCLog.LogConfig = (2, {}, 2)
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python < 3.3
+    clock = time.time
+
+
+def build_tree(root, dirs, files):
+    per_level = int(dirs ** 0.5) or 1
+    paths = []
+    for i in range(dirs):
+        d = os.path.join(root, 'd' + str(i // per_level), 'e' + str(i % per_level))
+        os.makedirs(d)
+        for j in range(files):
+            F = open(os.path.join(d, 'f' + str(j)), 'w')
+            F.write('contents of file %d in %s\n' % (j, d))
+            F.close()
+        paths.append(d)
+    return paths
+
+
+def timed(func, *args):
+    start = clock()
+    result = func(*args)
+    return clock() - start, result
+
+
+def run(scratch, src, leaves, scandir):
+    nxFile.HAVE_SCANDIR = scandir
+    nxFile.Md5Cache = nxFile.filecompare.DigestCache(os.path.join(scratch, 'md5.' + str(scandir)), nxFile.md5const)
+    dst = os.path.join(scratch, 'dst')
+    fc = nxFile.FileContext(dst, src, 'present', 'directory', False, '', 'md5', True, 'follow', '', '', '')
+    r = {}
+    r['set'], ok = timed(nxFile.SetDirectoryRecursive, dst, src, fc)
+    assert ok is not False
+    r['test'], ok = timed(nxFile.TestDirectory, dst, src, fc)
+    assert ok is True
+    r['plan'] = None
+    if scandir:
+        r['plan'], plan = timed(nxFile.PlanDirectory, dst, src, fc)
+        assert not plan.entries
+    changed = os.path.join(leaves[-1], 'f0')
+    F = open(changed, 'a')
+    F.write('changed\n')
+    F.close()
+    r['changed'], ok = timed(nxFile.TestDirectory, dst, src, fc)
+    assert ok is False
+    for d in leaves:
+        F = open(os.path.join(d, 'f1'), 'a')
+        F.write('changed\n')
+        F.close()
+    r['resync'], ok = timed(nxFile.SetDirectoryRecursive, dst, src, fc)
+    assert ok is not False and nxFile.TestDirectory(dst, src, fc) is True
+    shutil.rmtree(dst)
+    return r
+
+
+def main(argv):
+    dirs = 1000
+    files = 100
+    if len(argv) > 1:
+        dirs = int(argv[1])
+    if len(argv) > 2:
+        files = int(argv[2])
+    scratch = tempfile.mkdtemp()
+    try:
+        src = os.path.join(scratch, 'src')
+        leaves = build_tree(src, dirs, files)
+        print('%d directories, %d files' % (dirs, dirs * files))
+        legacy = run(scratch, src, leaves, False)
+        # undo the changes so both passes start from the same tree
+        shutil.rmtree(src)
+        leaves = build_tree(src, dirs, files)
+        planned = run(scratch, src, leaves, True)
+    finally:
+        shutil.rmtree(scratch)
+    print('%-10s %12s %12s %8s' % ('', 'per-file s', 'planner s', 'speedup'))
+    for name in ('set', 'test', 'plan', 'changed', 'resync'):
+        if planned[name] is None:
+            continue
+        if legacy[name] is None:
+            print('%-10s %12s %12.3f' % (name, '-', planned[name]))
+        else:
+            print('%-10s %12.3f %12.3f %7.1fx' % (name, legacy[name], planned[name], legacy[name] / planned[name]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Benchmark for the nxFileInventory walk.
+
+Builds a synthetic tree of 'files' small files (200k by default), 100 to
+a directory, under a scratch directory and runs a recursive
+DoInventory of it through the os.walk walker (HAVE_SCANDIR off) and the
+scandir walker, the scandir walker with checksums computed by 4
+threads, and through the DoInventory of 'baseline', another copy
+of nxFileInventory.py, if given, e.g. one taken from git:
+
+  git show HEAD~1:Providers/Scripts/3.x/Scripts/nxFileInventory.py > /tmp/old.py
+
+Each walker is timed with Checksum=mtime, where the walk and the stat
+calls are most of the work, and with md5, which reads every file, and
+the peak memory of the mtime walk is measured with tracemalloc in a
+separate pass.  The records are consumed as they are yielded, as
+Inventory_Marshall does.
+
+usage: nxfileinventory_bench.py [files [baseline]]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import tracemalloc
+import imp
+
+ProvidersDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '3.x')
+os.chdir(ProvidersDir)
+nxFileInventory = imp.load_source('nxFileInventory', './Scripts/nxFileInventory.py')
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python < 3.3
+    clock = time.time
+
+
+def build_tree(root, files):
+    dirs = max(files // 100, 1)
+    per_level = int(dirs ** 0.5) or 1
+    for i in range(dirs):
+        d = os.path.join(root, 'd' + str(i // per_level), 'e' + str(i % per_level))
+        os.makedirs(d)
+        for j in range(files // dirs):
+            F = open(os.path.join(d, 'f' + str(j)), 'w')
+            F.write('contents of file %d in %s\n' % (j, d))
+            F.close()
+    return dirs
+
+
+def walk(module, top, checksum):
+    n = 0
+    for d in module.DoInventory(top, True, 'follow', checksum, '*', 1024, 10485760, False):
+        n += 1
+    return n
+
+
+def measure(module, top):
+    r = {}
+    for checksum in ('mtime', 'md5'):
+        start = clock()
+        r['count'] = walk(module, top, checksum)
+        r[checksum] = clock() - start
+    tracemalloc.start()
+    walk(module, top, 'mtime')
+    r['peak'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return r
+
+
+def main(argv):
+    files = 200000
+    if len(argv) > 1:
+        files = int(argv[1])
+    walkers = []
+    if len(argv) > 2:
+        walkers.append(('baseline', imp.load_source('nxFileInventoryBaseline', argv[2]), None, None))
+    walkers.append(('os.walk', nxFileInventory, False, 1))
+    walkers.append(('scandir', nxFileInventory, True, 1))
+    walkers.append(('scandir x4', nxFileInventory, True, 4))
+    scratch = tempfile.mkdtemp()
+    results = []
+    try:
+        top = os.path.join(scratch, 'tree')
+        dirs = build_tree(top, files)
+        print('%d directories, %d files' % (dirs, files))
+        for name, module, scandir, workers in walkers:
+            if scandir is not None:
+                module.HAVE_SCANDIR = scandir
+                module.helperlib.DscConf = {'nxFileInventoryChecksumWorkers': str(workers)}
+            results.append((name, measure(module, top)))
+    finally:
+        nxFileInventory.HAVE_SCANDIR = hasattr(os, 'scandir')
+        nxFileInventory.helperlib.DscConf = None
+        shutil.rmtree(scratch)
+    print('%-10s %9s %10s %12s %10s %12s' % ('', 'records', 'mtime s', 'records/s', 'md5 s', 'peak KiB'))
+    for name, r in results:
+        print('%-10s %9d %10.3f %12.0f %10.3f %12.0f' % (name, r['count'], r['mtime'], r['count'] / r['mtime'],
+                                                        r['md5'], r['peak'] / 1024.0))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Microbenchmark for the client.py <-> PythonProvider wire format.
+
+Encodes an MI_InstanceA of nxFileInventory-like instances over an
+in-process socketpair and decodes it on the other end, once writing and
+reading the raw socket field by field (how client.py worked before the
+buffered reader/writer) and once through protocol.BufferedReader and
+protocol.BufferedWriter.  Reports the number of socket calls and the
+wall time of each pass.
+
+Also times the MI_* codecs alone: an MI_InstanceA holding the given
+number of scalar properties is encoded into memory and decoded again.
+
+usage: protocol_bench.py [instance_count [property_count]]
+"""
+import os
+import sys
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import protocol
+protocol.set_trace_level(protocol.TRACE_OFF)
+
+
+class MemorySocket(object):
+    """
+    Collects what is sent and replays it on recv.
+    """
+    def __init__(self, data=None):
+        self.data = data
+        self.pos = 0
+        self.sent = []
+
+    def recv(self, n):
+        buf = self.data[self.pos:self.pos + n]
+        self.pos += len(buf)
+        return buf
+
+    def sendall(self, buf):
+        self.sent.append(buf)
+
+
+class CountingSocket(object):
+    """
+    Forwards recv/send/sendall to a socket and counts the calls.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def recv(self, n):
+        self.calls += 1
+        return self.sock.recv(n)
+
+    def send(self, buf):
+        self.calls += 1
+        return self.sock.send(buf)
+
+    def sendall(self, buf):
+        self.calls += 1
+        return self.sock.sendall(buf)
+
+
+def make_inventory(count):
+    inventory = []
+    for i in range(count):
+        inventory.append({
+            'DestinationPath': protocol.MI_String('/etc/opt/microsoft/file' + str(i) + '.conf'),
+            'Checksum': protocol.MI_String('d41d8cd98f00b204e9800998ecf8427e'),
+            'Type': protocol.MI_String('file'),
+            'Contents': protocol.MI_String(''),
+            'Mode': protocol.MI_String('644'),
+            'Group': protocol.MI_String('root'),
+            'Owner': protocol.MI_String('root'),
+            'FileSize': protocol.MI_Uint64(i),
+            'ModifiedDate': protocol.MI_Timestamp.from_time(1500000000 + i),
+            'CreatedDate': protocol.MI_Timestamp.from_time(1500000000 + i)})
+    return {'__Inventory': protocol.MI_InstanceA(inventory)}
+
+
+def make_properties(count):
+    instances = []
+    for i in range(count // 10):
+        instances.append({
+            'Enabled': protocol.MI_Boolean(i % 2),
+            'Flags': protocol.MI_Uint8(i % 256),
+            'Offset': protocol.MI_Sint16(-(i % 32768)),
+            'Letter': protocol.MI_Char16(65 + i % 26),
+            'Count': protocol.MI_Uint32(i),
+            'Delta': protocol.MI_Sint64(-i),
+            'Size': protocol.MI_Uint64(i * 4096),
+            'Ratio': protocol.MI_Real32(i / 3.0),
+            'Average': protocol.MI_Real64(i / 7.0),
+            'Name': protocol.MI_String('counter' + str(i))})
+    return {'__Inventory': protocol.MI_InstanceA(instances)}
+
+
+def run_codec_pass(values):
+    out = MemorySocket()
+    start = time.time()
+    writer = protocol.BufferedWriter(out)
+    protocol.write_values(writer, values)
+    writer.flush()
+    encoded = time.time() - start
+
+    start = time.time()
+    result = protocol.read_values(protocol.BufferedReader(MemorySocket(out.sent[0])))
+    decoded = time.time() - start
+    assert len(result['__Inventory'].value) == len(values['__Inventory'].value)
+    return len(out.sent[0]), encoded, decoded
+
+
+def run_pass(values, buffered):
+    s1, s2 = socket.socketpair()
+    out = CountingSocket(s1)
+    inp = CountingSocket(s2)
+    result = {}
+
+    def encode():
+        fd = out
+        if buffered:
+            fd = protocol.BufferedWriter(out)
+        protocol.write_values(fd, values)
+        if buffered:
+            fd.flush()
+
+    start = time.time()
+    try:
+        writer = threading.Thread(target=encode)
+        writer.start()
+        fd = inp
+        if buffered:
+            fd = protocol.BufferedReader(inp)
+        result = protocol.read_values(fd)
+        writer.join()
+    finally:
+        elapsed = time.time() - start
+        s1.close()
+        s2.close()
+    assert len(result['__Inventory'].value) == len(values['__Inventory'].value)
+    return out.calls, inp.calls, elapsed
+
+
+def main(argv):
+    count = 50000
+    properties = 200000
+    if 1 < len(argv):
+        count = int(argv[1])
+    if 2 < len(argv):
+        properties = int(argv[2])
+    values = make_inventory(count)
+    print('MI_InstanceA with ' + str(count) + ' instances')
+    print('%-10s %12s %12s %10s' % ('', 'send calls', 'recv calls', 'seconds'))
+    for name, buffered in (('unbuffered', False), ('buffered', True)):
+        sends, recvs, elapsed = run_pass(values, buffered)
+        print('%-10s %12d %12d %10.3f' % (name, sends, recvs, elapsed))
+
+    values = make_properties(properties)
+    print('')
+    print('MI_InstanceA with ' + str(properties) + ' scalar properties')
+    print('%12s %10s %10s' % ('bytes', 'encode s', 'decode s'))
+    print('%12d %10.3f %10.3f' % run_codec_pass(values))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Encode/decode benchmark and regression suite for protocol.py.
+
+Each case is a realistic reply or request:
+
+  all_types          1000 instances holding one of every MI_* type
+  file_inventory     nxFileInventory Inventory reply, 10k files
+  service_getall     nxService Inventory reply, 400 services
+  perf_counters      perf counter names, samples and intervals as arrays
+  file_test_request  one nxFile Test request, the most frequent call
+
+and is measured for:
+
+  bytes                  size on the wire
+  encode_s, decode_s     best of --repeat runs of write_values/read_values
+                         against memory, each run looped to at least
+                         MIN_SAMPLE seconds so small cases are not noise
+  encode_mbps, decode_mbps
+  roundtrip_s            write and read over a socketpair, one thread each
+  send_calls, recv_calls socket calls made by that round trip
+  encode_peak, decode_peak
+                         tracemalloc peak bytes while encoding/decoding
+
+--save writes the results as a JSON baseline; --compare reads one back
+and exits with 1 if a case got slower, bigger or made more calls than
+the baseline allows, or if its bytes changed, which means the wire
+format did.  Timings may grow by --tolerance (a fraction), calls and
+peak allocations, which barely vary between runs, by COUNT_TOLERANCE.
+
+usage: protocol_suite.py [--repeat N] [--save FILE] [--compare FILE]
+                         [--tolerance T] [case ...]
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError: # python < 3.4
+    tracemalloc = None
+
+from protocol_bench import protocol, MemorySocket, CountingSocket, make_inventory
+
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'protocol_baseline.json')
+
+# Metrics that are compared against the baseline, all lower is better.
+TIMINGS = ('encode_s', 'decode_s', 'roundtrip_s')
+COUNTS = ('send_calls', 'recv_calls', 'encode_peak', 'decode_peak')
+COUNT_TOLERANCE = 0.1
+
+MIN_SAMPLE = 0.05
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python < 3.3
+    clock = time.time
+
+
+def all_types():
+    P = protocol
+    instance = {
+        'Boolean': P.MI_Boolean(True),
+        'Uint8': P.MI_Uint8(255),
+        'Sint8': P.MI_Sint8(-128),
+        'Uint16': P.MI_Uint16(65535),
+        'Sint16': P.MI_Sint16(-32768),
+        'Uint32': P.MI_Uint32(4294967295),
+        'Sint32': P.MI_Sint32(-2147483648),
+        'Uint64': P.MI_Uint64(18446744073709551615),
+        'Sint64': P.MI_Sint64(-9223372036854775808),
+        'Real32': P.MI_Real32(0.5),
+        'Real64': P.MI_Real64(1.0 / 3),
+        'Char16': P.MI_Char16(65),
+        'Timestamp': P.MI_Timestamp.from_time(1500000000),
+        'Interval': P.MI_Interval(1, 2, 3, 4, 5),
+        'String': P.MI_String('/etc/opt/omi/conf/omiserver.conf'),
+        'Instance': P.MI_Instance({'Name': P.MI_String('nested')}),
+        'BooleanA': P.MI_BooleanA([True, False]),
+        'Uint8A': P.MI_Uint8A(range(16)),
+        'Sint8A': P.MI_Sint8A([-1, 1]),
+        'Uint16A': P.MI_Uint16A([22, 443]),
+        'Sint16A': P.MI_Sint16A([-1, 1]),
+        'Uint32A': P.MI_Uint32A([0, 4294967295]),
+        'Sint32A': P.MI_Sint32A([-1, 1]),
+        'Uint64A': P.MI_Uint64A([0, 18446744073709551615]),
+        'Sint64A': P.MI_Sint64A([-1, 1]),
+        'Real32A': P.MI_Real32A([0.5, 0.25]),
+        'Real64A': P.MI_Real64A([0.5, 0.25]),
+        'Char16A': P.MI_Char16A([65, 66]),
+        'DatetimeA': P.MI_DatetimeA([P.MI_Timestamp.from_time(1500000000),
+                                     P.MI_Interval(0, 0, 15, 0, 0)]),
+        'StringA': P.MI_StringA(['alpha', 'beta', 'gamma']),
+        'InstanceA': P.MI_InstanceA([{'Name': P.MI_String('element')}])}
+    return {'__Inventory': P.MI_InstanceA([instance] * 1000)}
+
+
+def file_inventory():
+    return make_inventory(10000)
+
+
+def service_getall():
+    P = protocol
+    services = []
+    for i in range(400):
+        services.append({
+            'Name': P.MI_String('service' + str(i)),
+            'Controller': P.MI_String('systemd'),
+            'Enabled': P.MI_Boolean(i % 3 != 0),
+            'State': P.MI_String(('Running', 'Stopped')[i % 2]),
+            'Path': P.MI_String('/usr/lib/systemd/system/service' + str(i) + '.service'),
+            'Description': P.MI_String('Description of service number ' + str(i)),
+            'Runlevels': P.MI_String('')})
+    return {'__Inventory': P.MI_InstanceA(services)}
+
+
+def perf_counters():
+    P = protocol
+    names = []
+    for obj in ('Processor', 'Memory', 'Logical Disk', 'Network Adapter', 'System'):
+        for i in range(100):
+            names.append('\\' + obj + '(*)\\Counter ' + str(i))
+    return {
+        'PerformanceCounter': P.MI_StringA(names),
+        'IntervalSeconds': P.MI_Uint32A([10, 30, 60, 300] * 125),
+        'Timestamps': P.MI_Uint64A(range(1500000000, 1500100000)),
+        'Samples': P.MI_Real64A([i / 7.0 for i in range(100000)]),
+        'Enabled': P.MI_BooleanA([1, 0] * 250)}
+
+
+def file_test_request():
+    P = protocol
+    return {
+        'DestinationPath': P.MI_String('/etc/opt/microsoft/omsagent/conf/omsagent.conf'),
+        'SourcePath': P.MI_String('/var/opt/microsoft/omsconfig/source/omsagent.conf'),
+        'Ensure': P.MI_String('present'),
+        'Type': P.MI_String('file'),
+        'Force': P.MI_Boolean(False),
+        'Contents': P.MI_String(''),
+        'Checksum': P.MI_String('md5'),
+        'Recurse': P.MI_Boolean(False),
+        'Links': P.MI_String('follow'),
+        'Owner': P.MI_String('omsagent'),
+        'Group': P.MI_String('omiusers'),
+        'Mode': P.MI_String('644')}
+
+
+CASES = (
+    ('all_types', all_types),
+    ('file_inventory', file_inventory),
+    ('service_getall', service_getall),
+    ('perf_counters', perf_counters),
+    ('file_test_request', file_test_request))
+
+
+def encode(values):
+    out = MemorySocket()
+    writer = protocol.BufferedWriter(out)
+    protocol.write_values(writer, values)
+    writer.flush()
+    return out.sent[0]
+
+
+def decode(data):
+    return protocol.read_values(protocol.BufferedReader(MemorySocket(data)))
+
+
+def best_of(repeat, func, *args):
+    """
+    Returns the best time per call of 'func' over 'repeat' samples.
+    """
+    loops = 1
+    while True:
+        start = clock()
+        for _ in range(loops):
+            func(*args)
+        elapsed = clock() - start
+        if elapsed >= MIN_SAMPLE:
+            break
+        loops *= 10
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = clock()
+        for _ in range(loops):
+            func(*args)
+        best = min(best, clock() - start)
+    return best / loops
+
+
+def peak_allocation(func, *args):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def roundtrip(values):
+    s1, s2 = socket.socketpair()
+    out = CountingSocket(s1)
+    inp = CountingSocket(s2)
+
+    def send():
+        writer = protocol.BufferedWriter(out)
+        protocol.write_values(writer, values)
+        writer.flush()
+
+    start = clock()
+    try:
+        writer = threading.Thread(target=send)
+        writer.start()
+        protocol.read_values(protocol.BufferedReader(inp))
+        writer.join()
+        elapsed = clock() - start
+    finally:
+        s1.close()
+        s2.close()
+    return elapsed, out.calls, inp.calls
+
+
+def run_case(make, repeat):
+    values = make()
+    data = encode(values)
+    result = {'bytes': len(data)}
+    result['encode_s'] = best_of(repeat, encode, values)
+    result['decode_s'] = best_of(repeat, decode, data)
+    result['encode_mbps'] = len(data) / result['encode_s'] / 1e6
+    result['decode_mbps'] = len(data) / result['decode_s'] / 1e6
+    result['roundtrip_s'], result['send_calls'], result['recv_calls'] = roundtrip(values)
+    result['encode_peak'] = peak_allocation(encode, values)
+    result['decode_peak'] = peak_allocation(decode, data)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints how each case moved against the baseline and returns the list
+    of regressions.
+    """
+    regressions = []
+    print('')
+    print('%-20s %-12s %14s %14s %8s' % ('case', 'metric', 'baseline', 'current', 'ratio'))
+    for name in sorted(results.keys()):
+        if name not in baseline['cases']:
+            continue
+        old = baseline['cases'][name]
+        new = results[name]
+        if old['bytes'] != new['bytes']:
+            regressions.append(name + ': wire size changed from ' + str(old['bytes']) + ' to ' + str(new['bytes']))
+        for metric in TIMINGS + COUNTS:
+            if old.get(metric) is None or new.get(metric) is None:
+                continue
+            ratio = float(new[metric]) / max(old[metric], 1e-9)
+            limit = tolerance
+            if metric in COUNTS:
+                limit = COUNT_TOLERANCE
+            flag = ''
+            if ratio > 1 + limit:
+                flag = ' <--'
+                regressions.append(name + ': ' + metric + ' ' + ('%.2f' % ratio) + 'x baseline')
+            print('%-20s %-12s %14.6g %14.6g %8.2f%s' % (name, metric, old[metric], new[metric], ratio, flag))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='protocol.py encode/decode benchmark')
+    parser.add_argument('cases', nargs='*', help='cases to run, default all')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='FILE', nargs='?', const=BASELINE,
+                        help='write results as the baseline (default ' + BASELINE + ')')
+    parser.add_argument('--compare', metavar='FILE', nargs='?', const=BASELINE,
+                        help='compare against a baseline and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed slowdown as a fraction, default 0.5')
+    args = parser.parse_args(argv[1:])
+
+    selected = [case for case in CASES if not args.cases or case[0] in args.cases]
+    results = {}
+    print('%-20s %10s %9s %9s %9s %9s %9s %6s %6s %11s %11s' % (
+        'case', 'bytes', 'encode s', 'decode s', 'enc MB/s', 'dec MB/s', 'socket s',
+        'sends', 'recvs', 'enc peak', 'dec peak'))
+    for name, make in selected:
+        r = results[name] = run_case(make, max(args.repeat, 1))
+        print('%-20s %10d %9.6f %9.6f %9.1f %9.1f %9.4f %6d %6d %11s %11s' % (
+            name, r['bytes'], r['encode_s'], r['decode_s'], r['encode_mbps'], r['decode_mbps'],
+            r['roundtrip_s'], r['send_calls'], r['recv_calls'], r['encode_peak'], r['decode_peak']))
+
+    status = 0
+    if args.compare:
+        F = open(args.compare)
+        baseline = json.load(F)
+        F.close()
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('')
+            for r in regressions:
+                print('REGRESSION ' + r)
+            status = 1
+    if args.save:
+        F = open(args.save, 'w')
+        json.dump({'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'repeat': args.repeat,
+                   'cases': results}, F, indent=1, sort_keys=True)
+        F.write('\n')
+        F.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
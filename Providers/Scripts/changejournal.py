@@ -0,0 +1,350 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Change journal for nxFile and nxFileLine Test.
+
+Consistency checks Test the same files every 15 minutes and they hardly
+ever change in between.  ChangeJournal watches the directories holding
+the files a Test looked at with inotify, counts the changes to each of
+those files, and gives back the result of the Test for as long as none of
+them changed.
+
+Nothing is known about a file until the journal watches it, so a new
+process starts with full checks.  So does a lost event: when the inotify
+queue overflows every remembered result is dropped, and when the kernel
+drops a watch, or a watched directory is moved or replaced, the results
+for the files in it are.  Files on network filesystems, whose changes on
+other hosts inotify never sees, are not journaled at all.
+
+Enabled with nxFileChangeJournal=true in dsc.conf.  Linux only, Python 3.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import imp
+
+scriptFolderPath = os.path.dirname(os.path.realpath(__file__))
+helperlib = imp.load_source('helperlib', os.path.join(scriptFolderPath, 'helperlib.py'))
+DscConfFile = helperlib.DSC_CONF
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+# the watch is gone or points somewhere else now
+LOST_MASK = IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT = struct.Struct('iIII')
+
+REMOTE_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'ncpfs', 'afs', 'ceph',
+                      'glusterfs', 'lustre', 'gpfs', '9p', 'sshfs')
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    HAVE_INOTIFY = hasattr(libc, 'inotify_init1')
+except OSError:
+    HAVE_INOTIFY = False
+
+
+def check(ret):
+    if ret < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return ret
+
+
+class ChangeJournal(object):
+    """
+    Results of Tests by key, each valid until a file it depends on changes.
+
+    Every watched path has a slot in 'changes', a counter bumped by each
+    event for it.  begin() watches the paths of a Test before it runs and
+    notes their counters; remember() keeps the result of the Test only if
+    they still hold, and cached() returns it while they do.  'epoch' is
+    bumped when events were lost, which invalidates everything.
+    """
+
+    def __init__(self, thread=True):
+        if not HAVE_INOTIFY:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self.lock = threading.Lock()
+        self.dirs = {}     # directory -> (wd, st_dev, st_ino)
+        self.wds = {}      # wd -> directories watched through it
+        self.names = {}    # directory -> {name: slot}
+        self.slots = {}    # path -> slot
+        self.where = []    # slot -> directory
+        self.changes = []  # slot -> number of events seen
+        self.results = {}  # key -> (token, result)
+        self.epoch = 0
+        self.hits = 0
+        self.overflows = 0
+        if thread:
+            reader = threading.Thread(target=self.run, name='changejournal')
+            reader.daemon = True
+            reader.start()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        finally:
+            self.lock.release()
+
+    def run(self):
+        """
+        Reads events as they come, so the queue does not overflow between
+        two checks.
+        """
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        while True:
+            poller.poll(1000)
+            self.lock.acquire()
+            try:
+                if self.fd is None:
+                    return
+                self.drain()
+            finally:
+                self.lock.release()
+
+    def drain(self):
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+            if not data:
+                return
+            self.dispatch(data)
+
+    def dispatch(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                self.overflows += 1
+                self.epoch += 1
+                continue
+            if wd not in self.wds:
+                continue
+            if mask & LOST_MASK:
+                self.forget(wd, mask & IN_IGNORED == 0)
+                continue
+            name = os.fsdecode(name)
+            for directory in self.wds[wd]:
+                slot = self.names[directory].get(name)
+                if slot is not None:
+                    self.changes[slot] += 1
+
+    def forget(self, wd, remove=True):
+        """
+        Stops watching through 'wd'; every path in its directories counts
+        as changed and gets a new slot when it is watched again.
+        """
+        if remove:
+            libc.inotify_rm_watch(self.fd, wd)
+        for directory in self.wds.pop(wd):
+            del self.dirs[directory]
+            for name, slot in self.names.pop(directory).items():
+                self.changes[slot] += 1
+                del self.slots[os.path.join(directory, name)]
+
+    def watch(self, path):
+        """
+        Returns the slot of 'path', or None if it cannot be watched.
+        """
+        slot = self.slots.get(path)
+        if slot is not None:
+            return slot
+        directory, name = os.path.split(path)
+        if directory not in self.dirs:
+            # stat before the watch is added, so a directory replaced in
+            # between is found out by valid()
+            try:
+                st = os.stat(directory)
+                if is_remote(directory):
+                    return None
+                wd = check(libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK))
+            except OSError:
+                return None
+            self.dirs[directory] = (wd, st.st_dev, st.st_ino)
+            self.wds.setdefault(wd, []).append(directory)
+            self.names[directory] = {}
+        slot = len(self.changes)
+        self.changes.append(0)
+        self.where.append(directory)
+        self.slots[path] = slot
+        self.names[directory][name] = slot
+        return slot
+
+    def valid(self, token):
+        epoch, seen = token
+        if epoch != self.epoch:
+            return False
+        for slot, count in seen:
+            if self.changes[slot] != count:
+                return False
+        # a watch does not see its directory move with one of its parents
+        for directory in set(self.where[slot] for slot, count in seen):
+            wd, dev, ino = self.dirs[directory]
+            try:
+                st = os.stat(directory)
+            except OSError:
+                st = None
+            if st is None or (st.st_dev, st.st_ino) != (dev, ino):
+                self.forget(wd)
+                return False
+        return True
+
+    def begin(self, paths):
+        """
+        Watches 'paths', which a Test is about to look at, and returns the
+        token to remember its result with, or None if they cannot all be
+        watched.
+        """
+        self.lock.acquire()
+        try:
+            if self.fd is None:
+                return None
+            self.drain()
+            seen = []
+            for path in paths:
+                slot = self.watch(os.path.abspath(path))
+                if slot is None:
+                    return None
+                seen.append((slot, self.changes[slot]))
+            return self.epoch, tuple(seen)
+        finally:
+            self.lock.release()
+
+    def remember(self, key, token, result):
+        """
+        Keeps 'result' for 'key' unless a path of 'token' changed since
+        begin().
+        """
+        if token is None:
+            return
+        self.lock.acquire()
+        try:
+            if self.fd is None:
+                return
+            self.drain()
+            if self.valid(token):
+                self.results[key] = (token, result)
+            else:
+                self.results.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def cached(self, key):
+        """
+        Returns the result remembered for 'key', or None if there is none
+        or one of its paths changed since.
+        """
+        self.lock.acquire()
+        try:
+            entry = self.results.get(key)
+            if entry is None or self.fd is None:
+                return None
+            self.drain()
+            if not self.valid(entry[0]):
+                del self.results[key]
+                return None
+            self.hits += 1
+            return entry[1]
+        finally:
+            self.lock.release()
+
+
+def watched_paths(paths):
+    """
+    'paths' and, for the symlinks among them, the files they point to.
+    """
+    result = []
+    for path in paths:
+        result.append(path)
+        if os.path.islink(path):
+            result.append(os.path.realpath(path))
+    return result
+
+
+def is_remote(directory):
+    """
+    True if 'directory' is on a network filesystem, or its mount cannot
+    be found.
+    """
+    directory = os.path.realpath(directory)
+    best = None
+    fstype = None
+    try:
+        F = open('/proc/self/mounts')
+        try:
+            lines = F.read().splitlines()
+        finally:
+            F.close()
+    except (IOError, OSError):
+        return True
+    for l in lines:
+        fields = l.split()
+        if len(fields) < 3:
+            continue
+        mount = fields[1].replace('\\040', ' ').replace('\\011', '\t').replace('\\134', '\\')
+        if directory == mount or directory.startswith(mount.rstrip('/') + '/'):
+            if best is None or len(mount) >= len(best):
+                best = mount
+                fstype = fields[2]
+    if fstype is None:
+        return True
+    return fstype in REMOTE_FILESYSTEMS or fstype.startswith('fuse')
+
+
+def read_enabled(path):
+    return helperlib.read_dsc_conf(path).get('nxFileChangeJournal', '').lower() == 'true'
+
+
+# The journal shared by the providers of this process, kept when this
+# module is loaded again; False once it turned out not to be wanted or
+# not to be possible.
+try:
+    Journal
+except NameError:
+    Journal = None
+
+
+def get_journal():
+    """
+    Returns the shared ChangeJournal, or None when nxFileChangeJournal is
+    not true in dsc.conf or inotify cannot be used.
+    """
+    global Journal
+    if Journal is None:
+        Journal = False
+        if read_enabled(DscConfFile):
+            try:
+                Journal = ChangeJournal()
+            except OSError:
+                pass
+    return Journal or None
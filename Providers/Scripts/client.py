@@ -2,56 +2,88 @@
 # Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
 #============================================================================
 import os
+import signal
+import metrics
 import protocol
 import socket
 import struct
+import subprocess
 import sys
+import threading
 import traceback
 import ctypes
+import time
+try:
+    import queue
+except ImportError: # python < 3
+    import Queue as queue
 
-DO_TRACE = True
-DO_VERBOSE_TRACE  = False
+StartTime = time.time ()
 ScriptsDir = "<DSC_SCRIPT_PATH>"
 VarDir = "<PYTHON_PID_DIR>"
+ProviderModules = {}
+ImportTimes = []
+Operations = ('Test','Set','Get','Inventory')
+# Worker threads used once the peer negotiates tagged requests.
+MaxWorkers = 4
+# One lock per provider that does not set THREAD_SAFE = True at module
+# level, serializing its requests; added with the module under ImportLock.
+ProviderLocks = {}
+ImportLock = threading.Lock ()
+# Deadline in seconds for requests that carry no __Timeout value and whose
+# provider sets no REQUEST_TIMEOUT; None runs them without a deadline.
+DefaultRequestTimeout = None
+# Status sent with write_failed when a request runs past its deadline.
+TimeoutFailCode = 2
+# Seconds a timed out request gets to wind down once its child processes
+# are killed. A request still running after that keeps its provider's lock,
+# and the requests that need it fail until it lets go.
+KillGracePeriod = 1
+# The timed out request still holding each provider's lock, by provider.
+StuckRequests = {}
+StuckLock = threading.Lock ()
+# Children started by the request with a deadline running on each thread.
+RequestChildren = threading.local ()
 
-def trace (text):
-    if DO_TRACE:
-        sys.stdout.write (text + '\n')
+# Tracing is shared with protocol.py, set DSC_PYTHON_TRACE to on or verbose.
+trace = protocol.trace
+verbose_trace = protocol.verbose_trace
 
-def verbose_trace (text):
-    if DO_VERBOSE_TRACE:
-        trace (text)
 
-        
 def read_uchar (fd):
     verbose_trace ('<read_uchar>')
     buf = fd.recv (1)
     if len (buf) < 1:
         return None
     val = struct.unpack ('@B',buf)[0]
-    verbose_trace ('  val: '+str(int (val)))
+    verbose_trace ('  val: %s', int (val))
     verbose_trace ('</read_uchar>')
     return val
 
 
-def read_request (fd):
+def read_request (fd, timer):
     verbose_trace ('<read_request>')
     op_type = read_uchar (fd)
     if op_type == None:
         return None
-    verbose_trace ('  op_type: ' + str(op_type))
+    timer.restart ()
+    if op_type == protocol.OP_NEGOTIATE:
+        verbose_trace ('</read_request>')
+        return (op_type, None, None)
+    verbose_trace ('  op_type: %s', op_type)
     op_name = protocol.read_string (fd)
-    verbose_trace ('  op_name: "'+ op_name +'"')
+    verbose_trace ('  op_name: "%s"', op_name)
     d = protocol.read_values (fd)
+    timer.mark ('decode')
     verbose_trace ('</read_request>')
     return (op_type, op_name, d)
 
     
 def write_int (fd, val):
     verbose_trace ('<write_int>')
-    verbose_trace ('  val: '+str(val))
+    verbose_trace ('  val: %s', val)
     buf = struct.pack ('@i', val)
-    fd.send (buf)
+    fd.sendall (buf)
     verbose_trace ('</write_int>')
 
 
@@ -95,79 +127,387 @@ def translate_input (d):
     return oldStyleD
 
 
+def import_timed (name):
+    start = time.time ()
+    __import__ (name)
+    elapsed = time.time () - start
+    ImportTimes.append ((name, elapsed))
+    trace ('imported %s in %.6fs', name, elapsed)
+    return sys.modules[name]
+
+
+def import_provider (name):
+    """ Import the provider module 'name' from the Scripts package the first
+        time a request names it and keep it for the rest of the session.
+        Returns None if the package does not list it as a provider. """
+    if name in ProviderModules:
+        return ProviderModules[name]
+    ImportLock.acquire ()
+    try:
+        return import_provider_locked (name)
+    finally:
+        ImportLock.release ()
+
+
+def import_provider_locked (name):
+    if name in ProviderModules:
+        return ProviderModules[name]
+    package = sys.modules.get ('Scripts')
+    if package is None:
+        return None
+    # __init__.py files from older RegenerateInitFiles.py only have __all__
+    providers = getattr (package, '__providers__', None)
+    if providers is None:
+        providers = getattr (package, '__all__', [])
+    if name not in providers:
+        return None
+    try:
+        the_module = import_timed ('Scripts.' + name)
+    except:
+        trace ('Exception while Import: %r', sys.exc_info())
+        sys.stderr.write ('\nException while Import: ')
+        sys.stderr.write (repr(sys.exc_info())+'\n')
+        traceback.print_tb (sys.exc_info()[2])
+        sys.stderr.write ('\n')
+        return None
+    if not getattr (the_module, 'THREAD_SAFE', False):
+        ProviderLocks[name] = threading.Lock ()
+    ProviderModules[name] = the_module
+    return the_module
+
+
+def flush_logs ():
+    """ Write the log lines providers buffered in nxDSCLog, once it has
+        been loaded by one of them. """
+    log = sys.modules.get ('nxDSCLog')
+    if log is not None and hasattr (log, 'flush_all'):
+        log.flush_all ()
+
+
+def write_import_report (path):
+    """ Write the time spent starting the client and importing each
+        module, one '<name> <seconds>' line per entry. """
+    lines = []
+    lines.append ('%-32s %10.6f' % ('startup', StartupTime - StartTime))
+    for name, elapsed in ImportTimes:
+        lines.append ('%-32s %10.6f' % (name, elapsed))
+    try:
+        F = open (path, 'w')
+        F.write ('\n'.join (lines) + '\n')
+        F.close ()
+    except:
+        sys.stderr.write ('Unable to create ' + path)
+
+
 def callMOF (req):
     oldStyleDict = translate_input (req[2])
-    trace ('MOF=' + repr ((req[0], req[1], oldStyleDict)))
-    op = ('Test','Set','Get','Inventory')
-    if req[1] not in globals().keys():
+    trace ('MOF=%r', (req[0], req[1], oldStyleDict))
+    the_module = import_provider (req[1])
+    if the_module is None:
         sys.stderr.write('Unable to find module: ' + req[1])
         return None
-    the_module = globals ()[req[1]]
-    method_name = op[req[0]] + '_Marshall'
+    method_name = Operations[req[0]] + '_Marshall'
     if not method_name in the_module.__dict__.keys():
         sys.stderr.write ('Unable to find method: ' + method_name)
         return None
-    trace ('calling '+ req[1] + '.' + method_name + ' ' + repr (oldStyleDict))
+    trace ('calling %s.%s %r', req[1], method_name, oldStyleDict)
     ret = the_module.__dict__[method_name](**oldStyleDict)
-    sys.stderr.write (repr(ret))
+    trace ('returned %r', ret)
     return ret
 
     
-def handle_request (fd, req):
+def provider_lock (name):
+    """ Lock to hold while a request for provider 'name' runs, or None if
+        the provider sets THREAD_SAFE. Streamed Inventory instances are
+        produced while the response is encoded, so it covers that too. """
+    import_provider (name)
+    return ProviderLocks.get (name)
+
+
+def request_timeout (req):
+    """ Deadline in seconds for 'req': the __Timeout value carried with the
+        request (removed from its arguments), else the REQUEST_TIMEOUT of
+        its provider, else DefaultRequestTimeout. """
+    if '__Timeout' in req[2]:
+        value = req[2].pop ('__Timeout').value
+        if hasattr (value, 'value'):
+            value = value.value
+        if value:
+            return value
+    the_module = import_provider (req[1])
+    return getattr (the_module, 'REQUEST_TIMEOUT', DefaultRequestTimeout)
+
+
+Popen = subprocess.Popen
+
+
+def own_process_group (preexec_fn):
+    """ Run a provider's preexec_fn in the child, then make the child lead
+        a process group unless preexec_fn did (with setsid, say). """
+    preexec_fn ()
+    if os.getpgrp () != os.getpid ():
+        os.setpgrp ()
+
+
+class RequestPopen (Popen):
+    """ subprocess.Popen that starts the children of a request with a
+        deadline in a process group of their own, and records them so that
+        the request can kill its own children and no other request's. """
+
+    def __init__ (self, *args, **kwargs):
+        children = getattr (RequestChildren, 'children', None)
+        if children is not None:
+            preexec_fn = kwargs.get ('preexec_fn')
+            if preexec_fn is not None:
+                kwargs['preexec_fn'] = lambda: own_process_group (preexec_fn)
+            elif sys.version_info >= (3, 2):
+                kwargs.setdefault ('start_new_session', True)
+            else:
+                kwargs['preexec_fn'] = os.setpgrp
+        Popen.__init__ (self, *args, **kwargs)
+        if children is not None:
+            children.append (self.pid)
+
+
+# Providers start their processes through subprocess.Popen.
+subprocess.Popen = RequestPopen
+
+
+def kill_request_children (children):
+    """ SIGKILL the process groups led by the processes in 'children',
+        which also takes the processes they started. """
+    for pid in children:
+        try:
+            os.killpg (pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def handle_request (fd, req, timer):
     trace ('<handle_request>')
-    r = callMOF (req)
-    if len (r) < 2 :
-        ret = None
-        rval = r[0]
+    timeout = request_timeout (req)
+    if timeout is None:
+        run_request (fd, req, timer)
     else:
-        rval = r[0]
-        ret = r[1]
-    if rval == 0:
-        write_success (fd, ret)
-    else:
-        write_failed (fd,1, 'Error occurred processing '+ repr (req))
+        run_request_with_deadline (fd, req, timer, timeout)
     trace ('</handle_request>')
 
 
+def run_request_with_deadline (fd, req, timer, timeout):
+    """ Run 'req' on a worker thread and answer it with TimeoutFailCode if
+        it is not done within 'timeout' seconds. The worker encodes into its
+        own buffer, which is only copied to 'fd' if it finishes in time. """
+    out = protocol.BufferedWriter (None)
+    worker_timer = timer.split ()
+    errors = []
+    children = []
+    done = []
+    def run ():
+        RequestChildren.children = children
+        try:
+            run_request (out, req, worker_timer)
+        except:
+            errors.append (sys.exc_info ()[1])
+        StuckLock.acquire ()
+        done.append (True)
+        if StuckRequests.get (req[1]) is req:
+            del StuckRequests[req[1]]
+        StuckLock.release ()
+    worker = threading.Thread (target=run)
+    worker.daemon = True
+    worker.start ()
+    worker.join (timeout)
+    timer.merge (worker_timer)
+    if not worker.is_alive ():
+        if errors:
+            raise errors[0]
+        fd.sendall (out.getvalue ())
+        return
+    timer.mark ('timeout')
+    trace ('%s.%s timed out after %ss', req[1], Operations[req[0]], timeout)
+    sys.stderr.write ('Request timed out after ' + str (timeout) + 's: ' + repr (req[:2]) + '\n')
+    Metrics.add_partial (Operations[req[0]], req[1], len (out.getvalue ()))
+    kill_request_children (children)
+    worker.join (KillGracePeriod)
+    if worker.is_alive () and provider_lock (req[1]) is not None:
+        # still stuck (a hung stat, say) and holding the provider lock
+        StuckLock.acquire ()
+        if not done:
+            StuckRequests[req[1]] = req
+        StuckLock.release ()
+    write_failed (fd, TimeoutFailCode, 'Request timed out after ' + str (timeout) + ' seconds')
+
+
+def run_request (fd, req, timer):
+    lock = provider_lock (req[1])
+    if lock is not None:
+        if req[1] in StuckRequests:
+            write_failed (fd, TimeoutFailCode, 'Provider lock held by a timed out ' + req[1] + ' request')
+            return
+        lock.acquire ()
+    try:
+        r = callMOF (req)
+        timer.mark ('dispatch')
+        if len (r) < 2 :
+            ret = None
+            rval = r[0]
+        else:
+            rval = r[0]
+            ret = r[1]
+        if rval == 0:
+            write_success (fd, ret)
+        else:
+            write_failed (fd,1, 'Error occurred processing '+ repr (req))
+        timer.mark ('encode')
+    finally:
+        if lock is not None:
+            lock.release ()
+
+
+def negotiate (reader, writer):
+    """ Answer an OP_NEGOTIATE request, returns the granted capabilities. """
+    requested = protocol.LENGTH_CODEC.unpack (reader.recv (protocol.LENGTH_CODEC.size))[0]
+    granted = requested & protocol.CAPABILITY_TAGGED
+    trace ('negotiate: requested %s granted %s', requested, granted)
+    write_int (writer, 0)
+    write_int (writer, granted)
+    write_int (writer, MaxWorkers)
+    writer.flush ()
+    return granted
+
+
+class Dispatcher:
+    """ Runs tagged requests on a bounded pool of worker threads. Each
+        response is encoded by its worker and written as one frame as soon
+        as it is ready, so responses go out in completion order. """
+
+    def __init__ (self, fd, workers):
+        self.fd = fd
+        self.send_lock = threading.Lock ()
+        self.requests = queue.Queue (workers * 2)
+        self.workers = []
+        for i in range (workers):
+            t = threading.Thread (target=self.work)
+            t.daemon = True
+            t.start ()
+            self.workers.append (t)
+
+    def submit (self, tag, req, timer):
+        self.requests.put ((tag, req, timer))
+
+    def close (self):
+        """ Wait for the requests already submitted to be answered. """
+        for t in self.workers:
+            self.requests.put (None)
+        for t in self.workers:
+            t.join ()
+
+    def sendall (self, buf):
+        self.send_lock.acquire ()
+        try:
+            self.fd.sendall (buf)
+        finally:
+            self.send_lock.release ()
+
+    def work (self):
+        while True:
+            item = self.requests.get ()
+            if item is None:
+                return
+            tag, req, timer = item
+            writer = protocol.BufferedWriter (self)
+            writer.sendall (protocol.TAG_CODEC.pack (tag))
+            try:
+                handle_request (writer, req, timer)
+            except Exception:
+                e = sys.exc_info ()[1]
+                sys.stderr.write ('\nException in resource provider: ')
+                sys.stderr.write (repr(e) + "\n")
+                writer.reset ()
+                writer.sendall (protocol.TAG_CODEC.pack (tag))
+                write_failed (writer, 1, 'Exception in resource provider: ' + repr (e))
+            try:
+                size = writer.flush ()
+            except socket.error:
+                sys.stderr.write('exception encountered')
+                continue
+            timer.mark ('send')
+            Metrics.add (Operations[req[0]], req[1], timer, size)
+            flush_logs ()
+
+
+def serve_tagged (reader, fd):
+    dispatcher = Dispatcher (fd, MaxWorkers)
+    try:
+        while True:
+            buf = reader.recv (protocol.TAG_CODEC.size)
+            if len (buf) < protocol.TAG_CODEC.size:
+                break
+            tag = protocol.TAG_CODEC.unpack (buf)[0]
+            timer = metrics.RequestTimer ()
+            req = read_request (reader, timer)
+            if req == None:
+                break
+            trace ('Main: request %s len is %s', tag, len (req))
+            dispatcher.submit (tag, req, timer)
+    finally:
+        dispatcher.close ()
+
 
 def main (argv):
     default_timeout_sec = 85
     socket.setdefaulttimeout(default_timeout_sec)
     fd = socket.fromfd (int (argv[1]), socket.AF_UNIX, socket.SOCK_STREAM)
+    reader = protocol.BufferedReader (fd)
+    writer = protocol.BufferedWriter (fd)
+    timer = metrics.RequestTimer ()
     read = 1
     out = ''
     while 0 < read:
         try:
-            req = read_request (fd)
+            req = read_request (reader, timer)
             if req == None:
                 read = -1
+            elif req[0] == protocol.OP_NEGOTIATE:
+                if negotiate (reader, writer) & protocol.CAPABILITY_TAGGED:
+                    serve_tagged (reader, fd)
+                    read = -1
             else:
-                trace ('Main: request len is '+str(len (req)))
+                trace ('Main: request len is %s', len (req))
                 if sys.version < '3':
-                    handle_request (fd, req)
+                    handle_request (writer, req, timer)
                 else:
                     try:
-                        handle_request (fd, req)
+                        handle_request (writer, req, timer)
                     except Exception as e:
                         trace ("Handle request failed for a python 3 resource provider. Exception from the resource provider: ")
-                        trace (repr(e))
+                        trace ('%r', e)
                         sys.stderr.write ('\nException in resource provider: ')
                         sys.stderr.write (repr(e) + "\n")
                         raise e 
+                size = writer.flush ()
+                timer.mark ('send')
+                Metrics.add (Operations[req[0]], req[1], timer, size)
+                flush_logs ()
         except socket.error:
             read = -1;
             sys.stderr.write('exception encountered')
+    flush_logs ()
+    Metrics.flush ()
+    write_import_report (ImportReport)
 
 ##############################
 try:
     try:
-        trace ('socket: '+str(sys.argv[1]))
+        trace ('socket: %s', sys.argv[1])
         
         pid_path=VarDir+'/run/python/'+repr(os.getuid())
         
         if not os.path.isdir(pid_path):
             os.system('mkdir -p ' + pid_path)
         pid_file=pid_path+'/dsc_python_client.pid'
+        ImportReport=pid_path+'/dsc_python_client.imports'
+        Metrics=metrics.Metrics(pid_path+'/dsc_python_client.metrics')
         try:        
             F = open(pid_file,'w')
             F.write(str(os.getpid()) + "\n")
@@ -175,26 +515,28 @@ try:
             F.close()
         except:
              sys.stderr.write('Unable to create '+pid_file)
-        trace ('using python version '+ sys.version) 
+        trace ('using python version %s', sys.version) 
         sys.path.insert(0,'') # put the cwd in the path so we can find our module
         if sys.version < '2.6':
-            trace (ScriptsDir + '/2.4x-2.5x')
+            trace ('%s/2.4x-2.5x', ScriptsDir)
             os.chdir(ScriptsDir + '/2.4x-2.5x')
         elif sys.version < '3':
-            trace (ScriptsDir + '/2.6x-2.7x')
+            trace ('%s/2.6x-2.7x', ScriptsDir)
             os.chdir(ScriptsDir + '/2.6x-2.7x')
         else:
-            trace (ScriptsDir + '/3.x')
+            trace ('%s/3.x', ScriptsDir)
             os.chdir (ScriptsDir + '/3.x')
             sys.path.append(ScriptsDir + '/3.x/Scripts')
         try:
-            from Scripts import *
+            # providers are imported by callMOF when first requested
+            import_timed ('Scripts')
         except:
-            trace ("Exception while Import: " + repr(sys.exc_info()))
+            trace ('Exception while Import: %r', sys.exc_info())
             sys.stderr.write ('\nException while Import: ')
             sys.stderr.write (repr(sys.exc_info())+'\n')
             traceback.print_tb (sys.exc_info()[2])
             sys.stderr.write ('\n') 
+        StartupTime = time.time ()
         if __name__ == '__main__':
             main (sys.argv)
     
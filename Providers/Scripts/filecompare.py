@@ -0,0 +1,311 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+File content comparison for the providers that keep copies of files
+(nxFile, nxOMSPlugin, nxOMSContainers, nxArchive).
+
+Two files are compared byte for byte in one pass, reading both into
+preallocated buffers with readinto and stopping at the first block that
+differs, so equal files cost one read each and different files usually
+much less.  Nothing is hashed unless a digest is asked for with
+file_digest, as when it is checked against one stored earlier.
+
+DigestCache keeps digests on disk, keyed by what stat says about the
+file, so that unchanged files are compared again without being read.
+"""
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+BLOCK_SIZE = 1048576
+
+# Entries kept by a DigestCache before the least recently used go.
+MAX_CACHE_ENTRIES = 100000
+# Files changed this recently are not cached, a change within the same
+# timestamp tick would leave their stat key as it was.
+RACY_WINDOW = 2
+
+
+def read_block(f, view):
+    """
+    Fills 'view' from 'f' and returns the number of bytes read, which is
+    short only at the end of the stream.
+    """
+    n = 0
+    size = len(view)
+    while n < size:
+        got = f.readinto(view[n:])
+        if not got:
+            break
+        n += got
+    return n
+
+
+def streams_equal(f1, f2, block_size=BLOCK_SIZE, hashes=None):
+    """
+    Returns True if the readable binary streams 'f1' and 'f2' hold the
+    same bytes up to their end.  'hashes', a pair of hash objects, are
+    updated with what is read from each stream.
+    """
+    buf1 = bytearray(block_size)
+    buf2 = bytearray(block_size)
+    view1 = memoryview(buf1)
+    view2 = memoryview(buf2)
+    while True:
+        n1 = read_block(f1, view1)
+        n2 = read_block(f2, view2)
+        if hashes is not None:
+            hashes[0].update(view1[:n1])
+            hashes[1].update(view2[:n2])
+        if n1 != n2:
+            return False
+        if n1 < block_size:
+            # memoryview equality compares item by item, slices of the
+            # bytearrays compare with memcmp
+            return buf1[:n1] == buf2[:n2]
+        if buf1 != buf2:
+            return False
+
+
+def files_equal(path1, path2, block_size=BLOCK_SIZE):
+    """
+    Returns True if the files at 'path1' and 'path2' have the same
+    contents.  Raises IOError or OSError if either cannot be read.
+    Equal contents have equal digests, so comparing the bytes answers
+    what comparing digests would without hashing either file.
+    """
+    f1 = io.open(path1, 'rb', buffering=0)
+    try:
+        f2 = io.open(path2, 'rb', buffering=0)
+        try:
+            st1 = os.fstat(f1.fileno())
+            st2 = os.fstat(f2.fileno())
+            if st1.st_size != st2.st_size:
+                return False
+            if (st1.st_dev, st1.st_ino) == (st2.st_dev, st2.st_ino):
+                return True
+            # one byte past the size reads the whole of a small file, and
+            # the end of file, in one block
+            return streams_equal(f1, f2, min(block_size, st1.st_size + 1))
+        finally:
+            f2.close()
+    finally:
+        f1.close()
+
+
+def file_digest(path, hashconst, block_size=BLOCK_SIZE):
+    """
+    Returns the hex digest of the file at 'path' using the hash
+    constructor 'hashconst', e.g. hashlib.md5.
+    """
+    h = hashconst()
+    f = io.open(path, 'rb', buffering=0)
+    try:
+        buf = bytearray(min(block_size, os.fstat(f.fileno()).st_size + 1))
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def stat_key(st):
+    try:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+    except AttributeError: # python < 3.3
+        return (st.st_dev, st.st_ino, st.st_size, int(st.st_mtime * 1e9), int(st.st_ctime * 1e9))
+
+
+class DigestCache(object):
+    """
+    File digests kept in the file at 'path', keyed by (st_dev, st_ino,
+    st_size, st_mtime_ns, st_ctime_ns) so a file whose stat is unchanged
+    is not read again.  At most 'max_entries' are kept, the least
+    recently used are dropped first.  The file is loaded on first use and
+    replaced atomically by save; hits and misses count lookups since the
+    cache was created.  A cache can be shared between threads.
+    """
+
+    def __init__(self, path, hashconst, max_entries=MAX_CACHE_ENTRIES):
+        self.path = path
+        self.hashconst = hashconst
+        self.name = hashconst().name
+        self.max_entries = max_entries
+        self.entries = None
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.entries = OrderedDict()
+        try:
+            F = open(self.path)
+            try:
+                lines = F.read().splitlines()
+            finally:
+                F.close()
+        except (IOError, OSError):
+            return
+        if not lines or lines[0] != self.header():
+            return
+        for l in lines[1:]:
+            fields = l.split()
+            if len(fields) != 6:
+                continue
+            try:
+                key = tuple([int(f) for f in fields[:5]])
+            except ValueError:
+                continue
+            self.entries[key] = fields[5]
+
+    def header(self):
+        return '# digest cache v1 ' + self.name
+
+    def get(self, st):
+        key = stat_key(st)
+        self.lock.acquire()
+        try:
+            if self.entries is None:
+                self.load()
+            digest = self.entries.get(key)
+            if digest is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # move to the most recently used end
+            del self.entries[key]
+            self.entries[key] = digest
+            return digest
+        finally:
+            self.lock.release()
+
+    def put(self, st, digest):
+        if time.time() - max(st.st_mtime, st.st_ctime) < RACY_WINDOW:
+            return
+        key = stat_key(st)
+        self.lock.acquire()
+        try:
+            if self.entries is None:
+                self.load()
+            if key in self.entries:
+                del self.entries[key]
+            self.entries[key] = digest
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+        finally:
+            self.lock.release()
+
+    def digest(self, path):
+        """
+        Returns the digest of the file at 'path', reading it only when the
+        cache has none for its current stat.
+        """
+        st = os.stat(path)
+        digest = self.get(st)
+        if digest is None:
+            digest = self.compute(path, st)
+        return digest
+
+    def compute(self, path, st):
+        """
+        Hashes the file at 'path' and caches the digest under 'st' unless
+        the file changed while it was read.
+        """
+        digest = file_digest(path, self.hashconst)
+        if stat_key(os.stat(path)) == stat_key(st):
+            self.put(st, digest)
+        return digest
+
+    def files_equal(self, path1, path2, st1=None, st2=None):
+        """
+        files_equal, answered from the cached digests of both files when
+        there are; otherwise the files are compared and hashed in the same
+        pass and their digests cached.  'st1' and 'st2' are the stat
+        results of the files if the caller has them already.
+        """
+        if st1 is None:
+            st1 = os.stat(path1)
+        if st2 is None:
+            st2 = os.stat(path2)
+        if st1.st_size != st2.st_size:
+            return False
+        if (st1.st_dev, st1.st_ino) == (st2.st_dev, st2.st_ino):
+            return True
+        d1 = self.get(st1)
+        d2 = self.get(st2)
+        if d1 is not None and d2 is not None:
+            return d1 == d2
+        if d1 is not None:
+            return d1 == self.compute(path2, st2)
+        if d2 is not None:
+            return d2 == self.compute(path1, st1)
+        hashes = (self.hashconst(), self.hashconst())
+        f1 = io.open(path1, 'rb', buffering=0)
+        try:
+            f2 = io.open(path2, 'rb', buffering=0)
+            try:
+                equal = streams_equal(f1, f2, min(BLOCK_SIZE, st1.st_size + 1), hashes)
+            finally:
+                f2.close()
+        finally:
+            f1.close()
+        if equal:
+            if stat_key(os.stat(path1)) == stat_key(st1):
+                self.put(st1, hashes[0].hexdigest())
+            if stat_key(os.stat(path2)) == stat_key(st2):
+                self.put(st2, hashes[1].hexdigest())
+        return equal
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = 0.0
+        if lookups:
+            rate = 100.0 * self.hits / lookups
+        return '%d hits, %d misses (%.1f%% hit rate)' % (self.hits, self.misses, rate)
+
+    def save(self):
+        """
+        Writes the cache if it changed, through a temporary file renamed
+        over the old one once it is synced, so a crash leaves either the
+        old cache or the new one.  Returns False if it could not.
+        """
+        if not self.dirty:
+            return True
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path))
+            try:
+                F = os.fdopen(fd, 'w')
+                try:
+                    lines = [self.header()]
+                    self.lock.acquire()
+                    try:
+                        for key, digest in self.entries.items():
+                            lines.append('%d %d %d %d %d ' % key + digest)
+                    finally:
+                        self.lock.release()
+                    F.write('\n'.join(lines) + '\n')
+                    F.flush()
+                    os.fsync(F.fileno())
+                finally:
+                    F.close()
+                os.rename(tmp, self.path)
+            except:
+                os.remove(tmp)
+                raise
+        except (IOError, OSError):
+            return False
+        self.dirty = False
+        return True
@@ -10,3 +10,43 @@ DSC_NAMESPACE="<DSC_NAMESPACE>"
 DSC_SCRIPT_PATH="<DSC_SCRIPT_PATH>"
 DSC_MODULES_PATH="<DSC_MODULES_PATH>"
 DSC_HOST_BASE_PATH="<DSC_HOST_BASE_PATH>"
+
+DSC_CONF = CONFIG_SYSCONFDIR + '/' + CONFIG_SYSCONFDIR_DSC + '/dsc.conf'
+
+
+def read_dsc_conf(path=DSC_CONF):
+    """
+    Returns the key=value settings of the dsc.conf at 'path', {} if it
+    cannot be read.  Lines starting with '#' are comments.
+    """
+    conf = {}
+    try:
+        F = open(path)
+        try:
+            lines = F.read().splitlines()
+        finally:
+            F.close()
+    except (IOError, OSError):
+        lines = []
+    for l in lines:
+        l = l.strip()
+        if l.startswith('#') or '=' not in l:
+            continue
+        key, value = l.split('=', 1)
+        conf[key.strip()] = value.strip()
+    return conf
+
+
+# The settings of dsc.conf, read once per process by dsc_conf() and kept
+# when this module is loaded again.
+try:
+    DscConf
+except NameError:
+    DscConf = None
+
+
+def dsc_conf():
+    global DscConf
+    if DscConf is None:
+        DscConf = read_dsc_conf()
+    return DscConf
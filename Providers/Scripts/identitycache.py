@@ -0,0 +1,161 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Cached user and group lookups for the providers.
+
+pwd.getpwuid and friends ask NSS every time, which for LDAP or SSSD
+users can mean a trip to a server, and inventories ask for the owner
+and group of every file.  Users and Groups remember the answers, names
+by id and ids by name, failed lookups included, in a bounded LRU:
+answers for TTL seconds, failed lookups for NEGATIVE_TTL seconds.  All
+entries of a database are dropped as soon as its file (/etc/passwd,
+/etc/group) changes, which is checked at most every CHECK_INTERVAL
+seconds, and by invalidate(), for providers that just changed users
+or groups.
+
+The functions raise KeyError for unknown users and groups, as pwd and
+grp do.  The caches are shared by the providers of a process and kept
+when this module is loaded again.
+"""
+import grp
+import os
+import pwd
+import threading
+import time
+from collections import OrderedDict
+
+TTL = 300
+NEGATIVE_TTL = 60
+MAX_ENTRIES = 8192
+CHECK_INTERVAL = 1
+
+clock = time.monotonic
+
+
+class Database(object):
+    """
+    Lookups in the passwd or group database through 'by_id' and
+    'by_name', which return an entry with the name at [0] and the id at
+    [2] or raise KeyError.
+    """
+
+    def __init__(self, path, by_id, by_name, ttl=TTL, negative_ttl=NEGATIVE_TTL, size=MAX_ENTRIES):
+        self.path = path
+        self.by_id = by_id
+        self.by_name = by_name
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # ('id', id) or ('name', name) -> (expires, (name, id) or None)
+        self.stamp = None
+        self.checked = None
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.checked = None
+        finally:
+            self.lock.release()
+
+    def check(self, now):
+        """
+        Drops every entry if the database file changed.  Called with the
+        lock held.
+        """
+        if self.checked is not None and now - self.checked < CHECK_INTERVAL:
+            return
+        self.checked = now
+        try:
+            st = os.stat(self.path)
+            stamp = st.st_mtime, st.st_ino, st.st_size
+        except OSError:
+            stamp = None
+        if stamp != self.stamp:
+            self.entries.clear()
+            self.stamp = stamp
+
+    def store(self, key, expires, value):
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def lookup(self, kind, key):
+        """
+        Returns (name, id) for 'key', an id if 'kind' is 'id' or a name if
+        it is 'name'.
+        """
+        k = (kind, key)
+        self.lock.acquire()
+        try:
+            now = clock()
+            self.check(now)
+            entry = self.entries.get(k)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(k)
+                self.hits += 1
+                if entry[1] is None:
+                    raise KeyError(key)
+                return entry[1]
+            self.misses += 1
+        finally:
+            self.lock.release()
+        # asked without the lock, lookups can be slow
+        try:
+            if kind == 'id':
+                e = self.by_id(key)
+            else:
+                e = self.by_name(key)
+            value = (e[0], e[2])
+        except KeyError:
+            value = None
+        self.lock.acquire()
+        try:
+            now = clock()
+            if value is None:
+                self.store(k, now + self.negative_ttl, None)
+                raise KeyError(key)
+            self.store(k, now + self.ttl, value)
+            if kind == 'id':
+                # the name is this id's, the id of the name may not be this
+                # one's name, e.g. for a second name of uid 0
+                self.store(('name', value[0]), now + self.ttl, value)
+            return value
+        finally:
+            self.lock.release()
+
+
+try:
+    Users
+except NameError:
+    Users = Database('/etc/passwd', pwd.getpwuid, pwd.getpwnam)
+    Groups = Database('/etc/group', grp.getgrgid, grp.getgrnam)
+
+
+def user_name(uid):
+    return Users.lookup('id', uid)[0]
+
+
+def user_id(name):
+    return Users.lookup('name', name)[1]
+
+
+def group_name(gid):
+    return Groups.lookup('id', gid)[0]
+
+
+def group_id(name):
+    return Groups.lookup('name', name)[1]
+
+
+def invalidate():
+    """
+    Forgets every user and group, after they were changed.
+    """
+    Users.invalidate()
+    Groups.invalidate()
@@ -0,0 +1,249 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Inventory snapshots for nxFileInventory.
+
+A snapshot keeps what an inventory found, one entry per path:
+
+  (path, dev, ino, size, mtime_ns, ctime_ns, mode, type, owner, group, checksum)
+
+so that the next inventory of the same files need not read again those
+whose stat did not change, and can tell what was added, removed or
+modified since.
+
+The file is written entry by entry as the inventory goes, in the order
+of the walk, and ends with an index of (hash of the path, offset) pairs
+sorted by hash.  It is mapped rather than read, so opening it costs the
+same for ten entries or a million, and find() is a binary search of the
+index.  As an inventory walks the files in much the same order as the
+one before it, find() first looks at the entry after the one it found
+last.  A Writer keeps only the index in memory and puts the file in
+place atomically.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b'nxFIsnp1'
+# magic, time the inventory started, entries, offset of the index
+HEADER = struct.Struct('<8sdQQ')
+# dev, ino, size, mtime_ns, ctime_ns, mode, type, and the lengths of
+# the path, owner, group and checksum that follow
+ENTRY = struct.Struct('<QQqqqIBxHHHH')
+INDEX = struct.Struct('<QQ')
+TYPES = ('file', 'directory', 'link')
+
+# Files changed this soon before a snapshot was taken may change again
+# within the same timestamp tick and keep the stat of the snapshot.
+RACY_WINDOW = 2
+
+
+def path_key(path):
+    return os.fsencode(path)
+
+
+def path_hash(key):
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+
+def stat_fields(st):
+    """
+    The (dev, ino, size, mtime_ns, ctime_ns) of stat result 'st'.
+    """
+    try:
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+    except AttributeError: # python < 3.3
+        return (st.st_dev, st.st_ino, st.st_size, int(st.st_mtime * 1e9), int(st.st_ctime * 1e9))
+
+
+def make_entry(path, st, type, owner, group, checksum):
+    return (path,) + stat_fields(st) + (st.st_mode, type, owner, group, checksum)
+
+
+def encode(s):
+    return s.encode('utf-8', 'surrogateescape')
+
+
+def decode(b):
+    return b.decode('utf-8', 'surrogateescape')
+
+
+class Snapshot(object):
+    """
+    The snapshot in the file at 'path', or an empty one if there is no
+    such file or it is not a whole snapshot.  'taken' is the time the
+    inventory that wrote it started.
+    """
+
+    def __init__(self, path):
+        self.map = None
+        self.taken = 0
+        self.count = 0
+        self.index = 0
+        # the entry find() returned last, and the offset of the next one
+        self.last = None
+        self.next = HEADER.size
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER.size:
+                return
+            m = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        finally:
+            os.close(fd)
+        magic, taken, count, index = HEADER.unpack_from(m, 0)
+        if magic != MAGIC or index < HEADER.size or index + count * INDEX.size != size:
+            m.close()
+            return
+        self.map = m
+        self.taken = taken
+        self.count = count
+        self.index = index
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def read(self, offset):
+        """
+        Returns the entry at 'offset' and the offset of the next one.
+        """
+        m = self.map
+        dev, ino, size, mtime_ns, ctime_ns, mode, type, lp, lo, lg, lc = ENTRY.unpack_from(m, offset)
+        offset += ENTRY.size
+        path = os.fsdecode(m[offset:offset + lp])
+        offset += lp
+        owner = decode(m[offset:offset + lo])
+        offset += lo
+        group = decode(m[offset:offset + lg])
+        offset += lg
+        checksum = decode(m[offset:offset + lc])
+        offset += lc
+        return (path, dev, ino, size, mtime_ns, ctime_ns, mode, TYPES[type], owner, group, checksum), offset
+
+    def __iter__(self):
+        """
+        The entries, in the order they were written.
+        """
+        offset = HEADER.size
+        while offset < self.index:
+            entry, offset = self.read(offset)
+            yield entry
+
+    def find(self, path):
+        """
+        Returns the entry of 'path', or None.
+        """
+        if not self.count:
+            return None
+        if self.last is not None and self.last[0] == path:
+            return self.last
+        key = path_key(path)
+        m = self.map
+        if self.next < self.index:
+            offset = self.next
+            start = offset + ENTRY.size
+            if m[start:start + ENTRY.unpack_from(m, offset)[7]] == key:
+                self.last, self.next = self.read(offset)
+                return self.last
+        h = path_hash(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INDEX.unpack_from(m, self.index + mid * INDEX.size)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.count:
+            eh, offset = INDEX.unpack_from(m, self.index + lo * INDEX.size)
+            if eh != h:
+                break
+            start = offset + ENTRY.size
+            if m[start:start + ENTRY.unpack_from(m, offset)[7]] == key:
+                self.last, self.next = self.read(offset)
+                return self.last
+            lo += 1
+        return None
+
+    def unchanged(self, entry, st):
+        """
+        True if 'st' is the stat 'entry' was made from and the file had
+        not changed within RACY_WINDOW seconds before the snapshot, so
+        what the snapshot says of its contents still holds.
+        """
+        return entry[1:6] == stat_fields(st) and \
+            max(entry[4], entry[5]) < (self.taken - RACY_WINDOW) * 1e9
+
+
+class Writer(object):
+    """
+    Writes the snapshot at 'path' of an inventory started at time
+    'taken', one entry at a time with add().  finish() completes the
+    file and returns it as a Snapshot; install() then puts it in place
+    of the old one.  abort() drops the file if it was not installed.
+    """
+
+    def __init__(self, path, taken):
+        self.path = path
+        self.taken = taken
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, self.tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+        self.file = os.fdopen(fd, 'wb')
+        self.file.write(HEADER.pack(MAGIC, taken, 0, 0))
+        self.offset = HEADER.size
+        self.keys = []
+
+    def add(self, entry):
+        path, dev, ino, size, mtime_ns, ctime_ns, mode, type, owner, group, checksum = entry
+        key = path_key(path)
+        owner = encode(owner)
+        group = encode(group)
+        checksum = encode(checksum)
+        data = ENTRY.pack(dev, ino, size, mtime_ns, ctime_ns, mode, TYPES.index(type),
+                          len(key), len(owner), len(group), len(checksum)) + key + owner + group + checksum
+        self.file.write(data)
+        # one int per entry, sorted by hash then offset
+        self.keys.append(path_hash(key) << 64 | self.offset)
+        self.offset += len(data)
+
+    def finish(self):
+        self.keys.sort()
+        mask = (1 << 64) - 1
+        for k in self.keys:
+            self.file.write(INDEX.pack(k >> 64, k & mask))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.taken, len(self.keys), self.offset))
+        self.keys = None
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return Snapshot(self.tmp)
+
+    def install(self):
+        os.rename(self.tmp, self.path)
+        self.tmp = None
+
+    def abort(self):
+        if self.tmp is None:
+            return
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+        self.tmp = None
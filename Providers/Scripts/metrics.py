@@ -0,0 +1,166 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Request latency metrics for the Python provider host (client.py).
+
+Every request is timed per phase (decode, dispatch, encode, send, or
+timeout for requests that ran past their deadline) and the durations
+are aggregated into histograms keyed by operation, provider and phase,
+next to histograms of response sizes and of the partial sizes timed
+out requests had reached. The aggregate is rewritten to the metrics
+file every FLUSH_INTERVAL seconds and when the client exits.
+"""
+import bisect
+import os
+import threading
+import time
+
+try:
+    clock = time.monotonic
+except AttributeError: # python < 3.3
+    clock = time.time
+
+FLUSH_INTERVAL = 60
+
+# Upper bounds of the histogram buckets, the last bucket is open ended.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def format(self, fmt):
+        fields = ['count', str(self.count), 'sum', fmt % self.total, 'max', fmt % self.max]
+        for i in range(len(self.buckets)):
+            fields.append('le_' + str(self.buckets[i]))
+            fields.append(str(self.counts[i]))
+        fields.append('le_inf')
+        fields.append(str(self.counts[-1]))
+        return ' '.join(fields)
+
+
+class RequestTimer:
+    """
+    Splits the time spent on one request into named phases, each mark
+    closes the phase that started at the previous mark.
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.start = self.last = clock()
+
+    def restart(self):
+        self.phases = []
+        self.start = self.last = clock()
+
+    def mark(self, phase):
+        now = clock()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def split(self):
+        """
+        Returns a timer for phases marked on another thread, starting where
+        this one stands; merge folds them back in.
+        """
+        timer = RequestTimer()
+        timer.start = timer.last = self.last
+        return timer
+
+    def merge(self, timer):
+        self.phases.extend(list(timer.phases))
+        self.last = timer.last
+
+
+class Metrics:
+    def __init__(self, path, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.started = time.time()
+        self.last_flush = clock()
+        self.latency = {}
+        self.sizes = {}
+        self.partial = {}
+        self.lock = threading.Lock()
+
+    def add(self, operation, provider, timer, size=None):
+        """
+        Record the phases of 'timer' and the response size for one request.
+        """
+        self.lock.acquire()
+        try:
+            self.add_locked(operation, provider, timer, size)
+        finally:
+            self.lock.release()
+
+    def add_partial(self, operation, provider, size):
+        """
+        Record how much of its response a request that ran out of time had
+        encoded.
+        """
+        self.lock.acquire()
+        try:
+            self.histogram(self.partial, (operation, provider), SIZE_BUCKETS).add(size)
+        finally:
+            self.lock.release()
+
+    def add_locked(self, operation, provider, timer, size):
+        total = 0
+        for phase, seconds in timer.phases:
+            self.histogram(self.latency, (operation, provider, phase), LATENCY_BUCKETS).add(seconds)
+            total += seconds
+        self.histogram(self.latency, (operation, provider, 'total'), LATENCY_BUCKETS).add(total)
+        if size is not None:
+            self.histogram(self.sizes, (operation, provider), SIZE_BUCKETS).add(size)
+        if clock() - self.last_flush >= self.interval:
+            self.flush()
+
+    def histogram(self, histograms, key, buckets):
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = Histogram(buckets)
+        return h
+
+    def flush(self):
+        """
+        Rewrite the metrics file, through a temporary file so readers never
+        see it half written.
+        """
+        self.last_flush = clock()
+        lines = ['# pid ' + str(os.getpid()) + ' started ' + str(int(self.started))
+                 + ' updated ' + str(int(time.time()))]
+        keys = list(self.latency.keys())
+        keys.sort()
+        for key in keys:
+            lines.append('latency ' + ' '.join(key) + ' ' + self.latency[key].format('%.6f'))
+        keys = list(self.sizes.keys())
+        keys.sort()
+        for key in keys:
+            lines.append('bytes ' + ' '.join(key) + ' ' + self.sizes[key].format('%d'))
+        keys = list(self.partial.keys())
+        keys.sort()
+        for key in keys:
+            lines.append('partial ' + ' '.join(key) + ' ' + self.partial[key].format('%d'))
+        tmp = self.path + '.tmp'
+        try:
+            F = open(tmp, 'w')
+            F.write('\n'.join(lines) + '\n')
+            F.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            return False
+        return True
@@ -9,6 +9,8 @@ import time
 import inspect
 import codecs
 import imp
+import atexit
+import threading
 
 scriptFolderPath = os.path.dirname(os.path.realpath(__file__))
 fullPath = os.path.join(scriptFolderPath, 'helperlib.py')
@@ -19,6 +21,26 @@ LogFile = VarDir + "/log/dsc.log"
 if helperlib.CONFIG_SYSCONFDIR_DSC == "omsconfig":
     LogFile = "/var/opt/microsoft/omsconfig/omsconfig.log"
 
+# LogLevel=<level> in dsc.conf sets the level for every provider and
+# LogLevel.<provider>=<level>, e.g. LogLevel.nxPackage=DEBUG, overrides it
+# for one.  Levels are names or numbers 0 (FATAL) to 5 (VERBOSE).
+DscConfFile = helperlib.DSC_CONF
+LEVELS = ((0, 'FATAL'), (1, 'ERROR'), (2, 'WARNING'), (3, 'INFO'),
+          (4, 'DEBUG'), (5, 'VERBOSE'))
+# built aside, as providers load this module again while others log
+LEVEL_NUMBERS = dict([(strng, num) for num, strng in LEVELS])
+DefaultLogLevel = 5
+
+# Log lines are buffered and written once FlushSize bytes are pending,
+# once the oldest pending line is FlushInterval seconds old, and at exit.
+FlushSize = 65536
+FlushInterval = 5
+
+try:
+    unicode_type = unicode
+except NameError:
+    unicode_type = str
+
 def Print(s, file=sys.stderr):
     file.write(s + '\n')
 
@@ -33,57 +55,254 @@ def opened_w_error(filename, mode="r"):
         return None, Exception('IOError')
     return f, None
 
+
+class LogWriter(object):
+    """
+    Appends to one log file through a handle kept open between writes.
+    Lines are buffered in memory and written in batches; every batch
+    first checks that the path still names the open file, and reopens
+    it if logrotate moved or removed it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.pending = []
+        self.size = 0
+        self.oldest = None
+        self.errorreported = False
+        self.lock = threading.Lock()
+
+    def write(self, line):
+        if isinstance(line, unicode_type):
+            line = line.encode('utf8')
+        self.lock.acquire()
+        try:
+            self.pending.append(line)
+            self.size += len(line)
+            if self.oldest is None:
+                self.oldest = time.time()
+                start_flusher()
+            if self.size >= FlushSize or time.time() - self.oldest >= FlushInterval:
+                self.flush_locked()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self.flush_locked()
+        finally:
+            self.lock.release()
+
+    def flush_stale(self):
+        self.lock.acquire()
+        try:
+            if self.oldest is not None and time.time() - self.oldest >= FlushInterval:
+                self.flush_locked()
+        finally:
+            self.lock.release()
+
+    def flush_locked(self):
+        if not self.pending:
+            return
+        data = ''.encode('utf8').join(self.pending)
+        self.pending = []
+        self.size = 0
+        self.oldest = None
+        try:
+            self.reopen_if_rotated()
+            self.file.write(data)
+            self.file.flush()
+        except (IOError, OSError):
+            self.close()
+            if not self.errorreported:
+                Print("Exception writing logfile " + self.path +
+                      " Error: " + str(sys.exc_info()[1]), file=sys.stderr)
+                self.errorreported = True
+
+    def reopen_if_rotated(self):
+        if self.file is not None:
+            try:
+                st = os.stat(self.path)
+                if (st.st_dev, st.st_ino) == self.inode:
+                    return
+            except OSError:
+                pass
+            self.close()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(self.path, 'ab')
+        st = os.fstat(self.file.fileno())
+        self.inode = (st.st_dev, st.st_ino)
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except (IOError, OSError):
+                pass
+        self.file = None
+        self.inode = None
+
+
+# Providers load this module with imp.load_source, which re-executes it in
+# place; the writers, and the flusher thread, must survive that.
+try:
+    Writers
+except NameError:
+    Writers = {}
+    WritersLock = threading.Lock()
+    Flusher = None
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: forget_pending())
+
+
+def get_writer(path):
+    writer = Writers.get(path)
+    if writer is None:
+        WritersLock.acquire()
+        try:
+            writer = Writers.get(path)
+            if writer is None:
+                writer = Writers[path] = LogWriter(path)
+        finally:
+            WritersLock.release()
+    return writer
+
+
+def flush_all():
+    """
+    Writes every buffered log line.  client.py calls this after each
+    response, and it runs at exit.
+    """
+    for writer in list(Writers.values()):
+        writer.flush()
+
+
+def forget_pending():
+    # a forked child must not write the lines its parent will write
+    for writer in list(Writers.values()):
+        writer.pending = []
+        writer.size = 0
+        writer.oldest = None
+
+
+def flush_stale():
+    while True:
+        time.sleep(FlushInterval)
+        for writer in list(Writers.values()):
+            writer.flush_stale()
+
+
+def start_flusher():
+    global Flusher
+    if Flusher is None:
+        WritersLock.acquire()
+        try:
+            if Flusher is None:
+                Flusher = threading.Thread(target=flush_stale)
+                Flusher.daemon = True
+                Flusher.start()
+                atexit.register(flush_all)
+        finally:
+            WritersLock.release()
+
+
+def level_number(value, default):
+    """
+    Returns the level named or numbered by 'value', or 'default' if it
+    is neither.
+    """
+    if value in LEVEL_NUMBERS:
+        return LEVEL_NUMBERS[value]
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    if value < 0 or value > 5:
+        return default
+    return value
+
+
+def read_log_config(path):
+    """
+    Returns (level, overrides, max_level) from the LogLevel settings of
+    dsc.conf; overrides maps provider names to their level and max_level
+    is the most verbose of them all.
+    """
+    level = DefaultLogLevel
+    overrides = {}
+    for key, value in helperlib.read_dsc_conf(path).items():
+        value = value.upper()
+        if key == 'LogLevel':
+            level = level_number(value, level)
+        elif key.startswith('LogLevel.'):
+            overrides[key[len('LogLevel.'):]] = level_number(value, DefaultLogLevel)
+    max_level = level
+    for value in overrides.values():
+        max_level = max(max_level, value)
+    return level, overrides, max_level
+
+
+# dsc.conf is read once per process, the first time a line is logged.
+try:
+    LogConfig
+except NameError:
+    LogConfig = None
+
+
+def get_log_config():
+    global LogConfig
+    if LogConfig is None:
+        LogConfig = read_log_config(DscConfFile)
+    return LogConfig
+
 # YYYY/MM/DD HH:MM:SS: LEVEL: FILE(LINE): \n message \n
 
 
 class DSCLog(object):
 
+    levels = LEVELS
+
     def __init__(self, logpath = LogFile):
-        self.levels = ((0, 'FATAL'), (1, 'ERROR'), (2, 'WARNING'), (3, 'INFO'),
-                       (4, 'DEBUG'), (5, 'VERBOSE'))
         self.current_level = self.GetCurrentLogLevel()
-        if helperlib.CONFIG_SYSCONFDIR_DSC != "omsconfig":
-            os.system('mkdir -p ' + VarDir + '/log')
         self.file_path = logpath
 
     def Log(self, log_level, message):
-        last_frame = inspect.currentframe().f_back
-        place = last_frame.f_globals['__file__'] + \
-            '('+str(last_frame.f_lineno)+')'
-        if message is None or len(message) is 0:
-            return
+        """
+        Logs 'message' at 'log_level'.  'message' may be a callable
+        returning the text, it is only called if the line gets logged.
+        """
         if log_level is None:
             log_level = self.current_level
-        if type(log_level) == str:
-            t = log_level
-            log_level = 5
-            for num, strng in self.levels:
-                if t == strng:
-                    log_level = num
-        if log_level < 0 or log_level > 5 or len(message) < 1:
+        elif type(log_level) == str:
+            log_level = LEVEL_NUMBERS.get(log_level, 5)
+        level, overrides, max_level = get_log_config()
+        if log_level < 0 or log_level > max_level:
             return
-        if log_level > self.current_level:
+        last_frame = inspect.currentframe().f_back
+        filename = last_frame.f_globals['__file__']
+        if overrides:
+            provider = os.path.splitext(os.path.basename(filename))[0]
+            if log_level > overrides.get(provider, level):
+                return
+        place = filename + '('+str(last_frame.f_lineno)+')'
+        if callable(message):
+            message = message()
+        if message is None or len(message) == 0:
             return
         t = time.localtime()
         line = "%04u/%02u/%02u %02u:%02u:%02u: %s: %s:\n%s\n" % (t.tm_year,
             t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec,
             self.levels[log_level][1], place, message)
-        error = None
-        try:
-            F, error = opened_w_error(self.file_path, 'a')
-            if error:
-                Print("Exception opening logfile " + self.file_path +
-                      " Error: " + str(error), file=sys.stderr)
-            else:
-                F.write(line)
-                F.close()
-        except:
-            F.close()
-            Print("Exception opening logfile " + self.file_path +
-                  " Error: " + str(error), file=sys.stderr)
-
-    def GetCurrentLogLevel(self):
-        return 5
+        get_writer(self.file_path).write(line)
+
+    def GetCurrentLogLevel(self, provider=None):
+        level, overrides, max_level = get_log_config()
+        return overrides.get(provider, level)
 
 class ConsoleAndFileLogger(object):
     def __init__(self, path=LogFile):
@@ -93,23 +312,9 @@ class ConsoleAndFileLogger(object):
         
     def write(self, message):
         self.console.write(message)
-        try:
-            file_handle = codecs.open(self.logpath, 'a', 'utf8')
-            try:
-                try:
-                    file_handle.write(message)
-                except:
-                    if not self.errorreported:
-                        self.console.write("Failed to write the dsc log file " + self.logpath + "\n")
-                        self.errorreported = True
-            finally:
-                file_handle.close()
-        except:
-            if not self.errorreported:
-                self.console.write("Failed to open the dsc log file " + self.logpath + "\n")
-                self.errorreported = True
-                
+        get_writer(self.logpath).write(message)
+
     def flush(self):
-        pass
+        get_writer(self.logpath).flush()
     def __del__(self):
         sys.stdout = self.console
\ No newline at end of file
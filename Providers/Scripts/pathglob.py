@@ -0,0 +1,204 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Path patterns for nxFileInventory.
+
+A pattern is an absolute path whose components are fnmatch globs ('*',
+'?', '[...]'), each matched against one name so that none matches
+across a '/', or '**', which matches any number of directories, none
+included.  PathGlob compiles the components once and matches a path a
+name at a time as it is walked: the states reached at a directory tell
+both whether it matches and whether anything below it still can, so a
+walk need not enter directories where nothing will match.
+
+PathFilter applies lists of patterns of paths to leave out of a walk
+and of paths to keep in it all the same.
+"""
+import fnmatch
+import re
+
+MAGIC = re.compile('[*?[]')
+
+
+def compile_name(pattern):
+    """
+    The match function of glob 'pattern' for a name, which matches as
+    fnmatch.fnmatch does on POSIX.
+    """
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def is_literal(pattern):
+    """
+    True if glob 'pattern' matches no name but itself.
+    """
+    return MAGIC.search(pattern) is None
+
+
+def split(path):
+    return [c for c in path.split('/') if c]
+
+
+def parse_list(value):
+    """
+    The patterns of a comma separated dsc.conf setting.
+    """
+    return [p.strip() for p in (value or '').split(',') if p.strip()]
+
+
+class PathGlob(object):
+    """
+    Pattern 'pattern' compiled.  A state is the number of components
+    matched so far; the states of a path are those its names can reach
+    from the root, the empty set once it cannot match.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.parts = [] # match functions, None for '**'
+        self.literals = [] # components without wildcards, None for others
+        for c in split(pattern):
+            if c == '**':
+                if self.parts and self.parts[-1] is None:
+                    continue
+                self.parts.append(None)
+                self.literals.append(None)
+            else:
+                self.parts.append(compile_name(c))
+                self.literals.append(c if is_literal(c) else None)
+        self.end = len(self.parts)
+        self.root = self.closure([0])
+
+    def closure(self, states):
+        """
+        'states' and the states past the '**' they are at, which may
+        match no directory.
+        """
+        out = set(states)
+        for i in states:
+            while i < self.end and self.parts[i] is None:
+                i += 1
+                out.add(i)
+        return frozenset(out)
+
+    def step(self, states, name):
+        """
+        The states of the path in 'states' followed by 'name'.
+        """
+        out = []
+        for i in states:
+            if i == self.end:
+                continue
+            part = self.parts[i]
+            if part is None:
+                out.append(i)
+            elif part(name) is not None:
+                out.append(i + 1)
+        return self.closure(out)
+
+    def states(self, path):
+        s = self.root
+        for name in split(path):
+            if not s:
+                break
+            s = self.step(s, name)
+        return s
+
+    def matches(self, states):
+        return self.end in states
+
+    def below(self, states):
+        """
+        True if paths below the one in 'states' may match.
+        """
+        for i in states:
+            if i < self.end:
+                return True
+        return False
+
+    def names(self, states):
+        """
+        The only names that may follow the path in 'states' in a match,
+        if they have no wildcards; None if there are others.
+        """
+        names = set()
+        for i in states:
+            if i < self.end:
+                if self.literals[i] is None:
+                    return None
+                names.add(self.literals[i])
+        return names
+
+    def match(self, path):
+        return self.matches(self.states(path))
+
+
+class PathFilter(object):
+    """
+    Leaves out the paths that match one of the 'exclude' patterns, or
+    are below a directory that does, unless they, or a directory above
+    them, match one of the 'include' patterns.  A directory left out is
+    walked all the same if an include pattern may match below it.
+
+    The states of the last directory asked about are kept, as a walk
+    asks about the entries of one directory after the other.
+    """
+
+    def __init__(self, exclude, include=()):
+        self.exclude = [PathGlob(p) for p in exclude]
+        self.include = [PathGlob(p) for p in include]
+        self.globs = self.exclude + self.include
+        self.root = self.step([g.root for g in self.globs], None)
+        self.dir = None
+        self.dir_states = None
+
+    def step(self, states, name):
+        """
+        The states of each pattern after 'name', None for one that
+        matched, as everything below a match does.
+        """
+        out = []
+        for g, s in zip(self.globs, states):
+            if s is not None:
+                if name is not None:
+                    s = g.step(s, name)
+                if g.matches(s):
+                    s = None
+            out.append(s)
+        return out
+
+    def states(self, path):
+        path = path.rstrip('/')
+        if not path:
+            return self.root
+        d, name = path.rsplit('/', 1)
+        if d != self.dir:
+            s = self.root
+            for n in split(d):
+                s = self.step(s, n)
+            self.dir = d
+            self.dir_states = s
+        return self.step(self.dir_states, name)
+
+    def left_out(self, states):
+        n = len(self.exclude)
+        return None in states[:n] and None not in states[n:]
+
+    def skip(self, path):
+        """
+        True if 'path' is left out.
+        """
+        return self.left_out(self.states(path))
+
+    def enter(self, path):
+        """
+        True if directory 'path' is to be walked.
+        """
+        s = self.states(path)
+        if not self.left_out(s):
+            return True
+        for g, i in zip(self.include, s[len(self.exclude):]):
+            if g.below(i):
+                return True
+        return False
@@ -1,4 +1,7 @@
+import array
 import ctypes
+import os
+import socket
 import struct
 import sys
 import time
@@ -75,30 +78,269 @@ MI_TYPE_NAMES={
 64:'MI_NULL_FLAG',
 }
 
-DO_TRACE = True
-DO_VERBOSE_TRACE = False
-
-
-def trace(text):
-    if DO_TRACE:
-        sys.stdout.write(repr(text) + '\n')
-
+# Trace levels. TraceLevel is read from DSC_PYTHON_TRACE when the module is
+# loaded; messages above it are dropped before any formatting happens.
+TRACE_OFF = 0
+TRACE_ON = 1
+TRACE_VERBOSE = 2
+TRACE_LEVEL_NAMES = {'off': TRACE_OFF, 'on': TRACE_ON, 'verbose': TRACE_VERBOSE}
+
+
+def trace_level_from(value, default=TRACE_OFF):
+    """
+    Parses a trace level given as a name (off, on, verbose) or a number.
+    """
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in TRACE_LEVEL_NAMES:
+        return TRACE_LEVEL_NAMES[value]
+    try:
+        return max(TRACE_OFF, min(TRACE_VERBOSE, int(value)))
+    except ValueError:
+        return default
+
+
+# Providers load this file again with imp.load_source, which re-runs it in
+# the same module, so the level has to come from the environment rather
+# than from whoever imported it first.
+TraceLevel = trace_level_from(os.environ.get('DSC_PYTHON_TRACE'))
+
+
+def set_trace_level(level):
+    global TraceLevel
+    TraceLevel = level
+
+
+def emit_trace(fmt, args):
+    """
+    Writes one trace line. 'fmt' is either a callable returning the text
+    or a %-format applied to 'args'.
+    """
+    if callable(fmt):
+        text = fmt()
+    elif args:
+        text = fmt % args
+    else:
+        text = fmt
+    sys.stdout.write(text + '\n')
+
+
+def trace(fmt, *args):
+    if TraceLevel >= TRACE_ON:
+        emit_trace(fmt, args)
+
+
+def verbose_trace(fmt, *args):
+    if TraceLevel >= TRACE_VERBOSE:
+        emit_trace(fmt, args)
+
+
+RECV_BUFFER_SIZE = 65536
+
+# bytes in python3, str in python2
+EMPTY_BUFFER = ''.encode('ascii')
+BYTES_TYPE = type(EMPTY_BUFFER)
+
+
+class BufferedReader:
+    """
+    Wraps the provider socket so that recv(n) returns exactly n bytes.
+    The socket is read in RECV_BUFFER_SIZE chunks, so the fields of a
+    frame are handed out of memory instead of costing one recv each,
+    and strings longer than a single short read are read completely.
+    An empty result is only returned when the peer closed the socket
+    on a frame boundary.
+    """
+
+    def __init__(self, fd, size=RECV_BUFFER_SIZE):
+        self.fd = fd
+        self.size = size
+        self.buf = EMPTY_BUFFER
+        self.pos = 0
+
+    def recv(self, n):
+        end = self.pos + n
+        if end <= len(self.buf):
+            data = self.buf[self.pos:end]
+            self.pos = end
+            return data
+        chunks = [self.buf[self.pos:]]
+        have = len(chunks[0])
+        self.buf = EMPTY_BUFFER
+        self.pos = 0
+        while have < n:
+            chunk = self.fd.recv(max(self.size, n - have))
+            if not chunk:
+                if 0 < have:
+                    raise socket.error('connection closed after ' + str(have) +
+                                       ' of ' + str(n) + ' bytes')
+                return EMPTY_BUFFER
+            chunks.append(chunk)
+            have += len(chunk)
+        data = EMPTY_BUFFER.join(chunks)
+        if have == n:
+            return data
+        self.buf = data
+        self.pos = n
+        return data[:n]
+
+    def fileno(self):
+        return self.fd.fileno()
+
+
+class BufferedWriter:
+    """
+    Collects everything written through send/sendall in memory so that
+    a whole reply goes out with a single sendall when flush is called.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.reset()
+
+    def reset(self):
+        try:
+            self.buf = bytearray()
+        except NameError: # python < 2.6
+            self.buf = []
 
-def verbose_trace(text):
-    if DO_VERBOSE_TRACE:
-        trace(text)
+    def sendall(self, buf):
+        if isinstance(self.buf, list):
+            self.buf.append(buf)
+        else:
+            self.buf += buf
+
+    def send(self, buf):
+        self.sendall(buf)
+        return len(buf)
+
+    def reserve(self, size):
+        """
+        Leaves room for 'size' bytes that are only known once the data
+        after them has been written, returns the position to patch.
+        """
+        if isinstance(self.buf, list):
+            self.buf.append(None)
+            return len(self.buf) - 1
+        pos = len(self.buf)
+        self.buf += EMPTY_BUFFER.ljust(size, '\0'.encode('ascii'))
+        return pos
+
+    def patch(self, pos, buf):
+        if isinstance(self.buf, list):
+            self.buf[pos] = buf
+        else:
+            self.buf[pos:pos + len(buf)] = buf
+
+    def truncate(self, pos):
+        del self.buf[pos:]
+
+    def getvalue(self):
+        if isinstance(self.buf, list):
+            return EMPTY_BUFFER.join(self.buf)
+        return self.buf
+
+    def flush(self):
+        buf = self.getvalue()
+        if 0 < len(buf):
+            self.reset()
+            self.fd.sendall(buf)
+        return len(buf)
+
+    def fileno(self):
+        return self.fd.fileno()
+
+
+try:
+    Struct = struct.Struct
+except AttributeError: # python < 2.5
+    class Struct:
+        def __init__(self, format):
+            self.format = format
+            self.size = struct.calcsize(format)
+
+        def pack(self, *args):
+            return struct.pack(self.format, *args)
+
+        def unpack(self, buf):
+            return struct.unpack(self.format, buf)
+
+
+# Precompiled codecs for the fixed size MI types, indexed by type code.
+# CODECS hold the native layout of a single value (the array types map to
+# the codec of their element). TAGGED_CODECS prefix the value with its type
+# byte so a scalar is written with one pack; '=' keeps the native sizes of
+# these formats without inserting alignment padding after the type byte.
+#
+# ARRAY_TYPECODES has the array.array type codes matching the element size
+# of the numeric array types. The struct format characters double as type
+# codes, except that 'q' and 'Q' need python 3.3; 'l' and 'L' have the same
+# size on LP64. Types missing there are kept in lists and packed with one
+# Struct.
+#
+# Providers load this module again while other requests are encoding, so
+# the tables are built aside and each one assigned complete.
+def make_codecs ():
+    codecs = {}
+    tagged_codecs = {}
+    array_formats = {}
+    for type, format in ((MI_BOOLEAN, 'B'),
+                         (MI_UINT8, 'B'),
+                         (MI_SINT8, 'b'),
+                         (MI_UINT16, 'H'),
+                         (MI_SINT16, 'h'),
+                         (MI_UINT32, 'I'),
+                         (MI_SINT32, 'i'),
+                         (MI_UINT64, 'Q'),
+                         (MI_SINT64, 'q'),
+                         (MI_REAL32, 'f'),
+                         (MI_REAL64, 'd'),
+                         (MI_CHAR16, 'H')):
+        codecs[type] = Struct('@' + format)
+        codecs[type | MI_BOOLEANA] = codecs[type]
+        tagged_codecs[type] = Struct('=B' + format)
+        array_formats[type | MI_BOOLEANA] = format
+    # strings are written as type byte, byte length and utf8 data
+    tagged_codecs[MI_STRING] = Struct('=Bi')
+    array_typecodes = {}
+    for type, format in array_formats.items():
+        for typecode in format + {'Q': 'L', 'q': 'l'}.get(format, ''):
+            try:
+                if array.array(typecode).itemsize == codecs[type].size:
+                    array_typecodes[type] = typecode
+                    break
+            except ValueError:
+                pass
+    return codecs, tagged_codecs, array_formats, array_typecodes
+
+CODECS, TAGGED_CODECS, ARRAY_FORMATS, ARRAY_TYPECODES = make_codecs ()
+
+TYPE_CODEC = Struct('@B')
+LENGTH_CODEC = Struct('@i')
+TIMESTAMP_CODEC = Struct('=IIIIIIIi')
+INTERVAL_CODEC = Struct('=IIIII')
+
+# Optional framing extensions. A peer that wants them sends an
+# OP_NEGOTIATE request (uchar op, int capabilities) and gets back int
+# status, int granted capabilities and int worker count. Until then, and
+# with peers that never negotiate, requests are answered one at a time in
+# order. With CAPABILITY_TAGGED granted every request and response frame
+# starts with a TAG_CODEC request id, and responses may arrive out of order.
+OP_NEGOTIATE = 0x80
+CAPABILITY_TAGGED = 0x1
+TAG_CODEC = Struct('@I')
 
 
 def read_string(fd):
     verbose_trace('<read_string>')
-    buf = fd.recv(4)
-    strl = struct.unpack('@i', buf)[0]
-    verbose_trace('  len: ' + str(strl))
+    strl = LENGTH_CODEC.unpack(fd.recv(LENGTH_CODEC.size))[0]
+    verbose_trace('  len: %s', strl)
     text = ''
     if 0 < strl:
         buf = fd.recv(strl)
         text = buf.decode('utf8')
-    verbose_trace('  str: "' + text + '"')
+    verbose_trace('  str: "%s"', text)
     verbose_trace('</read_string>')
     return text
 
@@ -110,7 +352,7 @@ def read_arg_name(fd):
         arg_name = name.encode('ascii', 'ignore')
     else:
         arg_name = name
-    verbose_trace('  arg_name: "' + arg_name + '"')
+    verbose_trace('  arg_name: "%s"', arg_name)
     verbose_trace('</read_argname>')
     return arg_name
 
@@ -118,9 +360,8 @@ def read_arg_name(fd):
 def read_values(fd):
     verbose_trace('<read_values>')
     arg_dict = dict()
-    buf = fd.recv(4)
-    argc = struct.unpack('@i', buf)[0]
-    verbose_trace('  argc: ' + str(argc))
+    argc = LENGTH_CODEC.unpack(fd.recv(LENGTH_CODEC.size))[0]
+    verbose_trace('  argc: %s', argc)
     for _ in range(argc):
         arg_name = read_arg_name(fd)
         arg_val = MI_Value.read(fd)
@@ -131,35 +372,31 @@ def read_values(fd):
 
 def write_string(fd, st):
     verbose_trace('<write_string>')
-    verbose_trace('  st: "' + st + '"')
+    verbose_trace('  st: "%s"', st)
     verbose_trace(st)
-    buf = struct.pack('@i', len(st))
-    if not isinstance(buf, str):
-        buf += bytes(st, 'utf8')
-    else:
-        buf += st
-    fd.send(buf)
+    if not isinstance(st, BYTES_TYPE):
+        st = st.encode('utf8')
+    fd.sendall(LENGTH_CODEC.pack(len(st)) + st)
     verbose_trace('</write_string>')
 
 
 def write_values(fd, d):
     trace('<write_values>')
-    buf = struct.pack('@i', len(d))
-    fd.send(buf)
-    verbose_trace('  len: ' + str(len(d)))
+    fd.sendall(LENGTH_CODEC.pack(len(d)))
+    verbose_trace('  len: %s', len(d))
     if sys.version > '2.9':
         for key, value in d.items():
-            verbose_trace('  key: ' + key)
+            verbose_trace('  key: %s', key)
             if not hasattr(value, 'value'):
                 sys.stderr.write('\n  key: ' + key + ' is not mi_value\n')
-            verbose_trace('  value: ' + str(value.value))
+            verbose_trace('  value: %s', value.value)
             if value.value is not None:
                 write_string(fd, key)
                 value.write(fd)
     else:
         for key, value in d.iteritems():
-            trace('  key: ' + key)
-            verbose_trace('  value: ' + repr(value.value))
+            trace('  key: %s', key)
+            verbose_trace('  value: %r', value.value)
             if value is not None:
                 verbose_trace('  writing value')
                 write_string(fd, key)
@@ -169,6 +406,72 @@ def write_values(fd, d):
     trace('</write_values>')
 
 
+def new_array(type, vals):
+    """
+    Returns the elements of a numeric MI array as compact array.array
+    storage (or a list where no type code fits). Plain numbers, ctypes
+    values and arrays are accepted.
+    """
+    if vals is None:
+        vals = []
+    elif not isinstance(vals, (list, tuple, array.array)):
+        vals = list(vals)
+    typecode = ARRAY_TYPECODES.get(type)
+    if MI_BOOLEANA != type and typecode is not None:
+        try:
+            return array.array(typecode, vals)
+        except TypeError: # ctypes values
+            pass
+    tmp = []
+    for val in vals:
+        if hasattr(val, 'value'):
+            val = val.value
+        if MI_BOOLEANA == type:
+            if val:
+                val = 1
+            else:
+                val = 0
+        tmp.append(val)
+    if typecode is None:
+        return tmp
+    return array.array(typecode, tmp)
+
+
+def write_array(value, fd):
+    """
+    Writes a numeric MI array: type byte, count and all elements packed in
+    one call.
+    """
+    if isinstance(value.value, array.array):
+        if hasattr(value.value, 'tobytes'):
+            data = value.value.tobytes()
+        else: # python 2
+            data = value.value.tostring()
+    else:
+        data = Struct('@' + str(len(value.value)) +
+                      ARRAY_FORMATS[value.type]).pack(*value.value)
+    fd.sendall(TYPE_CODEC.pack(value.type) +
+               LENGTH_CODEC.pack(len(value.value)) + data)
+
+
+def read_array(fd, type):
+    """
+    Reads the count and elements of a numeric MI array in one recv.
+    """
+    length = LENGTH_CODEC.unpack(fd.recv(LENGTH_CODEC.size))[0]
+    verbose_trace('  len:%s', length)
+    data = fd.recv(length * CODECS[type].size)
+    typecode = ARRAY_TYPECODES.get(type)
+    if typecode is None:
+        return list(Struct('@' + str(length) + ARRAY_FORMATS[type]).unpack(data))
+    vals = array.array(typecode)
+    if hasattr(vals, 'frombytes'):
+        vals.frombytes(data)
+    else: # python 2
+        vals.fromstring(data)
+    return vals
+
+
 class file_desc:
     def sendall(self, buf):
         pass
@@ -210,81 +513,22 @@ class MI_Value:
         val = self.type
         if self.value is None:
             val = val | MI_NULL_FLAG
-        verbose_trace('    type: ' + str(self.type) + ' ' + repr(self.value))
-        buf = struct.pack('@B', val)
-        fd.sendall(buf)
+        verbose_trace('    type: %s %r', self.type, self.value)
+        fd.sendall(TYPE_CODEC.pack(val))
         verbose_trace('  </MI_Value::write>')
 
     @staticmethod
     def read(fd):
         verbose_trace('<MI_Value::read>')
-        buf = fd.recv(1)
-        type = struct.unpack('@B', buf)[0]
+        type = TYPE_CODEC.unpack(fd.recv(TYPE_CODEC.size))[0]
         switch = type & ~(MI_NULL_FLAG)
-        verbose_trace('  type: ' + str(switch))
+        verbose_trace('  type: %s', switch)
         val = None
-        if MI_BOOLEAN == switch:
-            val = MI_Boolean.read(fd, type)
-        elif MI_UINT8 == switch:
-            val = MI_Uint8.read(fd, type)
-        elif MI_SINT8 == switch:
-            val = MI_Sint8.read(fd, type)
-        elif MI_UINT16 == switch:
-            val = MI_Uint16.read(fd, type)
-        elif MI_SINT16 == switch:
-            val = MI_Sint16.read(fd, type)
-        elif MI_UINT32 == switch:
-            val = MI_Uint32.read(fd, type)
-        elif MI_SINT32 == switch:
-            val = MI_Sint32.read(fd, type)
-        elif MI_UINT64 == switch:
-            val = MI_Uint64.read(fd, type)
-        elif MI_SINT64 == switch:
-            val = MI_Sint64.read(fd, type)
-        elif MI_REAL32 == switch:
-            val = MI_Real32.read(fd, type)
-        elif MI_REAL64 == switch:
-            val = MI_Real64.read(fd, type)
-        elif MI_CHAR16 == switch:
-            val = MI_Char16.read(fd, type)
-        elif MI_DATETIME == switch:
-            val = MI_Datetime.read(fd, type)
-        elif MI_STRING == switch:
-            val = MI_String.read(fd, type)
-        elif MI_INSTANCE == switch:
-            val = MI_Instance.read(fd, type)
-        elif MI_BOOLEANA == switch:
-            val = MI_BooleanA.read(fd, type)
-        elif MI_UINT8A == switch:
-            val = MI_Uint8A.read(fd, type)
-        elif MI_SINT8A == switch:
-            val = MI_Sint8A.read(fd, type)
-        elif MI_UINT16A == switch:
-            val = MI_Uint16A.read(fd, type)
-        elif MI_SINT16A == switch:
-            val = MI_Sint16A.read(fd, type)
-        elif MI_UINT32A == switch:
-            val = MI_Uint32A.read(fd, type)
-        elif MI_SINT32A == switch:
-            val = MI_Sint32A.read(fd, type)
-        elif MI_UINT64A == switch:
-            val = MI_Uint64A.read(fd, type)
-        elif MI_SINT64A == switch:
-            val = MI_Sint64A.read(fd, type)
-        elif MI_REAL32A == switch:
-            val = MI_Real32A.read(fd, type)
-        elif MI_REAL64A == switch:
-            val = MI_Real64A.read(fd, type)
-        elif MI_CHAR16A == switch:
-            val = MI_Char16A.read(fd, type)
-        elif MI_DATETIMEA == switch:
-            val = MI_DatetimeA.read(fd, type)
-        elif MI_STRINGA == switch:
-            val = MI_StringA.read(fd, type)
-        elif MI_INSTANCEA == switch:
-            val = MI_InstanceA.read(fd, type)
+        reader = MI_READERS.get(switch)
+        if reader is not None:
+            val = reader(fd, type)
         else:
-            trace('Received unexpected type: ' + str(type))
+            trace('Received unexpected type: %s', type)
         verbose_trace('</MI_Value::read>')
         return val
 
@@ -301,15 +545,15 @@ class MI_Boolean(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Boolean.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
+            verbose_trace('  value: %s', self.value.value)
             if self.value.value:
                 tmp = 1
             else:
                 tmp = 0
-            buf = struct.pack('@B', tmp)
-            fd.sendall(buf)
+            fd.sendall(TAGGED_CODECS[MI_BOOLEAN].pack(MI_BOOLEAN, tmp))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Boolean.write>')
 
     @staticmethod
@@ -317,14 +561,10 @@ class MI_Boolean(MI_Value):
         verbose_trace('<MI_Boolean.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(1)
-            val = struct.unpack('@B', buf)[0]
-            verbose_trace('val is ' + str(int(val)) + '\n')
-            if val:
-                tmp = 'True'
-            else:
-                tmp = 'False'
-            verbose_trace('  value: ' + tmp)
+            codec = CODECS[MI_BOOLEAN]
+            val = codec.unpack(fd.recv(codec.size))[0]
+            verbose_trace('val is %s\n', int(val))
+            verbose_trace('  value: %s', bool(val))
         rval = MI_Boolean(val)
         verbose_trace('</MI_Boolean.read>')
         return rval
@@ -338,11 +578,11 @@ class MI_Uint8(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Uint8.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@B', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_UINT8].pack(MI_UINT8, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Uint8.write>')
 
     @staticmethod
@@ -350,8 +590,8 @@ class MI_Uint8(MI_Value):
         verbose_trace('<MI_Uint8.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(1)
-            val = struct.unpack('@B', buf)[0]
+            codec = CODECS[MI_UINT8]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Uint8(val)
         verbose_trace('</MI_Uint8.read>')
         return rval
@@ -365,11 +605,11 @@ class MI_Sint8(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Sint8.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@b', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_SINT8].pack(MI_SINT8, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Sint8.write>')
 
     @staticmethod
@@ -377,8 +617,8 @@ class MI_Sint8(MI_Value):
         verbose_trace('<MI_Sint8.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(1)
-            val = struct.unpack('@b', buf)[0]
+            codec = CODECS[MI_SINT8]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Sint8(val)
         verbose_trace('</MI_Sint8.read>')
         return rval
@@ -392,11 +632,11 @@ class MI_Uint16(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Uint16.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@H', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_UINT16].pack(MI_UINT16, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Uint16.write>')
 
     @staticmethod
@@ -404,8 +644,8 @@ class MI_Uint16(MI_Value):
         verbose_trace('<MI_Uint16.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(2)
-            val = struct.unpack('@H', buf)[0]
+            codec = CODECS[MI_UINT16]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Uint16(val)
         verbose_trace('</MI_Uint16.read>')
         return rval
@@ -419,11 +659,11 @@ class MI_Sint16(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Sint16.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@h', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_SINT16].pack(MI_SINT16, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Sint16.write>')
 
     @staticmethod
@@ -431,8 +671,8 @@ class MI_Sint16(MI_Value):
         verbose_trace('<MI_Sint16.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(2)
-            val = struct.unpack('@h', buf)[0]
+            codec = CODECS[MI_SINT16]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Sint16(val)
         verbose_trace('</MI_Sint16.read>')
         return rval
@@ -446,11 +686,11 @@ class MI_Uint32(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Uint32.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@I', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_UINT32].pack(MI_UINT32, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Uint32.write>')
 
     @staticmethod
@@ -458,8 +698,8 @@ class MI_Uint32(MI_Value):
         verbose_trace('<MI_Uint32.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(4)
-            val = struct.unpack('@I', buf)[0]
+            codec = CODECS[MI_UINT32]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Uint32(val)
         verbose_trace('</MI_Uint32.read>')
         return rval
@@ -473,11 +713,11 @@ class MI_Sint32(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Sint32.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@i', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_SINT32].pack(MI_SINT32, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Sint32.write>')
 
     @staticmethod
@@ -485,8 +725,8 @@ class MI_Sint32(MI_Value):
         verbose_trace('<MI_Sint32.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(4)
-            val = struct.unpack('@i', buf)[0]
+            codec = CODECS[MI_SINT32]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Sint32(val)
         verbose_trace('</MI_Sint32.read>')
         return rval
@@ -500,11 +740,11 @@ class MI_Uint64(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Uint64.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@Q', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_UINT64].pack(MI_UINT64, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Uint64.write>')
 
     @staticmethod
@@ -512,8 +752,8 @@ class MI_Uint64(MI_Value):
         verbose_trace('<MI_Uint64.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
-            val = struct.unpack('@Q', buf)[0]
+            codec = CODECS[MI_UINT64]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Uint64(val)
         verbose_trace('</MI_Uint64.read>')
         return rval
@@ -527,11 +767,11 @@ class MI_Sint64(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Sint64.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@q', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_SINT64].pack(MI_SINT64, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Sint64.write>')
 
     @staticmethod
@@ -539,8 +779,8 @@ class MI_Sint64(MI_Value):
         verbose_trace('<MI_Sint64.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
-            val = struct.unpack('@q', buf)[0]
+            codec = CODECS[MI_SINT64]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Sint64(val)
         verbose_trace('</MI_Sint64.read>')
         return rval
@@ -554,11 +794,11 @@ class MI_Real32(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Real32.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@f', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_REAL32].pack(MI_REAL32, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Real32.write>')
 
     @staticmethod
@@ -566,8 +806,8 @@ class MI_Real32(MI_Value):
         verbose_trace('<MI_Real32.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
-            val = struct.unpack('@f', buf)[0]
+            codec = CODECS[MI_REAL32]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Real32(val)
         verbose_trace('</MI_Real32.read>')
         return rval
@@ -581,11 +821,11 @@ class MI_Real64(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Real64.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@d', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_REAL64].pack(MI_REAL64, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Real64.write>')
 
     @staticmethod
@@ -593,8 +833,8 @@ class MI_Real64(MI_Value):
         verbose_trace('<MI_Real64.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(8)
-            val = struct.unpack('@d', buf)[0]
+            codec = CODECS[MI_REAL64]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Real64(val)
         verbose_trace('</MI_Real64.read>')
         return rval
@@ -608,11 +848,11 @@ class MI_Char16(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_Char16.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            verbose_trace('  value: ' + str(self.value.value))
-            buf = struct.pack('@H', self.value.value)
-            fd.sendall(buf)
+            verbose_trace('  value: %s', self.value.value)
+            fd.sendall(TAGGED_CODECS[MI_CHAR16].pack(MI_CHAR16, self.value.value))
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_Char16.write>')
 
     @staticmethod
@@ -620,8 +860,8 @@ class MI_Char16(MI_Value):
         verbose_trace('<MI_Char16.read>')
         val = None
         if 0 == (MI_NULL_FLAG & flags):
-            buf = fd.recv(2)
-            val = struct.unpack('@H', buf)[0]
+            codec = CODECS[MI_CHAR16]
+            val = codec.unpack(fd.recv(codec.size))[0]
         rval = MI_Char16(val)
         verbose_trace('</MI_Char16.read>')
         return rval
@@ -653,12 +893,12 @@ class MI_Datetime(MI_Value):
     def read_data(fd):
         verbose_trace('  <MI_Datetime.read_data>')
         rval = None
-        buf = fd.recv(1)
+        val = TYPE_CODEC.unpack(fd.recv(TYPE_CODEC.size))[0]
         isTimestamp = None
         try:
-            isTimestamp = ctypes.c_bool(struct.unpack('@B', buf)[0])
+            isTimestamp = ctypes.c_bool(val)
         except:
-            isTimestamp = ctypes.c_int(struct.unpack('@B', buf)[0])
+            isTimestamp = ctypes.c_int(val)
         if isTimestamp:
             rval = MI_Timestamp.read_data(fd)
         else:
@@ -738,58 +978,43 @@ class MI_Timestamp(MI_Datetime):
 
     def write_data(self, fd):
         verbose_trace('  <MI_Timestamp.write_data>')
-        verbose_trace('    isTimestamp:' + str(self.value.value))
-        verbose_trace('    year:' + str(self.year.value))
-        verbose_trace('    month:' + str(self.month.value))
-        verbose_trace('    day:' + str(self.day.value))
-        verbose_trace('    hour:' + str(self.hour.value))
-        verbose_trace('    minute:' + str(self.minute.value))
-        verbose_trace('    second:' + str(self.second.value))
-        verbose_trace('    microseconds:' + str(self.microseconds.value))
-        verbose_trace('    utc:' + str(self.utc.value))
-        buf = struct.pack('@B', self.value.value)
-        buf += struct.pack('@I', self.year.value)
-        buf += struct.pack('@I', self.month.value)
-        buf += struct.pack('@I', self.day.value)
-        buf += struct.pack('@I', self.hour.value)
-        buf += struct.pack('@I', self.minute.value)
-        buf += struct.pack('@I', self.second.value)
-        buf += struct.pack('@I', self.microseconds.value)
-        buf += struct.pack('@i', self.utc.value)
+        verbose_trace('    isTimestamp:%s', self.value.value)
+        verbose_trace('    year:%s', self.year.value)
+        verbose_trace('    month:%s', self.month.value)
+        verbose_trace('    day:%s', self.day.value)
+        verbose_trace('    hour:%s', self.hour.value)
+        verbose_trace('    minute:%s', self.minute.value)
+        verbose_trace('    second:%s', self.second.value)
+        verbose_trace('    microseconds:%s', self.microseconds.value)
+        verbose_trace('    utc:%s', self.utc.value)
+        buf = TYPE_CODEC.pack(self.value.value)
+        buf += TIMESTAMP_CODEC.pack(self.year.value,
+                                    self.month.value,
+                                    self.day.value,
+                                    self.hour.value,
+                                    self.minute.value,
+                                    self.second.value,
+                                    self.microseconds.value,
+                                    self.utc.value)
         fd.sendall(buf)
         verbose_trace('  </MI_Timestamp.write_data>')
 
     @staticmethod
     def read_data(fd):
         verbose_trace('    <MI_Timestamp.read_data>')
-        buf = fd.recv(4)
-        year = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        month = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        day = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        hour = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        minute = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        second = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        microseconds = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        utc = struct.unpack('@i', buf)[0]
-        buf = fd.recv(4)
+        year, month, day, hour, minute, second, microseconds, utc = \
+            TIMESTAMP_CODEC.unpack(fd.recv(TIMESTAMP_CODEC.size))
         rval = MI_Timestamp(year, month, day, hour, minute, second,
                             microseconds, utc)
         verbose_trace('      isTimestamp: True')
-        verbose_trace('      year:' + str(year))
-        verbose_trace('      month:' + str(month))
-        verbose_trace('      day:' + str(day))
-        verbose_trace('      hour:' + str(hour))
-        verbose_trace('      minute:' + str(minute))
-        verbose_trace('      second:' + str(second))
-        verbose_trace('      microseconds:' + str(microseconds))
-        verbose_trace('      utc:' + str(utc))
+        verbose_trace('      year:%s', year)
+        verbose_trace('      month:%s', month)
+        verbose_trace('      day:%s', day)
+        verbose_trace('      hour:%s', hour)
+        verbose_trace('      minute:%s', minute)
+        verbose_trace('      second:%s', second)
+        verbose_trace('      microseconds:%s', microseconds)
+        verbose_trace('      utc:%s', utc)
         verbose_trace('    </MI_Timestamp.read_data>')
         return rval
 
@@ -817,25 +1042,25 @@ class MI_Interval(MI_Datetime):
            microseconds is None:
             MI_Datetime.__init__(self, None)
         else:
-            MI_Datetime.__init__(self, True)
+            MI_Datetime.__init__(self, False)
 
         if days is None:
-            self.day = ctypes.c_uint(0)
+            self.days = ctypes.c_uint(0)
         else:
             self.days = ctypes.c_uint(days)
 
         if hours is None:
-            self.hour = ctypes.c_uint(0)
+            self.hours = ctypes.c_uint(0)
         else:
             self.hours = ctypes.c_uint(hours)
 
         if minutes is None:
-            self.minute = ctypes.c_uint(0)
+            self.minutes = ctypes.c_uint(0)
         else:
             self.minutes = ctypes.c_uint(minutes)
 
         if seconds is None:
-            self.second = ctypes.c_uint(0)
+            self.seconds = ctypes.c_uint(0)
         else:
             self.seconds = ctypes.c_uint(seconds)
 
@@ -853,42 +1078,33 @@ class MI_Interval(MI_Datetime):
 
     def write_data(self, fd):
         verbose_trace('  <MI_Interval.write_data>')
-        verbose_trace('    isTimestamp:' + str(self.value.value))
-        verbose_trace('    days:' + str(self.days.value))
-        verbose_trace('    hours:' + str(self.hours.value))
-        verbose_trace('    minutes:' + str(self.minutes.value))
-        verbose_trace('    seconds:' + str(self.seconds.value))
-        verbose_trace('    microseconds:' + str(self.microseconds.value))
-        buf = struct.pack('@B', self.value.value)
-        buf += struct.pack('@I', self.days.value)
-        buf += struct.pack('@I', self.hours.value)
-        buf += struct.pack('@I', self.minutes.value)
-        buf += struct.pack('@I', self.seconds.value)
-        buf += struct.pack('@I', self.microseconds.value)
+        verbose_trace('    isTimestamp:%s', self.value.value)
+        verbose_trace('    days:%s', self.days.value)
+        verbose_trace('    hours:%s', self.hours.value)
+        verbose_trace('    minutes:%s', self.minutes.value)
+        verbose_trace('    seconds:%s', self.seconds.value)
+        verbose_trace('    microseconds:%s', self.microseconds.value)
+        buf = TYPE_CODEC.pack(self.value.value)
+        buf += INTERVAL_CODEC.pack(self.days.value,
+                                   self.hours.value,
+                                   self.minutes.value,
+                                   self.seconds.value,
+                                   self.microseconds.value)
         fd.sendall(buf)
         verbose_trace('  </MI_Interval.write>')
 
     @staticmethod
     def read_data(fd):
         verbose_trace('    <MI_Interval.read_data>')
-        buf = fd.recv(4)
-        days = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        hours = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        minutes = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        seconds = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        microseconds = struct.unpack('@I', buf)[0]
-        buf = fd.recv(4)
-        rval = MI_Timestamp(days, hours, minutes, seconds, microseconds)
+        days, hours, minutes, seconds, microseconds = \
+            INTERVAL_CODEC.unpack(fd.recv(INTERVAL_CODEC.size))
+        rval = MI_Interval(days, hours, minutes, seconds, microseconds)
         verbose_trace('      isTimestamp: False')
-        verbose_trace('      days:' + str(days))
-        verbose_trace('      hours:' + str(hours))
-        verbose_trace('      minutes:' + str(minutes))
-        verbose_trace('      seconds:' + str(seconds))
-        verbose_trace('      microseconds:' + str(microseconds))
+        verbose_trace('      days:%s', days)
+        verbose_trace('      hours:%s', hours)
+        verbose_trace('      minutes:%s', minutes)
+        verbose_trace('      seconds:%s', seconds)
+        verbose_trace('      microseconds:%s', microseconds)
         verbose_trace('    </MI_Interval.read_data>')
         return rval
 
@@ -901,29 +1117,14 @@ class MI_String(MI_Value):
 
     def write(self, fd):
         verbose_trace('<MI_String.write>')
-        MI_Value.write(self, fd)
         if self.value is not None:
-            buf = struct.pack('@i', len(self.value))
-            if type(buf) is not str: # python3
-                if type(self.value) == str:
-                    buf = struct.pack('@i', len(bytes(self.value,'utf8')))
-                    buf += bytes(self.value, 'utf8')
-                    verbose_trace('  len: ' + str(len(self.value)) + ', value: ' +
-                                  self.value)
-                else:
-                    buf += self.value
-                    verbose_trace('  len: ' + str(len(self.value)) + ', value: ' +
-                                  self.value.decode('utf8'))
-            else: # python 2
-                if type(self.value) != str: # unicode
-                    buf = struct.pack('@i', len(self.value.encode('utf8')))
-                    buf+=self.value.encode('utf8')
-                else:
-                    buf += self.value
-                verbose_trace('  len: ' + str(len(self.value)) + ', value: ' +
-                                  self.value)
-
-            fd.sendall(buf)
+            buf = self.value
+            if not isinstance(buf, BYTES_TYPE):
+                buf = buf.encode('utf8')
+            verbose_trace('  len: %s, value: %r', len(buf), self.value)
+            fd.sendall(TAGGED_CODECS[MI_STRING].pack(MI_STRING, len(buf)) + buf)
+        else:
+            MI_Value.write(self, fd)
         verbose_trace('</MI_String.write>')
 
     @staticmethod
@@ -964,34 +1165,16 @@ class MI_Instance(MI_Value):
 class MI_BooleanA(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_BOOLEANA)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                try:
-                    self.value.append(ctypes.c_bool(val))
-                except:
-                    self.value.append(ctypes.c_int(val))
+        self.value = new_array(MI_BOOLEANA, vals)
 
     def write(self, fd):
         verbose_trace('<MI_BooleanA.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                if val.value:
-                    tmp = 1
-                else:
-                    tmp = 0
-                buf = struct.pack('@B', tmp)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_BooleanA.write>')
 
     @staticmethod
@@ -999,15 +1182,7 @@ class MI_BooleanA(MI_Value):
         verbose_trace('<MI_BooleanA.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(1)
-                val = struct.unpack('@B', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_BOOLEANA)
         rval = MI_BooleanA(vals)
         verbose_trace('</MI_BooleanA.read>')
         return rval
@@ -1016,43 +1191,24 @@ class MI_BooleanA(MI_Value):
 class MI_Uint8A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_UINT8A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_ubyte(val))
+        self.value = new_array(MI_UINT8A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Uint8A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@B', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Uint8A.write>')
 
     @staticmethod
     def read(fd, flags):
-        verbose_trace('<MI_UintA.read>')
+        verbose_trace('<MI_Uint8A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(1)
-                val = struct.unpack('@B', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_UINT8A)
         rval = MI_Uint8A(vals)
         verbose_trace('</MI_Uint8A.read>')
         return rval
@@ -1061,43 +1217,24 @@ class MI_Uint8A(MI_Value):
 class MI_Sint8A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_SINT8A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_byte(val))
+        self.value = new_array(MI_SINT8A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Sint8A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@b', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Sint8A.write>')
 
     @staticmethod
     def read(fd, flags):
-        verbose_trace('<MI_SintA.read>')
+        verbose_trace('<MI_Sint8A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(1)
-                val = struct.unpack('@b', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_SINT8A)
         rval = MI_Sint8A(vals)
         verbose_trace('</MI_Sint8A.read>')
         return rval
@@ -1105,33 +1242,17 @@ class MI_Sint8A(MI_Value):
 
 class MI_Uint16A(MI_Value):
     def __init__(self, vals):
-        verbose_trace('<MI_Uint16A>')
         MI_Value.__init__(self, MI_UINT16A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                if isinstance(val, ctypes.c_ushort):
-                    self.value.append(val)
-                else:
-                    self.value.append(ctypes.c_ushort(val))
-        verbose_trace('</MI_Uint16A>')
+        self.value = new_array(MI_UINT16A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Uint16A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('  <values>')
-            for val in self.value:
-                verbose_trace('    value: ' + str(val.value))
-                buf = struct.pack('@H', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Uint16A.write>')
 
     @staticmethod
@@ -1139,15 +1260,7 @@ class MI_Uint16A(MI_Value):
         verbose_trace('<MI_Uint16A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(2)
-                val = struct.unpack('@H', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_UINT16A)
         rval = MI_Uint16A(vals)
         verbose_trace('</MI_Uint16A.read>')
         return rval
@@ -1156,27 +1269,16 @@ class MI_Uint16A(MI_Value):
 class MI_Sint16A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_SINT16A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_short(val))
+        self.value = new_array(MI_SINT16A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Sint16A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@h', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Sint16A.write>')
 
     @staticmethod
@@ -1184,15 +1286,7 @@ class MI_Sint16A(MI_Value):
         verbose_trace('<MI_Sint16A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            len = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(len))
-            for _ in range(len):
-                buf = fd.recv(2)
-                val = struct.unpack('@h', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_SINT16A)
         rval = MI_Sint16A(vals)
         verbose_trace('</MI_Sint16A.read>')
         return rval
@@ -1201,27 +1295,16 @@ class MI_Sint16A(MI_Value):
 class MI_Uint32A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_UINT32A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_uint(val))
+        self.value = new_array(MI_UINT32A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Uint32A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@I', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Uint32A.write>')
 
     @staticmethod
@@ -1229,15 +1312,7 @@ class MI_Uint32A(MI_Value):
         verbose_trace('<MI_Uint32A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(4)
-                val = struct.unpack('@I', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_UINT32A)
         rval = MI_Uint32A(vals)
         verbose_trace('</MI_Uint32A.read>')
         return rval
@@ -1246,27 +1321,16 @@ class MI_Uint32A(MI_Value):
 class MI_Sint32A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_SINT32A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_int(val))
+        self.value = new_array(MI_SINT32A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Sint32A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('    len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@i', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Sint32A.write>')
 
     @staticmethod
@@ -1274,15 +1338,7 @@ class MI_Sint32A(MI_Value):
         verbose_trace('<MI_Sint32A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(4)
-                val = struct.unpack('@i', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_SINT32A)
         rval = MI_Sint32A(vals)
         verbose_trace('</MI_Sint32A.read>')
         return rval
@@ -1291,27 +1347,16 @@ class MI_Sint32A(MI_Value):
 class MI_Uint64A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_UINT64A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_ulonglong(val))
+        self.value = new_array(MI_UINT64A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Uint64A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@Q', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Uint64A.write>')
 
     @staticmethod
@@ -1319,15 +1364,7 @@ class MI_Uint64A(MI_Value):
         verbose_trace('<MI_Uint64A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(8)
-                val = struct.unpack('@Q', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_UINT64A)
         rval = MI_Uint64A(vals)
         verbose_trace('</MI_Uint64A.read>')
         return rval
@@ -1336,27 +1373,16 @@ class MI_Uint64A(MI_Value):
 class MI_Sint64A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_SINT64A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_longlong(val))
+        self.value = new_array(MI_SINT64A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Sint64A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@q', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Sint64A.write>')
 
     @staticmethod
@@ -1364,15 +1390,7 @@ class MI_Sint64A(MI_Value):
         verbose_trace('<MI_Sint64A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            len = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(len))
-            for _ in range(len):
-                buf = fd.recv(8)
-                val = struct.unpack('@q', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_SINT64A)
         rval = MI_Sint64A(vals)
         verbose_trace('</MI_Sint64A.read>')
         return rval
@@ -1381,27 +1399,16 @@ class MI_Sint64A(MI_Value):
 class MI_Real32A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_REAL32A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_float(val))
+        self.value = new_array(MI_REAL32A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Real32A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@f', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Real32A.write>')
 
     @staticmethod
@@ -1409,15 +1416,7 @@ class MI_Real32A(MI_Value):
         verbose_trace('<MI_Real32A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(4)
-                val = struct.unpack('@f', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_REAL32A)
         rval = MI_Real32A(vals)
         verbose_trace('</MI_Real32A.read>')
         return rval
@@ -1426,27 +1425,16 @@ class MI_Real32A(MI_Value):
 class MI_Real64A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_REAL64A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_double(val))
+        self.value = new_array(MI_REAL64A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Real64A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('    <values>')
-            for val in self.value:
-                verbose_trace('      value: ' + str(val.value))
-                buf = struct.pack('@d', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Real64A.write>')
 
     @staticmethod
@@ -1454,15 +1442,7 @@ class MI_Real64A(MI_Value):
         verbose_trace('<MI_Real64A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for _ in range(length):
-                buf = fd.recv(8)
-                val = struct.unpack('@d', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_REAL64A)
         rval = MI_Real64A(vals)
         verbose_trace('</MI_Real64A.read>')
         return rval
@@ -1471,27 +1451,16 @@ class MI_Real64A(MI_Value):
 class MI_Char16A(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_CHAR16A)
-        self.value = []
-        if vals is not None:
-            for val in vals:
-                self.value.append(ctypes.c_ushort(val))
+        self.value = new_array(MI_CHAR16A, vals)
 
     def write(self, fd):
         verbose_trace('<MI_Char16A.write>')
         if self.value is not None and 0 < len(self.value):
-            MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
-            fd.sendall(buf)
-            verbose_trace('  <values>')
-            for val in self.value:
-                verbose_trace('    value: ' + str(val.value))
-                buf = struct.pack('@H', val.value)
-                fd.sendall(buf)
-            verbose_trace('  </values>')
+            verbose_trace('  len:%s', len(self.value))
+            write_array(self, fd)
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_Char16A.write>')
 
     @staticmethod
@@ -1499,15 +1468,7 @@ class MI_Char16A(MI_Value):
         verbose_trace('<MI_Char16A.read>')
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
-            vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
-            for i in range(length):
-                buf = fd.recv(2)
-                val = struct.unpack('@H', buf)[0]
-                verbose_trace('  value: ' + str(val))
-                vals.append(val)
+            vals = read_array(fd, MI_CHAR16A)
         rval = MI_Char16A(vals)
         verbose_trace('</MI_Char16A.read>')
         return rval
@@ -1516,18 +1477,22 @@ class MI_Char16A(MI_Value):
 class MI_DatetimeA(MI_Value):
     def __init__(self, vals):
         MI_Value.__init__(self, MI_DATETIMEA)
-        self.values = []
-        for val in vals:
-            self.values.append(val)
+        self.value = []
+        if vals is not None:
+            for val in vals:
+                self.value.append(val)
 
     def write(self, fd):
         verbose_trace('<MI_DatetimeA.write>')
-        MI_Value.write(self, fd)
-        verbose_trace('  len:' + str(len(self.values)))
-        buf = struct.pack('@i', len(self.values))
-        fd.sendall(buf)
-        for val in self.values:
-            val.write_data(fd)
+        if 0 < len(self.value):
+            MI_Value.write(self, fd)
+            verbose_trace('  len:%s', len(self.value))
+            buf = LENGTH_CODEC.pack(len(self.value))
+            fd.sendall(buf)
+            for val in self.value:
+                val.write_data(fd)
+        else:
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_DatetimeA.write>')
 
     @staticmethod
@@ -1536,9 +1501,8 @@ class MI_DatetimeA(MI_Value):
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
             vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
+            length = LENGTH_CODEC.unpack(fd.recv(LENGTH_CODEC.size))[0]
+            verbose_trace('  len:%s', length)
             for _ in range(length):
                 val = MI_Datetime.read_data(fd)
                 vals.append(val)
@@ -1559,16 +1523,16 @@ class MI_StringA(MI_Value):
         verbose_trace('<MI_StringA.write>')
         if self.value is not None and 0 < len(self.value):
             MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
+            verbose_trace('  len:%s', len(self.value))
+            buf = LENGTH_CODEC.pack(len(self.value))
             fd.sendall(buf)
             verbose_trace('  <values>')
             for val in self.value:
                 write_string(fd, val)
             verbose_trace('  </values>')
         else:
-            verbose_trace('    type: ' + str(self.type))
-            fd.sendall(struct.pack('@B', self.type | MI_NULL_FLAG))
+            verbose_trace('    type: %s', self.type)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
         verbose_trace('</MI_StringA.write>')
 
     @staticmethod
@@ -1577,9 +1541,8 @@ class MI_StringA(MI_Value):
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
             vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
+            length = LENGTH_CODEC.unpack(fd.recv(LENGTH_CODEC.size))[0]
+            verbose_trace('  len:%s', length)
             for i in range(length):
                 strg = read_string(fd)
                 vals.append(strg)
@@ -1600,8 +1563,8 @@ class MI_InstanceA(MI_Value):
         verbose_trace('<MI_InstanceA.write>')
         if 0 < len(self.value):
             MI_Value.write(self, fd)
-            verbose_trace('  len:' + str(len(self.value)))
-            buf = struct.pack('@i', len(self.value))
+            verbose_trace('  len:%s', len(self.value))
+            buf = LENGTH_CODEC.pack(len(self.value))
             fd.sendall(buf)
             verbose_trace('  <values>')
             for val in self.value:
@@ -1609,8 +1572,8 @@ class MI_InstanceA(MI_Value):
             verbose_trace('  </values>')
         else:
             verbose_trace('    len: 0')
-            verbose_trace('    type: ' + str(self.type | MI_NULL_FLAG))
-            buf = struct.pack('@B', self.type | MI_NULL_FLAG)
+            verbose_trace('    type: %s', self.type | MI_NULL_FLAG)
+            buf = TYPE_CODEC.pack(self.type | MI_NULL_FLAG)
             fd.sendall(buf)
         verbose_trace('</MI_InstanceA.write>')
 
@@ -1620,13 +1583,119 @@ class MI_InstanceA(MI_Value):
         vals = None
         if 0 == (MI_NULL_FLAG & flags):
             vals = []
-            buf = fd.recv(4)
-            length = struct.unpack('@i', buf)[0]
-            verbose_trace('  len:' + str(length))
+            length = LENGTH_CODEC.unpack(fd.recv(LENGTH_CODEC.size))[0]
+            verbose_trace('  len:%s', length)
             for _ in range(length):
                 val = read_values(fd)
-                sys.stderr.write('....' + repr(val) + '....\n')
+                verbose_trace('....%r....', val)
                 vals.append(val)
         rval = MI_InstanceA(vals)
         verbose_trace('</MI_InstanceA.read>')
         return rval
+
+
+class InstanceStream:
+    """
+    Sequence over a generator of instances. MI_InstanceStreamA.write
+    drains the generator without keeping the instances around; len,
+    indexing or iterating it from anywhere else materializes the list.
+    """
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.cache = None
+
+    def drain(self):
+        if self.cache is not None:
+            return iter(self.cache)
+        instances = self.instances
+        self.instances = None
+        self.cache = []
+        return iter(instances)
+
+    def materialize(self):
+        if self.cache is None:
+            self.cache = list(self.instances)
+            self.instances = None
+        return self.cache
+
+    def __len__(self):
+        return len(self.materialize())
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __getitem__(self, index):
+        return self.materialize()[index]
+
+    def __repr__(self):
+        if self.cache is None:
+            return '<streamed instances>'
+        return repr(self.cache)
+
+
+class MI_InstanceStreamA(MI_InstanceA):
+    """
+    MI_InstanceA whose instances come from a generator. Each instance is
+    encoded as it is produced and the count is patched in afterwards, so
+    neither the instances nor their MI_* values are held all at once.
+    """
+
+    def __init__(self, instances):
+        MI_Value.__init__(self, MI_INSTANCEA)
+        self.value = InstanceStream(instances)
+
+    def write(self, fd):
+        verbose_trace('<MI_InstanceStreamA.write>')
+        if not hasattr(fd, 'reserve'):
+            # unbuffered socket, the count has to go out first
+            MI_InstanceA(self.value).write(fd)
+            verbose_trace('</MI_InstanceStreamA.write>')
+            return
+        pos = fd.reserve(TYPE_CODEC.size + LENGTH_CODEC.size)
+        length = 0
+        for val in self.value.drain():
+            write_values(fd, val)
+            length += 1
+        verbose_trace('  len:%s', length)
+        if 0 < length:
+            fd.patch(pos, TYPE_CODEC.pack(self.type) + LENGTH_CODEC.pack(length))
+        else:
+            fd.truncate(pos)
+            fd.sendall(TYPE_CODEC.pack(self.type | MI_NULL_FLAG))
+        verbose_trace('</MI_InstanceStreamA.write>')
+
+
+# MI_Value.read dispatch table, indexed by type code
+MI_READERS = {
+    MI_BOOLEAN: MI_Boolean.read,
+    MI_UINT8: MI_Uint8.read,
+    MI_SINT8: MI_Sint8.read,
+    MI_UINT16: MI_Uint16.read,
+    MI_SINT16: MI_Sint16.read,
+    MI_UINT32: MI_Uint32.read,
+    MI_SINT32: MI_Sint32.read,
+    MI_UINT64: MI_Uint64.read,
+    MI_SINT64: MI_Sint64.read,
+    MI_REAL32: MI_Real32.read,
+    MI_REAL64: MI_Real64.read,
+    MI_CHAR16: MI_Char16.read,
+    MI_DATETIME: MI_Datetime.read,
+    MI_STRING: MI_String.read,
+    MI_INSTANCE: MI_Instance.read,
+    MI_BOOLEANA: MI_BooleanA.read,
+    MI_UINT8A: MI_Uint8A.read,
+    MI_SINT8A: MI_Sint8A.read,
+    MI_UINT16A: MI_Uint16A.read,
+    MI_SINT16A: MI_Sint16A.read,
+    MI_UINT32A: MI_Uint32A.read,
+    MI_SINT32A: MI_Sint32A.read,
+    MI_UINT64A: MI_Uint64A.read,
+    MI_SINT64A: MI_Sint64A.read,
+    MI_REAL32A: MI_Real32A.read,
+    MI_REAL64A: MI_Real64A.read,
+    MI_CHAR16A: MI_Char16A.read,
+    MI_DATETIMEA: MI_DatetimeA.read,
+    MI_STRINGA: MI_StringA.read,
+    MI_INSTANCEA: MI_InstanceA.read,
+}
@@ -0,0 +1,365 @@
+#============================================================================
+# Copyright (c) Microsoft Corporation. All rights reserved. See license.txt for license information.
+#============================================================================
+"""
+Conditional downloads of remote files for nxFile.
+
+RemoteCache keeps the body last downloaded from each URL, with the
+validators the server sent for it (ETag, Last-Modified, Content-Length)
+and its md5, in a directory of its own.  fetch asks the server for the
+URL with If-None-Match and If-Modified-Since and keeps the cached body
+on 304 Not Modified.  A download that was cut short is resumed with
+Range and If-Range, so it starts over only if the file changed.  head
+asks the same way for the validators alone and leaves the body unread.
+
+Requests go through a ConnectionPool, which keeps one HTTP/1.1
+connection alive per scheme, host and port, so resources that point at
+the same server share it, also when this module is loaded again.
+Proxies are taken from the environment, as SetProxyFromConf leaves
+them, like urllib does, with the Basic credentials of the proxy URL.
+Python 3 only.
+"""
+import base64
+import hashlib
+import http.client
+import json
+import os
+import ssl
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+BLOCK_SIZE = 1048576
+MAX_REDIRECTS = 5
+TIMEOUT = 60
+
+
+def proxy_headers(p):
+    """
+    The Proxy-Authorization header for the user and password of the
+    split proxy URL 'p', as urllib's ProxyHandler sends it; {} if it has
+    none.
+    """
+    if p.username is None:
+        return {}
+    user_pass = urllib.parse.unquote(p.username) + ':' + urllib.parse.unquote(p.password or '')
+    return {'Proxy-Authorization': 'Basic ' + base64.b64encode(user_pass.encode()).decode('ascii')}
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive connections by (scheme, host, port).
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.connections = {}
+        self.context = ssl.create_default_context()
+        self.opened = 0
+
+    def connect(self, scheme, host, port):
+        proxy = None
+        headers = {}
+        if not urllib.request.proxy_bypass(host):
+            proxy = urllib.request.getproxies().get(scheme)
+        if proxy:
+            if '://' not in proxy:
+                proxy = 'http://' + proxy
+            p = urllib.parse.urlsplit(proxy)
+            headers = proxy_headers(p)
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(p.hostname, p.port or 443, timeout=self.timeout, context=self.context)
+                conn.set_tunnel(host, port, headers=headers)
+            else:
+                conn = http.client.HTTPConnection(p.hostname, p.port or 80, timeout=self.timeout)
+        elif scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        conn.proxied = proxy is not None and scheme == 'http'
+        # sent with each request to an http proxy, https has them on CONNECT
+        conn.proxy_headers = conn.proxied and headers or {}
+        self.opened += 1
+        return conn
+
+    def get(self, url, headers):
+        """
+        Sends a GET for 'url' and returns the response, which must be read
+        to its end before the next request.  A kept connection the server
+        has closed in the meantime is replaced once.
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise urllib.error.URLError('unsupported scheme ' + parts.scheme)
+        key, port = self.key(parts)
+        for attempt in (0, 1):
+            conn = self.connections.pop(key, None)
+            reused = conn is not None
+            if conn is None:
+                conn = self.connect(parts.scheme, parts.hostname, port)
+            target = parts.path or '/'
+            if parts.query:
+                target += '?' + parts.query
+            if conn.proxied:
+                target = url
+            try:
+                conn.request('GET', target, headers=dict(headers, **conn.proxy_headers))
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError) as error:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise urllib.error.URLError(error)
+            if not resp.will_close:
+                self.connections[key] = conn
+            return resp
+
+    def key(self, parts):
+        port = parts.port or (parts.scheme == 'https' and 443 or 80)
+        return (parts.scheme, parts.hostname, port), port
+
+    def discard(self, url):
+        """
+        Closes the kept connection to the server of 'url', whose last
+        response was not read to its end.
+        """
+        conn = self.connections.pop(self.key(urllib.parse.urlsplit(url))[0], None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        while self.connections:
+            self.connections.popitem()[1].close()
+
+
+# Connections shared by every RemoteCache, kept when this module is
+# loaded again.
+try:
+    Connections
+except NameError:
+    Connections = ConnectionPool()
+
+
+class RemoteCache(object):
+    """
+    Bodies of remote files in 'directory', one set of files per URL:
+    <key>.body, the last complete download; <key>.json, its validators
+    and md5; <key>.part and <key>.part.json, a download in progress.
+    """
+
+    def __init__(self, directory, pool=None):
+        self.directory = directory
+        self.pool = pool or Connections
+        self.hits = 0
+        self.downloads = 0
+        self.resumed = 0
+
+    def paths(self, url):
+        key = os.path.join(self.directory, hashlib.sha1(url.encode('utf8')).hexdigest())
+        return key + '.body', key + '.json', key + '.part', key + '.part.json'
+
+    def load(self, path, url):
+        try:
+            F = open(path)
+            try:
+                meta = json.load(F)
+            finally:
+                F.close()
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta
+
+    def store(self, path, meta):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.meta')
+        try:
+            F = os.fdopen(fd, 'w')
+            try:
+                json.dump(meta, F)
+            finally:
+                F.close()
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+
+    def cached(self, url):
+        """
+        Returns (body path, meta) of the cached copy of 'url', or None.
+        """
+        body, meta_path, part, part_meta = self.paths(url)
+        meta = self.load(meta_path, url)
+        if meta is None or not os.path.isfile(body):
+            return None
+        return body, meta
+
+    def fetch(self, url):
+        """
+        Returns (path, meta) of a local copy of 'url' that is current
+        with the server; meta holds 'etag', 'last_modified', 'length' and
+        'md5'.  Raises urllib.error.HTTPError for error statuses and
+        urllib.error.URLError when the server cannot be reached or the
+        download is cut short, which the next fetch resumes.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        body, meta_path, part, part_meta_path = self.paths(url)
+        cached = self.cached(url)
+        headers = conditional_headers(cached)
+        offset = 0
+        part_meta = self.load(part_meta_path, url)
+        if part_meta is not None and os.path.isfile(part):
+            validator = part_meta.get('etag') or part_meta.get('last_modified')
+            offset = os.path.getsize(part)
+            if validator and offset:
+                headers['Range'] = 'bytes=%d-' % offset
+                headers['If-Range'] = validator
+            else:
+                offset = 0
+
+        resp, location = self.get(url, headers)
+        try:
+            if resp.status == 304 and cached is not None:
+                resp.read()
+                self.hits += 1
+                return cached
+            if resp.status == 206 and offset and content_range_start(resp) == offset:
+                self.resumed += 1
+                meta = part_meta
+                mode = 'ab'
+            elif resp.status == 200:
+                offset = 0
+                meta = response_meta(url, resp)
+                self.store(part_meta_path, meta)
+                mode = 'wb'
+            elif resp.status == 206:
+                # not the range asked for, start over next time
+                resp.read()
+                os.remove(part_meta_path)
+                raise urllib.error.URLError('unexpected Content-Range from ' + url)
+            else:
+                resp.read()
+                raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.msg, None)
+            self.downloads += 1
+            self.receive(resp, part, mode, url)
+        finally:
+            resp.close()
+
+        size = os.path.getsize(part)
+        if meta.get('length') is not None and size < meta['length']:
+            raise urllib.error.URLError('download of ' + url + ' stopped at ' + str(size) + ' of ' + str(meta['length']) + ' bytes')
+        meta['length'] = size
+        meta['md5'] = file_md5(part)
+        os.rename(part, body)
+        self.store(meta_path, meta)
+        os.remove(part_meta_path)
+        return body, meta
+
+    def head(self, url):
+        """
+        Returns the meta of 'url' as the server has it now, less the md5,
+        without downloading it: that of the cached copy on 304 Not
+        Modified, else that of the headers of a GET whose body is left
+        unread.  A GET rather than a HEAD, which servers that sign their
+        URLs for one method refuse.  Raises as fetch does.
+        """
+        cached = self.cached(url)
+        resp, location = self.get(url, conditional_headers(cached))
+        try:
+            if resp.status == 304 and cached is not None:
+                resp.read()
+                self.hits += 1
+                return cached[1]
+            if resp.status != 200:
+                resp.read()
+                raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.msg, None)
+            meta = response_meta(url, resp)
+        finally:
+            resp.close()
+        self.pool.discard(location)
+        return meta
+
+    def get(self, url, headers):
+        """
+        Sends a GET for 'url', following redirects, and returns the
+        response and the URL it came from.
+        """
+        location = url
+        for redirect in range(MAX_REDIRECTS + 1):
+            resp = self.pool.get(location, headers)
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader('Location'):
+                resp.read()
+                location = urllib.parse.urljoin(location, resp.getheader('Location'))
+                continue
+            break
+        return resp, location
+
+    def receive(self, resp, part, mode, url):
+        F = open(part, mode)
+        try:
+            while True:
+                try:
+                    data = resp.read(BLOCK_SIZE)
+                except (http.client.HTTPException, OSError) as error:
+                    raise urllib.error.URLError(error)
+                if not data:
+                    break
+                F.write(data)
+        finally:
+            F.close()
+
+
+def conditional_headers(cached):
+    """
+    The headers of a GET that the server answers with 304 Not Modified
+    if the (path, meta) 'cached' copy is current.
+    """
+    headers = {'Accept-Encoding': 'identity'}
+    if cached is not None:
+        if cached[1].get('etag'):
+            headers['If-None-Match'] = cached[1]['etag']
+        if cached[1].get('last_modified'):
+            headers['If-Modified-Since'] = cached[1]['last_modified']
+    return headers
+
+
+def response_meta(url, resp):
+    """
+    The meta of the 200 response 'resp' for 'url', before its body is
+    read.
+    """
+    meta = {'url': url,
+            'etag': resp.getheader('ETag'),
+            'last_modified': resp.getheader('Last-Modified'),
+            'length': None}
+    length = resp.getheader('Content-Length')
+    if length is not None and length.isdigit():
+        meta['length'] = int(length)
+    return meta
+
+
+def content_range_start(resp):
+    """
+    The first byte of a 206 response, from 'Content-Range: bytes a-b/n'.
+    """
+    value = resp.getheader('Content-Range') or ''
+    try:
+        return int(value.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def file_md5(path):
+    h = hashlib.md5()
+    F = open(path, 'rb')
+    try:
+        while True:
+            data = F.read(BLOCK_SIZE)
+            if not data:
+                break
+            h.update(data)
+    finally:
+        F.close()
+    return h.hexdigest()